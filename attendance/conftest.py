@@ -1,5 +1,15 @@
+import functools
+
 import pytest
+from django.core.cache import cache
+from django.utils import timezone
+from rest_framework.test import APIClient
 
+from attendance.core.faces import COMPARE, RekognitionFaceComparator
+from attendance.core.management.commands.process_sqs_msg import FaceRecognitionProcessor
+from attendance.core.models import Attendance, Session
+from attendance.core.tests.factories import AttendanceFactory, CourseFactory, SessionFactory, StudentFactory
+from attendance.core.tests.fake_aws import FakeSession, FakeSQS
 from attendance.users.models import User
 from attendance.users.tests.factories import UserFactory
 
@@ -9,6 +19,90 @@ def media_storage(settings, tmpdir):
     settings.MEDIA_ROOT = tmpdir.strpath
 
 
+@pytest.fixture(autouse=True)
+def clear_cache():
+    yield
+    cache.clear()
+
+
 @pytest.fixture
 def user(db) -> User:
     return UserFactory()
+
+
+@pytest.fixture
+def api_client() -> APIClient:
+    return APIClient()
+
+
+@pytest.fixture
+def student(db) -> User:
+    return StudentFactory()
+
+
+@pytest.fixture
+def session(db) -> Session:
+    return SessionFactory()
+
+
+@pytest.fixture
+def teacher_client(api_client, session) -> APIClient:
+    api_client.force_authenticate(session.course_id.teacher_id)
+    return api_client
+
+
+@pytest.fixture
+def student_client(api_client, student) -> APIClient:
+    api_client.force_authenticate(student)
+    return api_client
+
+
+@pytest.fixture
+def attendances(session) -> list[Attendance]:
+    """Check-ins of every face recognition status in two sessions of the course, one of them geofenced."""
+    geofenced = SessionFactory(
+        course_id=session.course_id,
+        location_enabled=True,
+        longitude=-81.2003,
+        latitude=28.6024,
+        radius=0.00001,
+        geofence={"type": "Polygon", "coordinates": [[[0, 0], [1e-05, 0], [1, 1], [0, 0]]]},
+        end_time=timezone.now(),
+    )
+    # Another course of the teacher's, without sessions
+    CourseFactory(teacher_id=session.course_id.teacher_id)
+    statuses = list(Attendance.FaceRecognitionStatus)
+    return [
+        AttendanceFactory(
+            session_id=(session, geofenced)[i % 2],
+            student_id=StudentFactory(name=("", "Zoë 😀", 'O"Brien\\')[i % 3]),
+            face_recognition_status=statuses[i % len(statuses)],
+            is_present=bool(i % 2),
+        )
+        for i in range(8)
+    ]
+
+
+@pytest.fixture
+def processor_for():
+    """Build a FaceRecognitionProcessor on fake AWS clients, returning it with their session factory."""
+
+    def build(
+        sqs: FakeSQS,
+        concurrency: int,
+        visibility_timeout: int = 30,
+        mode: str = COMPARE,
+        comparator_class=None,
+        **clients,
+    ) -> tuple[FaceRecognitionProcessor, FakeSession]:
+        session_factory = FakeSession(sqs, **clients)
+        processor = FaceRecognitionProcessor(
+            concurrency=concurrency,
+            wait_time=0,
+            visibility_timeout=visibility_timeout,
+            comparator_class=comparator_class or functools.partial(RekognitionFaceComparator, mode=mode),
+            session_factory=session_factory,
+        )
+        return processor, session_factory
+
+    return build
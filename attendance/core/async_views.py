@@ -0,0 +1,185 @@
+"""
+Async views for the ASGI deployment.
+
+With ``ATTENDANCE_ASYNC_VIEWS`` enabled and the app served from ``config.asgi``,
+the endpoints a whole lecture hits at once are routed here instead of to the DRF
+views: check-in, the teacher's secret refresh and the face recognition status
+students poll after uploading their picture. DRF views can't be async, so these
+are plain Django views that authenticate, render and report errors the way the
+DRF views do, while waiting on the cache and the database without holding a
+worker.
+"""
+
+import logging
+from collections.abc import Callable
+from functools import wraps
+from io import BytesIO
+from typing import cast
+
+from asgiref.sync import sync_to_async
+from dj_rest_auth.app_settings import api_settings as rest_auth_settings
+from dj_rest_auth.jwt_auth import JWTCookieAuthentication
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import exceptions
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+from attendance.users.permissions import IsStudent, IsTeacher
+
+from .checkin import acheck_in
+from .models import SESSION_CACHE_KEY, Attendance, Session
+from .parsers import ORJSONParser
+from .renderers import ORJSONRenderer
+from .views import AttendanceListCreateAPIView, face_status_queryset
+
+LOGGER = logging.getLogger(__name__)
+
+
+class AsyncJWTCookieAuthentication(JWTCookieAuthentication):
+    async def aauthenticate(self, request):
+        # JWTCookieAuthentication.authenticate with the user lookup awaited
+        header = self.get_header(request)
+        if header is None:
+            if not rest_auth_settings.JWT_AUTH_COOKIE:
+                return None
+            raw_token = request.COOKIES.get(rest_auth_settings.JWT_AUTH_COOKIE)
+            if rest_auth_settings.JWT_AUTH_COOKIE_ENFORCE_CSRF_ON_UNAUTHENTICATED:
+                self.enforce_csrf(request)
+            elif raw_token is not None and rest_auth_settings.JWT_AUTH_COOKIE_USE_CSRF:
+                self.enforce_csrf(request)
+        else:
+            raw_token = self.get_raw_token(header)
+
+        if raw_token is None:
+            return None
+
+        validated_token = self.get_validated_token(raw_token)
+        return await self.aget_user(validated_token), validated_token
+
+    async def aget_user(self, validated_token):
+        try:
+            user_id = validated_token[jwt_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken("Token contained no recognizable user identification")
+
+        try:
+            user = await self.user_model.objects.aget(**{jwt_settings.USER_ID_FIELD: user_id})
+        except self.user_model.DoesNotExist:
+            raise AuthenticationFailed("User not found", code="user_not_found")
+
+        if jwt_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed("User is inactive", code="user_inactive")
+
+        if jwt_settings.CHECK_REVOKE_TOKEN:
+            if validated_token.get(jwt_settings.REVOKE_TOKEN_CLAIM) != get_md5_hash_password(user.password):
+                raise AuthenticationFailed("The user's password has been changed.", code="password_changed")
+
+        return user
+
+
+def render(data, status: int, headers: dict | None = None) -> HttpResponse:
+    return HttpResponse(ORJSONRenderer().render(data), status=status, headers=headers, content_type="application/json")
+
+
+def request_data(request):
+    if request.content_type != "application/json":
+        return request.POST
+
+    data = ORJSONParser().parse(BytesIO(request.body))
+    if not isinstance(data, dict):
+        raise exceptions.ParseError("JSON parse error - Expected an object.")
+    return data
+
+
+def handle_exception(exc: Exception, request, authenticator: AsyncJWTCookieAuthentication) -> HttpResponse:
+    """APIView.handle_exception, rendered through the project's EXCEPTION_HANDLER."""
+    if isinstance(exc, exceptions.NotAuthenticated | exceptions.AuthenticationFailed):
+        if auth_header := authenticator.authenticate_header(request):
+            # Read back with getattr by the exception handler for the WWW-Authenticate header
+            setattr(exc, "auth_header", auth_header)
+        else:
+            exc.status_code = 403
+
+    # api_settings imports the handler, the stubs type it as the dotted path
+    exception_handler = cast(Callable[[Exception, dict], Response | None], api_settings.EXCEPTION_HANDLER)
+    response = exception_handler(exc, {"request": request})
+    if response is None:
+        # The sync views would let Django render its HTML error page
+        LOGGER.exception(f"Unhandled error in {request.path}", exc_info=exc)
+        return render({"detail": "A server error occurred."}, 500)
+    headers = {header: value for header, value in response.items() if header != "Content-Type"}
+    return render(response.data, response.status_code, headers)
+
+
+def async_api_view(methods: tuple[str, ...], permission_class, status: int = 200):
+    """Run an async view with the authentication, permission and error handling of an APIView."""
+
+    def decorator(view):
+        @csrf_exempt
+        @transaction.non_atomic_requests
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            authenticator = AsyncJWTCookieAuthentication()
+            try:
+                if request.method not in methods:
+                    raise exceptions.MethodNotAllowed(request.method)
+                user_auth = await authenticator.aauthenticate(request)
+                if user_auth is None:
+                    raise exceptions.NotAuthenticated()
+                request.user, request.auth = user_auth
+                if not permission_class().has_permission(request, None):
+                    raise exceptions.PermissionDenied()
+
+                return render(await view(request, *args, **kwargs), status)
+            except Exception as exc:
+                return handle_exception(exc, request, authenticator)
+
+        return wrapper
+
+    return decorator
+
+
+@async_api_view(("POST",), IsStudent, status=201)
+async def check_in(request):
+    return await acheck_in(request.user, request_data(request))
+
+
+sync_attendance_list_create = AttendanceListCreateAPIView.as_view()
+
+
+@csrf_exempt
+@transaction.non_atomic_requests
+async def attendance_list_create(request, *args, **kwargs):
+    if request.method == "POST" and settings.ATTENDANCE_CHECKIN_FAST_PATH:
+        return await check_in(request)
+    # Listing and the legacy check-in stay on DRF
+    return await sync_to_async(sync_attendance_list_create)(request, *args, **kwargs)
+
+
+@async_api_view(("POST",), IsTeacher)
+async def session_get_secret(request, pk: int):
+    if session_data := await cache.aget(SESSION_CACHE_KEY.format(teacher_id=request.user.id, session_id=pk)):
+        return {"secret": session_data["secret"]}
+
+    try:
+        session = await Session.objects.select_related("course_id__teacher_id").aget(
+            pk=pk, course_id__teacher_id=request.user
+        )
+    except Session.DoesNotExist:
+        raise exceptions.NotFound("No Session matches the given query.")
+    return {"secret": await session.agenerate_secret()}
+
+
+@async_api_view(("GET",), IsTeacher | IsStudent)
+async def attendance_face_status(request, pk: int):
+    try:
+        return await face_status_queryset(request.user).aget(pk=pk)
+    except Attendance.DoesNotExist:
+        raise exceptions.NotFound("No Attendance matches the given query.")
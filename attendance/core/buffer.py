@@ -0,0 +1,316 @@
+"""
+Write-behind buffer for check-ins.
+
+With ``ATTENDANCE_CHECKIN_WRITE_BEHIND`` enabled, check-ins that don't need face
+recognition are appended to a Redis stream instead of being inserted right away,
+and ``manage.py flush_checkins`` drains the stream into Postgres in batches,
+counting the check-ins it inserts in attendance.core.counters.
+Until a check-in is flushed it is also kept in a per-student hash so the
+student's own attendance list can still show it: in place in the whole list, or
+under "pending" on the first page of a paginated one.
+
+Entries that can't be inserted, or that keep failing past ``max_deliveries``, are
+moved to a dead-letter stream so they don't hold up the check-ins queued after
+them. Entries a flusher read but never acknowledged, e.g. because its task was
+replaced, are claimed by the other flushers once they have been idle for a while.
+"""
+
+import json
+import logging
+import time
+from collections import Counter
+from datetime import datetime
+
+from django.db import DataError, IntegrityError, connection, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django_redis import get_redis_connection
+
+from attendance.users.models import User
+
+from .counters import PRESENT, count_check_in
+from .models import SESSION_CACHE_TIMEOUT, Attendance, Session
+
+LOGGER = logging.getLogger(__name__)
+
+STREAM_KEY = "checkin:stream"
+GROUP_NAME = "flushers"
+PENDING_KEY = "checkin:pending:student:{student_id}"
+STATS_KEY = "checkin:flush:stats"
+DEAD_LETTER_KEY = "checkin:dead"
+
+# Sets the pending marker and queues the entry in one step, so a failed XADD can't leave
+# a marker that rejects the student's retries without a check-in ever being written.
+# KEYS: pending hash, stream. ARGV: session id, created at, marker TTL, then the entry's fields.
+BUFFER_SCRIPT = """
+if redis.call("HSETNX", KEYS[1], ARGV[1], ARGV[2]) == 0 then
+    return 0
+end
+redis.call("EXPIRE", KEYS[1], ARGV[3])
+redis.call("XADD", KEYS[2], "*", unpack(ARGV, 4))
+return 1
+"""
+
+# Rows that already exist are skipped, only the inserted ones come back to be counted
+INSERT_SQL = """
+    INSERT INTO {table}
+        (session_id_id, student_id_id, created_at, is_present, face_recognition_status, longitude, latitude)
+    VALUES {values}
+    ON CONFLICT (session_id_id, student_id_id) DO NOTHING
+    RETURNING session_id_id
+"""
+
+
+def buffer_check_in(
+    session_id: int, student, longitude: float | None = None, latitude: float | None = None
+) -> dict | None:
+    """Queue a check-in for the flusher, returning None if the student already has one pending."""
+    created_at = timezone.now()
+    redis = get_redis_connection("default")
+    pending_key = PENDING_KEY.format(student_id=student.id)
+
+    fields = {"session_id": session_id, "student_id": student.id, "created_at": created_at.isoformat()}
+    if longitude is not None and latitude is not None:
+        fields.update(longitude=longitude, latitude=latitude)
+    args = [session_id, created_at.isoformat(), SESSION_CACHE_TIMEOUT]
+    for field, value in fields.items():
+        args += [field, value]
+    is_new = redis.register_script(BUFFER_SCRIPT)(keys=[pending_key, STREAM_KEY], args=args)
+    if not is_new:
+        return None
+
+    return {
+        "id": None,
+        "session_id": int(session_id),
+        "student_id": student.id,
+        "created_at": created_at,
+        "face_recognition_status": Attendance.FaceRecognitionStatus.NOT_REQUIRED,
+        "is_present": True,
+    }
+
+
+def pending_check_ins(student, session_id: int | str | None = None) -> list[Attendance]:
+    """Unsaved Attendance objects for the student's check-ins that haven't been flushed yet."""
+    pending = get_redis_connection("default").hgetall(PENDING_KEY.format(student_id=student.id))
+    if not pending:
+        return []
+
+    created_at = {int(key): datetime.fromisoformat(value.decode()) for key, value in pending.items()}
+    if session_id is not None:
+        created_at = {key: value for key, value in created_at.items() if key == int(session_id)}
+
+    sessions = Session.objects.select_related("course_id").filter(id__in=created_at)
+    return sorted(
+        (
+            Attendance(
+                session_id=session,
+                student_id=student,
+                created_at=created_at[session.id],
+                is_present=True,
+                face_recognition_status=Attendance.FaceRecognitionStatus.NOT_REQUIRED,
+            )
+            for session in sessions
+        ),
+        key=lambda attendance: attendance.created_at,
+        reverse=True,
+    )
+
+
+def flush_stats() -> dict:
+    redis = get_redis_connection("default")
+    pipeline = redis.pipeline()
+    pipeline.hgetall(STATS_KEY)
+    pipeline.xlen(STREAM_KEY)
+    stats, backlog = pipeline.execute()
+    return {**{key.decode(): json.loads(value) for key, value in stats.items()}, "backlog": backlog}
+
+
+class CheckInFlusher:
+    def __init__(
+        self,
+        consumer_name: str,
+        batch_size: int = 500,
+        block_ms: int = 1000,
+        claim_idle_ms: int = 60_000,
+        max_deliveries: int = 5,
+    ):
+        self.redis = get_redis_connection("default")
+        self.consumer_name = consumer_name
+        self.batch_size = batch_size
+        self.block_ms = block_ms
+        self.claim_idle_ms = claim_idle_ms
+        self.max_deliveries = max_deliveries
+        self.create_group()
+
+    def create_group(self) -> None:
+        try:
+            self.redis.xgroup_create(STREAM_KEY, GROUP_NAME, id="0", mkstream=True)
+        except Exception as e:
+            # BUSYGROUP: another flusher already created it
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    def read_batch(self, stream_id: str) -> list[tuple[bytes, dict]]:
+        response = self.redis.xreadgroup(
+            GROUP_NAME,
+            self.consumer_name,
+            {STREAM_KEY: stream_id},
+            count=self.batch_size,
+            block=None if stream_id == "0" else self.block_ms,
+        )
+        return response[0][1] if response else []
+
+    def claim_idle(self) -> int:
+        """Take over entries other flushers read but haven't acknowledged for claim_idle_ms."""
+        claimed, start_id = 0, b"0-0"
+        while True:
+            start_id, entries, *_ = self.redis.xautoclaim(
+                STREAM_KEY,
+                GROUP_NAME,
+                self.consumer_name,
+                self.claim_idle_ms,
+                start_id=start_id,
+                count=self.batch_size,
+            )
+            claimed += len(entries)
+            if start_id in (b"0-0", "0-0"):
+                if claimed:
+                    LOGGER.warning(f"Claimed {claimed} idle check-ins")
+                return claimed
+
+    def drop_exhausted(self, entries: list[tuple[bytes, dict]]) -> list[tuple[bytes, dict]]:
+        """Dead-letter entries delivered more than max_deliveries times, returning the others."""
+        pending = self.redis.xpending_range(
+            STREAM_KEY, GROUP_NAME, entries[0][0], entries[-1][0], len(entries), consumername=self.consumer_name
+        )
+        deliveries = {entry["message_id"]: entry["times_delivered"] for entry in pending}
+        exhausted = [entry for entry in entries if deliveries.get(entry[0], 0) > self.max_deliveries]
+        if exhausted:
+            pipeline = self.redis.pipeline()
+            for entry_id, fields in exhausted:
+                self.dead_letter(pipeline, entry_id, fields, f"Delivered {deliveries[entry_id]} times")
+            pipeline.execute()
+        return [entry for entry in entries if deliveries.get(entry[0], 0) <= self.max_deliveries]
+
+    def dead_letter(self, pipeline, entry_id: bytes, fields: dict | None, error: str) -> None:
+        LOGGER.error(f"Dead-lettering check-in {entry_id!r} - fields: {fields}, error: {error}")
+        if fields is not None:
+            pipeline.xadd(DEAD_LETTER_KEY, {**fields, b"entry_id": entry_id, b"error": error})
+            pipeline.hdel(PENDING_KEY.format(student_id=int(fields[b"student_id"])), int(fields[b"session_id"]))
+        pipeline.xack(STREAM_KEY, GROUP_NAME, entry_id)
+        pipeline.xdel(STREAM_KEY, entry_id)
+        pipeline.hincrby(STATS_KEY, "dead_lettered_total", 1)
+
+    def insert(self, cursor, rows: list[tuple]) -> list[int]:
+        """Insert (entry id, session id, student id, created at, longitude, latitude) rows, returning the
+        session ids of the ones that didn't exist yet."""
+        cursor.execute(
+            INSERT_SQL.format(
+                table=connection.ops.quote_name(Attendance._meta.db_table),
+                values=", ".join(["(%s, %s, %s, %s, %s, %s, %s)"] * len(rows)),
+            ),
+            [
+                value
+                for _, session_id, student_id, created_at, longitude, latitude in rows
+                for value in (
+                    session_id,
+                    student_id,
+                    created_at,
+                    True,
+                    Attendance.FaceRecognitionStatus.NOT_REQUIRED,
+                    longitude,
+                    latitude,
+                )
+            ],
+        )
+        return [session_id for (session_id,) in cursor.fetchall()]
+
+    def flush(self, entries: list[tuple[bytes, dict]]) -> int:
+        # Entries deleted from the stream while still pending come back with no fields
+        fields_by_id = dict(entries)
+        check_ins = [
+            (
+                entry_id,
+                int(fields[b"session_id"]),
+                int(fields[b"student_id"]),
+                # Entries queued before created_at was carried in the stream are stamped now
+                parse_datetime(fields[b"created_at"].decode()) if b"created_at" in fields else timezone.now(),
+                float(fields[b"longitude"]) if b"longitude" in fields else None,
+                float(fields[b"latitude"]) if b"latitude" in fields else None,
+            )
+            for entry_id, fields in entries
+            if fields is not None
+        ]
+        session_ids = set(
+            Session.objects.filter(id__in={check_in[1] for check_in in check_ins}).values_list("id", flat=True)
+        )
+        student_ids = set(
+            User.objects.filter(id__in={check_in[2] for check_in in check_ins}).values_list("id", flat=True)
+        )
+        for _, session_id, student_id, *_ in check_ins:
+            if session_id not in session_ids:
+                LOGGER.warning(f"Dropping check-in for deleted session - session: {session_id}, student: {student_id}")
+            elif student_id not in student_ids:
+                LOGGER.warning(f"Dropping check-in for deleted student - session: {session_id}, student: {student_id}")
+
+        rows = [check_in for check_in in check_ins if check_in[1] in session_ids and check_in[2] in student_ids]
+        inserted: Counter[int] = Counter()
+        failed = []
+        with transaction.atomic(), connection.cursor() as cursor:
+            for start in range(0, len(rows), self.batch_size):
+                batch = rows[start : start + self.batch_size]
+                try:
+                    with transaction.atomic():
+                        inserted.update(self.insert(cursor, batch))
+                except (DataError, IntegrityError):
+                    # One bad row fails the whole statement, so retry the batch row by row to set it aside
+                    for row in batch:
+                        try:
+                            with transaction.atomic():
+                                inserted.update(self.insert(cursor, [row]))
+                        except (DataError, IntegrityError) as e:
+                            failed.append((row[0], str(e)))
+            # Students who checked in some other way already were counted then
+            for session_id, count in inserted.items():
+                count_check_in(session_id, PRESENT, count)
+
+        # Stream ids start with the millisecond timestamp of the XADD
+        entry_ids = [entry_id for entry_id, _ in entries]
+        lag_ms = int(time.time() * 1000) - int(entry_ids[0].split(b"-")[0])
+
+        pipeline = self.redis.pipeline()
+        for entry_id, error in failed:
+            self.dead_letter(pipeline, entry_id, fields_by_id[entry_id], error)
+        pipeline.xack(STREAM_KEY, GROUP_NAME, *entry_ids)
+        pipeline.xdel(STREAM_KEY, *entry_ids)
+        for _, session_id, student_id, *_ in check_ins:
+            pipeline.hdel(PENDING_KEY.format(student_id=student_id), session_id)
+        pipeline.hset(STATS_KEY, mapping={"last_batch_size": len(entries), "last_lag_ms": lag_ms})
+        pipeline.hincrby(STATS_KEY, "flushed_total", len(entries) - len(failed))
+        pipeline.execute()
+
+        LOGGER.info(f"Flushed {len(entries) - len(failed)} check-ins, lag: {lag_ms} ms")
+        return len(entries) - len(failed)
+
+    def run(self):
+        # Start with entries this consumer read but never acknowledged, e.g. before a crash
+        stream_id = "0"
+        next_claim = 0.0
+        while True:
+            try:
+                if time.monotonic() >= next_claim:
+                    if self.claim_idle():
+                        stream_id = "0"
+                    next_claim = time.monotonic() + self.claim_idle_ms / 1000
+                if not (entries := self.read_batch(stream_id)):
+                    stream_id = ">"
+                    continue
+                # Entries read again after a failure are dead-lettered once they have been retried enough
+                if stream_id == "0":
+                    entries = self.drop_exhausted(entries)
+                if entries:
+                    self.flush(entries)
+            except Exception as e:
+                LOGGER.error(f"Error in flush loop: {e}")
+                stream_id = "0"
+                time.sleep(5)  # Prevent tight loop on persistent errors
@@ -0,0 +1,336 @@
+"""
+Check-in pipeline for ``POST /api/v1/attendance/``.
+
+A whole lecture checks in within the same few seconds, so this path makes a
+single cache round trip to fetch the session data and returns a flat response
+instead of going through the nested serializers. The token's payload is read
+unverified only to find the session, then PyJWT verifies it with the session's
+secret as AttendanceCreateSerializer does.
+"""
+
+import math
+import time
+from typing import Any, NoReturn
+
+import jwt
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.utils import timezone
+from rest_framework import serializers
+from rest_framework.settings import api_settings
+
+from . import metrics
+from .buffer import buffer_check_in
+from .counters import count_check_in, state_of
+from .geofence import build_geometry, contains
+from .models import SESSION_CACHE_KEY, SESSION_CACHE_TIMEOUT, Attendance, get_face_image_path
+from .s3 import generate_presigned_url
+
+# Set once a student is marked present, so retries are rejected without touching Postgres
+CHECKED_IN_KEY = "session:{session_id}:checked_in:{student_id}"
+
+
+def reject(message: str, field: str | None = None) -> NoReturn:
+    raise serializers.ValidationError({field or api_settings.NON_FIELD_ERRORS_KEY: [message]})
+
+
+def parse_token(token: str) -> dict[str, Any]:
+    """Read a check-in token's payload without verifying it, only to find its session."""
+    try:
+        payload = jwt.decode(token, options={"verify_signature": False})
+    except jwt.InvalidTokenError:
+        reject("Invalid token.")
+    if not isinstance(payload, dict):
+        reject("Invalid token.")
+    return payload
+
+
+def verify_token(token: str, secret: str) -> None:
+    try:
+        jwt.decode(token, secret, algorithms=["HS256"])
+    except jwt.InvalidSignatureError:
+        reject("Invalid signature.")
+    except jwt.ExpiredSignatureError:
+        reject("Token expired.")
+    except jwt.InvalidTokenError:
+        reject("Invalid token.")
+
+
+def checked_in_timeout(expires_at: float | None) -> int:
+    # Expire with the session's cache entry when we know when that is
+    return max(1, int(expires_at - time.time())) if expires_at else SESSION_CACHE_TIMEOUT
+
+
+def mark_checked_in(session_id: int, student_id: int, expires_at: float | None = None) -> None:
+    key = CHECKED_IN_KEY.format(session_id=session_id, student_id=student_id)
+    cache.set(key, True, timeout=checked_in_timeout(expires_at))
+
+
+def mark_checked_in_many(check_ins: list[tuple[int, int, int]]) -> None:
+    """
+    Mark (teacher id, session id, student id) check-ins made present outside the
+    check-in path, until their session's cache entry expires. Sessions that are no
+    longer cached reject check-ins already, so they aren't marked.
+    """
+    keys = {
+        (teacher_id, session_id): SESSION_CACHE_KEY.format(teacher_id=teacher_id, session_id=session_id)
+        for teacher_id, session_id, _ in check_ins
+    }
+    if not keys:
+        return
+    cached = cache.get_many(list(keys.values()))
+    for teacher_id, session_id, student_id in check_ins:
+        if session_data := cached.get(keys[teacher_id, session_id]):
+            mark_checked_in(session_id, student_id, session_data.get("expires_at"))
+
+
+async def amark_checked_in(session_id: int, student_id: int, expires_at: float | None = None) -> None:
+    key = CHECKED_IN_KEY.format(session_id=session_id, student_id=student_id)
+    await cache.aset(key, True, timeout=checked_in_timeout(expires_at))
+
+
+class DuplicateCheckIn(serializers.ValidationError):
+    pass
+
+
+def read_token(token: str, student_id: int | None = None) -> tuple[dict[str, Any], list[str]]:
+    """Read a check-in token's payload, returning it with the cache keys that validating it needs."""
+    payload = parse_token(token)
+    session_id = payload.get("session_id", None)
+    teacher_id = payload.get("teacher_id", None)
+
+    # Early return if session id is not present
+    if not session_id or not teacher_id:
+        reject("Invalid token.")
+
+    # Get session secret and the student's check-in marker from cache in one round trip
+    keys = [SESSION_CACHE_KEY.format(teacher_id=teacher_id, session_id=session_id)]
+    if student_id:
+        keys.append(CHECKED_IN_KEY.format(session_id=session_id, student_id=student_id))
+    return payload, keys
+
+
+def check_token(
+    token: str,
+    payload: dict[str, Any],
+    keys: list[str],
+    cached: dict,
+    longitude: float | None = None,
+    latitude: float | None = None,
+) -> dict[str, Any]:
+    session_data = cached.get(keys[0])
+    if not session_data:
+        reject("Token not active for this session.")
+
+    if len(keys) > 1 and cached.get(keys[1]):
+        raise DuplicateCheckIn({api_settings.NON_FIELD_ERRORS_KEY: ["You have already checked in."]})
+
+    verify_token(token, session_data["secret"])
+
+    # Check if location is enabled
+    if session_data["location_enabled"]:
+        if not longitude or not latitude:
+            reject("Longitude and latitude are required.")
+
+        # Payloads cached before geofences existed only carry the session's point
+        geometry = session_data.get("geometry") or build_geometry(
+            session_data["latitude"], session_data["longitude"], None, None
+        )
+        if geometry is None or not contains(geometry, [latitude], [longitude])[0]:
+            reject("Location not within range.")
+
+    return {
+        "session_id": payload["session_id"],
+        "face_recognition_enabled": session_data["face_recognition_enabled"],
+        "expires_at": session_data.get("expires_at"),
+    }
+
+
+def validate_check_in(
+    token: str, longitude: float | None = None, latitude: float | None = None, student_id: int | None = None
+) -> dict[str, Any]:
+    payload, keys = read_token(token, student_id)
+    try:
+        return check_token(token, payload, keys, cache.get_many(keys), longitude, latitude)
+    except DuplicateCheckIn:
+        metrics.incr(metrics.CHECK_IN_DUPLICATES_REJECTED)
+        raise
+
+
+async def avalidate_check_in(
+    token: str, longitude: float | None = None, latitude: float | None = None, student_id: int | None = None
+) -> dict[str, Any]:
+    payload, keys = read_token(token, student_id)
+    try:
+        return check_token(token, payload, keys, await cache.aget_many(keys), longitude, latitude)
+    except DuplicateCheckIn:
+        await metrics.aincr(metrics.CHECK_IN_DUPLICATES_REJECTED)
+        raise
+
+
+# Inserts the check-in, or returns the existing row if the student is still waiting on face recognition.
+# A student who is already present gets no row back, without the row being rewritten.
+# xmax is only 0 for a row this statement inserted, not for one it locked and updated.
+UPSERT_SQL = """
+    INSERT INTO {table}
+        (session_id_id, student_id_id, created_at, is_present, face_recognition_status, longitude, latitude)
+    VALUES (%s, %s, %s, %s, %s, %s, %s)
+    ON CONFLICT (session_id_id, student_id_id) DO UPDATE SET is_present = {table}.is_present
+    WHERE NOT {table}.is_present
+    RETURNING {columns}, (xmax = 0) AS inserted
+"""
+
+
+def record_check_in(
+    session_id: int,
+    student,
+    face_recognition_enabled: bool,
+    expires_at: float | None = None,
+    longitude: float | None = None,
+    latitude: float | None = None,
+) -> Attendance:
+    default_is_present = False if face_recognition_enabled else True
+    default_face_recognition_status = (
+        Attendance.FaceRecognitionStatus.PENDING
+        if face_recognition_enabled
+        else Attendance.FaceRecognitionStatus.NOT_REQUIRED
+    )
+
+    fields = [field for field in Attendance._meta.fields if field.concrete]
+    sql = UPSERT_SQL.format(
+        table=connection.ops.quote_name(Attendance._meta.db_table),
+        columns=", ".join(connection.ops.quote_name(field.column) for field in fields),
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(
+            sql,
+            [
+                session_id,
+                student.id,
+                timezone.now(),
+                default_is_present,
+                default_face_recognition_status,
+                longitude,
+                latitude,
+            ],
+        )
+        row = cursor.fetchone()
+
+    if row is None:
+        mark_checked_in(session_id, student.id, expires_at)
+        reject("You have already checked in.")
+
+    *row, inserted = row
+    attendance_obj = Attendance.from_db(connection.alias, [field.attname for field in fields], row)
+    attendance_obj.student_id = student
+    if inserted:
+        count_check_in(session_id, state_of(attendance_obj.is_present, attendance_obj.face_recognition_status))
+    if attendance_obj.is_present:
+        mark_checked_in(session_id, student.id, expires_at)
+    return attendance_obj
+
+
+def face_image_upload_url(attendance: Attendance, student) -> str | None:
+    if "storages" not in settings.INSTALLED_APPS:
+        return None
+
+    if student.init_image:
+        path = get_face_image_path(attendance, str(attendance.id))
+    else:
+        path = get_face_image_path(attendance, f"{attendance.id}_init")
+
+    return generate_presigned_url("put_object", path, 300, ContentType="image/jpeg")
+
+
+def _float_field(data, field: str) -> float | None:
+    value = data.get(field, None)
+    if value is None or value == "":
+        return None
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        reject("A valid number is required.", field)
+    if not math.isfinite(value):
+        reject("A valid number is required.", field)
+    return value
+
+
+def read_check_in(data) -> tuple[str, float | None, float | None]:
+    token = data.get("token", None)
+    if not token or not isinstance(token, str):
+        reject("This field is required.", "token")
+    return token, _float_field(data, "longitude"), _float_field(data, "latitude")
+
+
+def check_in_response(attendance: Attendance, student) -> dict[str, Any]:
+    response = {
+        "id": attendance.id,
+        "session_id": attendance.session_id_id,
+        "student_id": student.id,
+        "created_at": attendance.created_at,
+        "face_recognition_status": attendance.face_recognition_status,
+        "is_present": attendance.is_present,
+    }
+    if attendance.face_recognition_status == Attendance.FaceRecognitionStatus.PENDING:
+        response["face_image_upload_url"] = face_image_upload_url(attendance, student)
+    return response
+
+
+def check_in(student, data) -> dict[str, Any]:
+    token, longitude, latitude = read_check_in(data)
+    check_in_data = validate_check_in(token, longitude, latitude, student_id=student.id)
+    session_id = check_in_data["session_id"]
+
+    # Without face recognition the client never needs the row id, so the insert can be deferred
+    if settings.ATTENDANCE_CHECKIN_WRITE_BEHIND and not check_in_data["face_recognition_enabled"]:
+        response = buffer_check_in(session_id, student, longitude, latitude)
+        if response is None:
+            reject("You have already checked in.")
+        mark_checked_in(session_id, student.id, check_in_data["expires_at"])
+        return response
+
+    attendance = record_check_in(
+        session_id,
+        student,
+        check_in_data["face_recognition_enabled"],
+        check_in_data["expires_at"],
+        longitude,
+        latitude,
+    )
+    return check_in_response(attendance, student)
+
+
+async def acheck_in(student, data) -> dict[str, Any]:
+    """``check_in`` for the ASGI views, the insert itself runs in a worker thread."""
+    token, longitude, latitude = read_check_in(data)
+    check_in_data = await avalidate_check_in(token, longitude, latitude, student_id=student.id)
+    session_id = check_in_data["session_id"]
+
+    if settings.ATTENDANCE_CHECKIN_WRITE_BEHIND and not check_in_data["face_recognition_enabled"]:
+        response = await sync_to_async(buffer_check_in)(session_id, student, longitude, latitude)
+        if response is None:
+            reject("You have already checked in.")
+        await amark_checked_in(session_id, student.id, check_in_data["expires_at"])
+        return response
+
+    attendance = await sync_to_async(record_check_in)(
+        session_id,
+        student,
+        check_in_data["face_recognition_enabled"],
+        check_in_data["expires_at"],
+        longitude,
+        latitude,
+    )
+    return check_in_response(attendance, student)
+
+
+def mint_token(session, expires_in: int = 30) -> str:
+    """Mint a check-in token the way the teacher's screen does, for tests and benchmarks."""
+    payload = {
+        "session_id": session.id,
+        "teacher_id": session.course_id.teacher_id.id,
+        "exp": int(time.time()) + expires_in,
+    }
+    return jwt.encode(payload, session.generate_secret(), algorithm="HS256")
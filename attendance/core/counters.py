@@ -0,0 +1,100 @@
+"""
+Live attendance counts per session.
+
+Every attendance row is in exactly one of three states: present (marked present
+or accepted by face recognition or by the teacher), pending (waiting on face
+recognition) or failed. The cache keeps one counter per state and session,
+moved on every check-in and status change once it is committed, so the session
+summary never has to list the rows. Counters expire with the session's cache
+entry and are rebuilt from SQL whenever one is missing, and
+``manage.py reconcile_session_counts`` rebuilds them on demand.
+"""
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Q
+
+from .models import SESSION_CACHE_TIMEOUT, Attendance
+
+COUNT_KEY = "session:{session_id}:count:{state}"
+
+PRESENT = "present"
+PENDING = "pending"
+FAILED = "failed"
+STATES = (PRESENT, PENDING, FAILED)
+
+STATE_FILTERS = {
+    PRESENT: Q(is_present=True) | Q(face_recognition_status=Attendance.FaceRecognitionStatus.SUCCESS),
+    FAILED: Q(is_present=False) & Q(face_recognition_status=Attendance.FaceRecognitionStatus.FAILED),
+}
+STATE_FILTERS[PENDING] = ~STATE_FILTERS[PRESENT] & ~STATE_FILTERS[FAILED]
+
+
+def state_of(is_present: bool, face_recognition_status: str) -> str:
+    if is_present or face_recognition_status == Attendance.FaceRecognitionStatus.SUCCESS:
+        return PRESENT
+    if face_recognition_status == Attendance.FaceRecognitionStatus.FAILED:
+        return FAILED
+    return PENDING
+
+
+def count_keys(session_id: int) -> dict[str, str]:
+    return {state: COUNT_KEY.format(session_id=session_id, state=state) for state in STATES}
+
+
+def _incr(session_id: int, state: str, delta: int) -> None:
+    try:
+        cache.incr(COUNT_KEY.format(session_id=session_id, state=state), delta)
+    except ValueError:
+        # Not counted yet or expired: the next read rebuilds the counters from SQL
+        pass
+
+
+def count_check_in(session_id: int, state: str, count: int = 1) -> None:
+    transaction.on_commit(lambda: _incr(session_id, state, count))
+
+
+def count_transition(session_id: int, before: str, after: str) -> None:
+    if before == after:
+        return
+
+    def move():
+        _incr(session_id, before, -1)
+        _incr(session_id, after, 1)
+
+    transaction.on_commit(move)
+
+
+def set_counts(session_id: int, counts: dict[str, int]) -> None:
+    keys = count_keys(session_id)
+    cache.set_many({keys[state]: counts[state] for state in STATES}, timeout=SESSION_CACHE_TIMEOUT)
+
+
+def counts_from_db(session_ids) -> dict[int, dict[str, int]]:
+    """Count every session's rows per state with one grouped query."""
+    rows = (
+        Attendance.objects.filter(session_id__in=session_ids)
+        .order_by()
+        .values("session_id")
+        .annotate(**{state: Count("id", filter=STATE_FILTERS[state]) for state in STATES})
+    )
+    counts = {session_id: dict.fromkeys(STATES, 0) for session_id in session_ids}
+    for row in rows:
+        counts[row["session_id"]] = {state: row[state] for state in STATES}
+    return counts
+
+
+def get_counts(session_id: int, cached: dict | None = None) -> dict[str, int]:
+    """The session's counters, from ``cached`` if the caller already fetched their keys."""
+    keys = count_keys(session_id)
+    if cached is None:
+        cached = cache.get_many(keys.values())
+
+    if all(key in cached for key in keys.values()):
+        counts = {state: cached[keys[state]] for state in STATES}
+    else:
+        counts = counts_from_db([session_id])[session_id]
+        # Don't overwrite counters another request rebuilt in the meantime
+        for state in STATES:
+            cache.add(keys[state], counts[state], timeout=SESSION_CACHE_TIMEOUT)
+    return {**counts, "total": sum(counts.values())}
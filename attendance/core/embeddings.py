@@ -0,0 +1,223 @@
+"""
+Memory-mapped store of enrolled students' face embeddings.
+
+The store is a directory holding generations of two arrays, each memory-mapped
+so every processor worker, in any process on the host, shares one copy in the
+page cache:
+
+- ``embeddings.npy``: a float32 matrix with one L2-normalized embedding per row,
+  so a dot product is the cosine similarity.
+- ``index.npy``: per row, the student id and the FaceId the embedding was
+  enrolled with. Unused rows have student id 0, rows replaced by a
+  re-enrollment -1.
+
+New embeddings are appended to the current generation in place; the embedding
+is written before its index entry, so readers never see a half-written row.
+Growing past the capacity and compaction, which drops replaced rows, write a
+new generation and switch the ``current`` symlink to it atomically. Readers
+pick the new generation up on their next miss. Writers take an exclusive
+``flock`` on the directory's lock file.
+"""
+
+import fcntl
+import os
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+
+INDEX_DTYPE = np.dtype([("student_id", "<i8"), ("face_id", "S36")])
+UNUSED = 0
+REPLACED = -1
+MIN_CAPACITY = 1024
+
+
+class EmbeddingStore:
+    def __init__(self, path: str | os.PathLike):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.lock = threading.RLock()
+        self.generation: str | None = None
+        # Empty until a generation is mapped
+        self.matrix: np.memmap = np.empty((0, 0), dtype=np.float32).view(np.memmap)
+        self.index: np.memmap = np.empty(0, dtype=INDEX_DTYPE).view(np.memmap)
+        # student id -> row, for the rows read so far
+        self.rows: dict[int, int] = {}
+        self.size = 0
+        self.refresh()
+
+    @property
+    def current(self) -> Path:
+        return self.path / "current"
+
+    @contextmanager
+    def exclusive(self):
+        """Serialize writers across threads and processes."""
+        with self.lock, open(self.path / "lock", "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                self.refresh()
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def refresh(self) -> None:
+        """Pick up rows appended and generations written by other processes."""
+        with self.lock:
+            while self.current.exists() and (generation := os.readlink(self.current)) != self.generation:
+                try:
+                    self.matrix = np.load(self.path / generation / "embeddings.npy", mmap_mode="r+")
+                    self.index = np.load(self.path / generation / "index.npy", mmap_mode="r+")
+                except FileNotFoundError:
+                    # Replaced by a newer generation between reading the link and opening the files
+                    continue
+                self.generation = generation
+                self.rows, self.size = {}, 0
+
+            student_ids = self.index["student_id"]
+            while self.size < len(student_ids) and student_ids[self.size] != UNUSED:
+                if student_ids[self.size] != REPLACED:
+                    self.rows[int(student_ids[self.size])] = self.size
+                self.size += 1
+
+    @property
+    def replaced(self) -> int:
+        return int(np.count_nonzero(self.index["student_id"][: self.size] == REPLACED))
+
+    def row(self, student_id: int, face_id: str) -> int | None:
+        with self.lock:
+            row = self.rows.get(student_id)
+            if row is None or self.index["student_id"][row] != student_id:
+                # Not read yet, or re-enrolled or removed by another process
+                self.refresh()
+                row = self.rows.get(student_id)
+            if row is None or self.index["student_id"][row] != student_id:
+                return None
+            return row if self.index["face_id"][row].decode() == face_id else None
+
+    def get(self, student_id: int, face_id: str) -> np.ndarray | None:
+        """The student's embedding if it was enrolled with ``face_id``, a read-only view into the store."""
+        row = self.row(student_id, face_id)
+        if row is None:
+            return None
+        view = self.matrix[row]
+        view.flags.writeable = False
+        return view
+
+    def put(self, student_id: int, face_id: str, embedding: np.ndarray) -> None:
+        embedding = np.asarray(embedding, dtype=np.float32)
+        embedding = embedding / np.linalg.norm(embedding)
+        with self.exclusive():
+            if self.row(student_id, face_id) is not None:
+                return
+            if self.matrix.shape[1] != len(embedding):
+                if self.size - self.replaced:
+                    raise ValueError(f"Embeddings have {self.matrix.shape[1]} dimensions, not {len(embedding)}")
+                self.write_generation(len(embedding), MIN_CAPACITY)
+            elif self.size == len(self.index):
+                self.write_generation(self.matrix.shape[1], max(MIN_CAPACITY, 2 * (self.size - self.replaced)))
+
+            # Rows are renumbered when a new generation is written
+            previous = self.rows.get(student_id)
+            row = self.size
+            self.matrix[row] = embedding
+            self.matrix.flush()
+            self.index[row] = (student_id, face_id.encode())
+            if previous is not None:
+                self.index["student_id"][previous] = REPLACED
+            self.index.flush()
+            self.rows[student_id] = row
+            self.size += 1
+
+    def remove(self, face_ids: list[str]) -> None:
+        """Drop the rows enrolled with ``face_ids``, they are reclaimed by the next compaction."""
+        encoded = [face_id.encode() for face_id in face_ids]
+        with self.exclusive():
+            for row in np.flatnonzero(np.isin(self.index["face_id"][: self.size], encoded)):
+                student_id = int(self.index["student_id"][row])
+                if student_id != REPLACED:
+                    self.index["student_id"][row] = REPLACED
+                    self.rows.pop(student_id, None)
+            self.index.flush()
+
+    def compact(self, force: bool = False) -> int:
+        """
+        Rewrite the store without replaced rows, returning how many were dropped.
+        Unless forced, only once they outnumber the live rows.
+        """
+        with self.exclusive():
+            replaced = self.replaced
+            if not replaced or (not force and replaced < self.size - replaced):
+                return 0
+            self.write_generation(self.matrix.shape[1], max(MIN_CAPACITY, 2 * (self.size - replaced)))
+        return replaced
+
+    def write_generation(self, dimensions: int, capacity: int) -> None:
+        """Copy the live rows to a new generation of ``capacity`` rows and make it current."""
+        live = np.flatnonzero(self.index["student_id"][: self.size] > 0)
+        name = f"generation-{int.from_bytes(os.urandom(4), 'big'):08x}"
+        directory = self.path / name
+        directory.mkdir()
+        matrix = np.lib.format.open_memmap(
+            directory / "embeddings.npy", mode="w+", dtype=np.float32, shape=(capacity, dimensions)
+        )
+        index = np.lib.format.open_memmap(directory / "index.npy", mode="w+", dtype=INDEX_DTYPE, shape=(capacity,))
+        if len(live):
+            matrix[: len(live)] = self.matrix[live]
+            index[: len(live)] = self.index[live]
+        matrix.flush()
+        index.flush()
+
+        link = self.path / f"{name}.link"
+        link.symlink_to(name)
+        os.replace(link, self.current)
+        old = self.generation
+        self.refresh()
+        if old:
+            # Processes that still map the old files keep reading them until they refresh
+            for file in (self.path / old).iterdir():
+                file.unlink()
+            (self.path / old).rmdir()
+
+    def stored_rows(self, student_ids: list[int]) -> np.ndarray:
+        """Each student's row, -1 for students who aren't stored. Call it holding the lock."""
+        self.refresh()
+        rows = np.array([self.rows.get(student_id, -1) for student_id in student_ids], dtype=np.intp)
+        if self.size:
+            # Removed by another process since
+            rows[self.index["student_id"][rows] != np.asarray(student_ids)] = -1
+        return rows
+
+    def similarities(self, targets: np.ndarray, student_ids: list[int]) -> np.ndarray:
+        """
+        Cosine similarity of every target embedding with every student's, an
+        (n targets, n students) matrix with NaN for students who aren't stored.
+
+        Each student's row is a view into the mapped matrix, so only those rows
+        are read and none are copied. Multiplying with the whole matrix would
+        read the embeddings of every enrolled student for a session's students.
+        """
+        targets = unit_rows(targets)
+        scores = np.full((len(targets), len(student_ids)), np.nan, dtype=np.float32)
+        with self.lock:
+            for column, row in enumerate(self.stored_rows(student_ids)):
+                if row >= 0:
+                    scores[:, column] = targets @ self.matrix[row]
+        return scores
+
+    def pair_similarities(self, student_ids: list[int], targets: np.ndarray) -> np.ndarray:
+        """Cosine similarity of each target embedding with its own student's, NaN if they aren't stored."""
+        targets = unit_rows(targets)
+        scores = np.full(len(targets), np.nan, dtype=np.float32)
+        with self.lock:
+            # One dot product per pair, with the student's row read in place
+            for i, row in enumerate(self.stored_rows(student_ids)):
+                if row >= 0:
+                    scores[i] = targets[i] @ self.matrix[row]
+        return scores
+
+
+def unit_rows(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
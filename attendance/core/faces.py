@@ -0,0 +1,291 @@
+"""
+Face comparison backends for the face recognition processor.
+
+``FACE_COMPARATOR`` names the backend, built with the processor's per-thread
+``client(service_name)`` factory:
+
+- ``RekognitionFaceComparator`` compares images with AWS Rekognition, pairwise
+  or through a face collection depending on ``FACE_RECOGNITION_MODE``.
+- ``LocalFaceComparator`` runs in-process on CPU. ``FACE_EMBEDDER`` turns an
+  image into a face embedding; no face model ships with the project, it has to
+  be provided. ``fake_embedder`` stands in for one to run the pipeline and
+  ``benchmark_face_comparison`` offline. At enrollment the init image's embedding gets a FaceId, is saved to
+  S3 as ``{student_id}/{face_id}.npy`` and appended to the host's memory-mapped
+  ``EmbeddingStore``; other hosts load it from S3 on first use. Images are
+  matched by the cosine similarity of their embeddings against
+  ``FACE_SIMILARITY_THRESHOLD``, a receive batch's with one vectorized call.
+  Students without an embedding, enrolled before the switch to this backend,
+  don't match unless ``FACE_LOCAL_FALLBACK`` compares them with
+  ``RekognitionFaceComparator`` until they upload a new init image.
+"""
+
+import abc
+import io
+import logging
+import uuid
+import zlib
+from collections.abc import Callable, Sequence
+
+import numpy as np
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+
+from .embeddings import EmbeddingStore
+
+LOGGER = logging.getLogger(__name__)
+
+# FACE_RECOGNITION_MODE values
+COMPARE = "compare"
+COLLECTION = "collection"
+# CompareFaces' default, used for collection searches too so both modes accept the same matches
+SIMILARITY_THRESHOLD = 80
+# Faces a collection search returns, the student's has to be among them
+SEARCH_MAX_FACES = 10
+
+# Embeddings are saved next to the student's images, the suffix keeps them out of the .jpeg S3 notification
+EMBEDDING_SUFFIX = ".npy"
+
+# (student id, FaceId or "", target image key)
+Comparison = tuple[int, str, str]
+
+
+class FaceComparator(abc.ABC):
+    """
+    Matches attendance images with students' init images.
+
+    ``enroll`` prepares a new init image and returns the FaceId stored on the
+    student, or "" if the backend doesn't use one. If ``uses_face_ids`` is set,
+    the processor passes the stored FaceId back to ``compare``. If
+    ``compares_in_batches`` is set, the processor collects a receive batch's
+    attendance images for one ``compare_batch`` call instead of comparing each
+    in its worker.
+    """
+
+    uses_face_ids = False
+    compares_in_batches = False
+
+    def __init__(self, client: Callable):
+        self.client = client
+
+    def enroll(self, bucket_name: str, init_image: str, student_id: int) -> str:
+        return ""
+
+    def compare(self, bucket_name: str, student_id: int, face_id: str, target_image: str) -> bool:
+        return self.compare_batch(bucket_name, [(student_id, face_id, target_image)])[0]
+
+    @abc.abstractmethod
+    def compare_batch(self, bucket_name: str, comparisons: Sequence[Comparison]) -> list[bool]:
+        """Whether each target image is of its student, in order."""
+
+    def delete_faces(self, face_ids: list[str]) -> None:
+        pass
+
+
+class RekognitionFaceComparator(FaceComparator):
+    def __init__(self, client: Callable, mode: str | None = None):
+        super().__init__(client)
+        self.mode = mode or settings.FACE_RECOGNITION_MODE
+        if self.mode not in (COMPARE, COLLECTION):
+            raise ImproperlyConfigured(f"FACE_RECOGNITION_MODE must be {COMPARE!r} or {COLLECTION!r}")
+        self.uses_face_ids = self.mode == COLLECTION
+        self.collection_id = settings.REKOGNITION_COLLECTION_ID
+
+    @property
+    def rekognition(self):
+        return self.client("rekognition")
+
+    def enroll(self, bucket_name: str, init_image: str, student_id: int) -> str:
+        if self.mode == COLLECTION:
+            return self.index_face(bucket_name, init_image, student_id)
+        return ""
+
+    def compare_batch(self, bucket_name: str, comparisons: Sequence[Comparison]) -> list[bool]:
+        # Rekognition compares one image per call
+        results = []
+        for student_id, face_id, target_image in comparisons:
+            if face_id:
+                LOGGER.info(f"Searching face {face_id} of student {student_id}")
+                results.append(self.search_face(bucket_name, face_id, target_image))
+            else:
+                LOGGER.info(f"Comparing face with {student_id}/init.jpeg")
+                results.append(self.compare_face(bucket_name, f"{student_id}/init.jpeg", target_image))
+        return results
+
+    def compare_face(self, bucket_name: str, init_image: str, target_image: str) -> bool:
+        try:
+            response = self.rekognition.compare_faces(
+                SourceImage={
+                    "S3Object": {
+                        "Bucket": bucket_name,
+                        "Name": init_image,
+                    }
+                },
+                TargetImage={
+                    "S3Object": {
+                        "Bucket": bucket_name,
+                        "Name": target_image,
+                    }
+                },
+            )
+            return len(response["FaceMatches"]) > 0
+
+        except self.rekognition.exceptions.InvalidParameterException:
+            return False
+
+    def index_face(self, bucket_name: str, init_image: str, student_id: int) -> str:
+        """Add the init image's face to the collection, returning its FaceId or "" if none was found."""
+        try:
+            response = self.rekognition.index_faces(
+                CollectionId=self.collection_id,
+                Image={"S3Object": {"Bucket": bucket_name, "Name": init_image}},
+                ExternalImageId=str(student_id),
+                MaxFaces=1,
+                QualityFilter="AUTO",
+            )
+        except self.rekognition.exceptions.ResourceNotFoundException:
+            LOGGER.info(f"Creating face collection {self.collection_id}")
+            try:
+                self.rekognition.create_collection(CollectionId=self.collection_id)
+            except self.rekognition.exceptions.ResourceAlreadyExistsException:
+                pass
+            return self.index_face(bucket_name, init_image, student_id)
+        except self.rekognition.exceptions.InvalidParameterException:
+            response = {"FaceRecords": []}
+
+        if not response["FaceRecords"]:
+            LOGGER.warning(f"No face indexed for student {student_id}, their images will be compared pairwise")
+            return ""
+        return response["FaceRecords"][0]["Face"]["FaceId"]
+
+    def search_face(self, bucket_name: str, face_id: str, target_image: str) -> bool:
+        try:
+            response = self.rekognition.search_faces_by_image(
+                CollectionId=self.collection_id,
+                Image={"S3Object": {"Bucket": bucket_name, "Name": target_image}},
+                MaxFaces=SEARCH_MAX_FACES,
+                FaceMatchThreshold=SIMILARITY_THRESHOLD,
+            )
+            return any(match["Face"]["FaceId"] == face_id for match in response["FaceMatches"])
+
+        except self.rekognition.exceptions.InvalidParameterException:
+            return False
+
+    def delete_faces(self, face_ids: list[str]) -> None:
+        try:
+            self.rekognition.delete_faces(CollectionId=self.collection_id, FaceIds=face_ids)
+        except Exception as e:
+            LOGGER.error(f"Failed to delete faces {face_ids} from the collection: {e}")
+
+
+def fake_embedder(image: bytes) -> np.ndarray | None:
+    """
+    Stand-in for a face model, for tests, benchmarks and running process_sqs_msg offline.
+
+    It recognizes bytes, not faces: images that are the same up to a "#", such as
+    ``b"person 1"`` and ``b"person 1#2"``, get embeddings with a cosine similarity
+    of about 0.99, and unrelated images about 0. ``b"no face"`` has no face. Never
+    point ``FACE_EMBEDDER`` at it with real images.
+    """
+    if image == b"no face":
+        return None
+    person, _, shot = image.partition(b"#")
+    embedding = np.random.default_rng(zlib.crc32(person)).normal(size=128)
+    noise = np.random.default_rng(zlib.crc32(image)).normal(scale=0.1, size=128) if shot else 0
+    return embedding + noise
+
+
+class LocalFaceComparator(FaceComparator):
+    uses_face_ids = True
+    compares_in_batches = True
+
+    def __init__(
+        self,
+        client: Callable,
+        embedder: Callable | None = None,
+        threshold: float | None = None,
+        store: EmbeddingStore | None = None,
+        fallback: FaceComparator | None = None,
+    ):
+        super().__init__(client)
+        if embedder is None:
+            if not settings.FACE_EMBEDDER:
+                raise ImproperlyConfigured("LocalFaceComparator needs FACE_EMBEDDER")
+            embedder = import_string(settings.FACE_EMBEDDER)
+        self.embedder = embedder
+        self.threshold = settings.FACE_SIMILARITY_THRESHOLD if threshold is None else threshold
+        self.store = store or EmbeddingStore(settings.FACE_EMBEDDING_STORE)
+        # For students without an embedding: their FaceId is "" or a Rekognition collection's
+        if fallback is None and settings.FACE_LOCAL_FALLBACK:
+            fallback = RekognitionFaceComparator(client)
+        self.fallback = fallback
+
+    @property
+    def s3(self):
+        return self.client("s3")
+
+    def read(self, bucket_name: str, key: str) -> bytes:
+        return self.s3.get_object(Bucket=bucket_name, Key=key)["Body"].read()
+
+    def embed(self, image: bytes) -> np.ndarray | None:
+        """The image's face embedding as a float32 vector, None if it has no face."""
+        embedding = self.embedder(image)
+        return None if embedding is None else np.asarray(embedding, dtype=np.float32)
+
+    def enroll(self, bucket_name: str, init_image: str, student_id: int) -> str:
+        embedding = self.embed(self.read(bucket_name, init_image))
+        if embedding is None:
+            LOGGER.warning(f"No face found in the init image of student {student_id}")
+            return ""
+        face_id = str(uuid.uuid4())
+        buffer = io.BytesIO()
+        np.save(buffer, embedding, allow_pickle=False)
+        self.s3.put_object(Bucket=bucket_name, Key=f"{student_id}/{face_id}{EMBEDDING_SUFFIX}", Body=buffer.getvalue())
+        self.store.put(student_id, face_id, embedding)
+        return face_id
+
+    def load(self, bucket_name: str, student_id: int, face_id: str) -> bool:
+        """Make sure the student's embedding is in the local store, enrolled on another host or before a restart."""
+        if self.store.row(student_id, face_id) is not None:
+            return True
+        try:
+            data = self.read(bucket_name, f"{student_id}/{face_id}{EMBEDDING_SUFFIX}")
+            embedding = np.load(io.BytesIO(data), allow_pickle=False)
+        except self.s3.exceptions.NoSuchKey:
+            LOGGER.warning(f"Student {student_id} has no embedding for face {face_id}")
+            return False
+        self.store.put(student_id, face_id, embedding)
+        return True
+
+    def compare_batch(self, bucket_name: str, comparisons: Sequence[Comparison]) -> list[bool]:
+        targets = {}
+        unenrolled = []
+        for i, (student_id, face_id, target_image) in enumerate(comparisons):
+            if not face_id or not self.load(bucket_name, student_id, face_id):
+                unenrolled.append(i)
+                continue
+            target = self.embed(self.read(bucket_name, target_image))
+            if target is not None:
+                targets[i] = target
+
+        results = [False] * len(comparisons)
+        if targets:
+            student_ids = [comparisons[i][0] for i in targets]
+            similarities = self.store.pair_similarities(student_ids, np.stack(list(targets.values())))
+            for i, similarity in zip(targets, similarities):
+                results[i] = bool(similarity >= self.threshold)
+        if unenrolled and self.fallback is not None:
+            LOGGER.info(f"Comparing {len(unenrolled)} images of students without an embedding with the fallback")
+            matches = self.fallback.compare_batch(bucket_name, [comparisons[i] for i in unenrolled])
+            for i, matched in zip(unenrolled, matches):
+                results[i] = matched
+        elif unenrolled:
+            LOGGER.warning(f"{len(unenrolled)} images of students without an embedding don't match")
+        return results
+
+    def delete_faces(self, face_ids: list[str]) -> None:
+        self.store.remove(face_ids)
+        self.store.compact()
+        # The init images these replace may have been indexed in the fallback's collection
+        if self.fallback is not None and self.fallback.uses_face_ids:
+            self.fallback.delete_faces(face_ids)
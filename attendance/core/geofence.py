@@ -0,0 +1,108 @@
+"""
+Session geofences.
+
+A session is located either by a circle around its latitude/longitude or by a
+GeoJSON ``Polygon``/``MultiPolygon`` (coordinates in ``[longitude, latitude]``
+order, holes allowed). ``build_geometry`` runs when the session is saved and
+projects everything onto a flat plane in meters around the session origin, so
+``contains`` only has to do arithmetic on arrays, for one check-in or for every
+attendance row of a session at once.
+"""
+
+import math
+
+import numpy as np
+
+# Earth radius in meters
+EARTH_RADIUS = 6371000
+
+DEFAULT_RADIUS = 100
+
+
+def project(origin: tuple[float, float], latitudes, longitudes) -> tuple[np.ndarray, np.ndarray]:
+    # Equirectangular projection, accurate to well under a meter at campus scale
+    lat0, lon0 = origin
+    latitudes = np.asarray(latitudes, dtype=np.float64)
+    longitudes = np.asarray(longitudes, dtype=np.float64)
+    x = np.radians(longitudes - lon0) * math.cos(math.radians(lat0)) * EARTH_RADIUS
+    y = np.radians(latitudes - lat0) * EARTH_RADIUS
+    return x, y
+
+
+def polygons_from_geojson(geofence: dict) -> list[list[list[list[float]]]]:
+    if geofence["type"] == "Polygon":
+        return [geofence["coordinates"]]
+    if geofence["type"] == "MultiPolygon":
+        return geofence["coordinates"]
+    raise ValueError("Geofence must be a GeoJSON Polygon or MultiPolygon.")
+
+
+def validate_geojson(geofence: dict) -> None:
+    if not isinstance(geofence, dict) or "coordinates" not in geofence:
+        raise ValueError("Geofence must be a GeoJSON Polygon or MultiPolygon.")
+
+    for polygon in polygons_from_geojson(geofence):
+        if not polygon:
+            raise ValueError("Each polygon needs at least one ring.")
+        for ring in polygon:
+            if len(ring) < 3:
+                raise ValueError("Each polygon ring needs at least 3 points.")
+            for point in ring:
+                if len(point) != 2 or not all(isinstance(value, int | float) for value in point):
+                    raise ValueError("Points must be [longitude, latitude] pairs.")
+                if not -180 <= point[0] <= 180 or not -90 <= point[1] <= 90:
+                    raise ValueError("Points must be [longitude, latitude] pairs.")
+
+
+def build_geometry(
+    latitude: float | None, longitude: float | None, radius: float | None, geofence: dict | None
+) -> dict | None:
+    """Precompute a session's geofence as projected circle and polygon edges."""
+    if geofence:
+        polygons = polygons_from_geojson(geofence)
+        points = np.array([point for polygon in polygons for ring in polygon for point in ring], dtype=np.float64)
+        origin = (float(points[:, 1].mean()), float(points[:, 0].mean()))
+
+        projected = []
+        for polygon in polygons:
+            ring_edges = []
+            for ring in polygon:
+                coordinates = np.asarray(ring, dtype=np.float64)
+                x, y = project(origin, coordinates[:, 1], coordinates[:, 0])
+                # Close the ring if the client didn't repeat the first point
+                ring_edges.append(np.column_stack((x, y, np.roll(x, -1), np.roll(y, -1))))
+            edges = np.concatenate(ring_edges)
+            # Every vertex starts an edge, so the first two columns cover the whole polygon
+            bbox = [*edges[:, :2].min(axis=0).tolist(), *edges[:, :2].max(axis=0).tolist()]
+            projected.append({"bbox": bbox, "edges": edges.tolist()})
+        return {"origin": origin, "circles": [], "polygons": projected}
+
+    if latitude is None or longitude is None:
+        return None
+    return {"origin": (latitude, longitude), "circles": [[0.0, 0.0, radius or DEFAULT_RADIUS]], "polygons": []}
+
+
+def contains(geometry: dict, latitudes, longitudes) -> np.ndarray:
+    """Whether each point lies inside any of the geometry's circles or polygons."""
+    x, y = project(geometry["origin"], latitudes, longitudes)
+    inside = np.zeros(x.shape, dtype=bool)
+
+    for cx, cy, r in geometry["circles"]:
+        inside |= (x - cx) ** 2 + (y - cy) ** 2 <= r**2
+
+    for polygon in geometry["polygons"]:
+        min_x, min_y, max_x, max_y = polygon["bbox"]
+        candidates = ~inside & (x >= min_x) & (x <= max_x) & (y >= min_y) & (y <= max_y)
+        if not candidates.any():
+            continue
+
+        # Even-odd ray casting of every candidate point against every edge at once
+        px, py = x[candidates, np.newaxis], y[candidates, np.newaxis]
+        x1, y1, x2, y2 = np.asarray(polygon["edges"], dtype=np.float64).T
+        straddles = (y1 > py) != (y2 > py)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            crossing_x = x1 + (py - y1) * (x2 - x1) / (y2 - y1)
+        crossings = np.count_nonzero(straddles & (px < crossing_x), axis=1)
+        inside[candidates] = crossings % 2 == 1
+
+    return inside
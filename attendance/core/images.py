@@ -0,0 +1,30 @@
+"""
+Normalization of uploaded face images before they are compared.
+
+Phones upload full-resolution JPEGs with EXIF metadata. ``normalize_jpeg``
+decodes them at a reduced scale with Pillow's JPEG draft mode, which skips most
+of the decoding work, applies the EXIF orientation, fits the image in
+``max_size`` pixels and re-encodes it without any metadata.
+"""
+
+import io
+
+from PIL import Image, ImageOps
+
+# Rekognition needs faces of at least 40x40 pixels in images of up to 4096 pixels a side
+DEFAULT_MAX_SIZE = 1280
+DEFAULT_QUALITY = 85
+
+
+def normalize_jpeg(data: bytes, max_size: int = DEFAULT_MAX_SIZE, quality: int = DEFAULT_QUALITY) -> bytes:
+    with Image.open(io.BytesIO(data)) as image:
+        # Decode at the smallest power-of-two scale that still covers max_size, a no-op for other formats
+        image.draft("RGB", (max_size, max_size))
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        output = io.BytesIO()
+        # Nothing is copied from the original's info, so EXIF, ICC and comments are left out
+        image.save(output, "JPEG", quality=quality, optimize=True)
+    return output.getvalue()
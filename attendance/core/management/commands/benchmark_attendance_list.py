@@ -0,0 +1,116 @@
+import cProfile
+import io
+import pstats
+import time
+import uuid
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from attendance.core.models import Attendance, Course, Session
+from attendance.core.serializers import AttendanceSerializer, FlatAttendanceSerializer
+from attendance.users.models import User
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark GET /api/v1/attendance/?session_id= for one large session, nested with AttendanceSerializer "
+        "and flat with FlatAttendanceSerializer (?flat=true). Reports the request, the query and the "
+        "serialization on their own, and with --profile the functions serialization spends its time in."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=10_000)
+        parser.add_argument("--repeat", type=int, default=5, help="Runs of each, the fastest is reported")
+        parser.add_argument("--profile", type=int, default=0, help="Print the top N functions of each serializer")
+        parser.add_argument("--host", default="localhost", help="Host header, must be in ALLOWED_HOSTS")
+
+    def handle(self, *args, **options):
+        run_id = uuid.uuid4().hex[:8]
+        try:
+            self.benchmark(run_id, options)
+        finally:
+            Course.objects.filter(name=f"bench-{run_id}").delete()
+            User.objects.filter(email__startswith=f"bench-{run_id}-").delete()
+
+    def benchmark(self, run_id: str, options):
+        teacher, session = self.populate(run_id, options["rows"])
+        client = APIClient(HTTP_HOST=options["host"])
+        client.force_authenticate(teacher)
+        url = reverse("api:attendance-list-create")
+        queryset = Attendance.objects.select_related("session_id", "student_id", "session_id__course_id").filter(
+            session_id=session.id
+        )
+        queryset = queryset.order_by("-created_at", "-id")
+        flat = FlatAttendanceSerializer()
+
+        def nested_query():
+            return list(queryset.all())
+
+        def flat_query():
+            return list(flat.values(queryset))
+
+        objects, rows = nested_query(), flat_query()
+
+        def nested_serialize():
+            return AttendanceSerializer(objects, many=True).data
+
+        def flat_serialize():
+            return flat.to_representation(rows), flat.sessions([row["session_id"] for row in rows])
+
+        self.stdout.write(f"{'serializer':>10} {'request ms':>11} {'query ms':>9} {'serialize ms':>13}")
+        for name, params, query, serialize in (
+            ("nested", {}, nested_query, nested_serialize),
+            ("flat", {"flat": "true"}, flat_query, flat_serialize),
+        ):
+            params["session_id"] = str(session.id)
+            fetched = self.fastest(lambda: self.get(client, url, params), options["repeat"])
+            queried = self.fastest(query, options["repeat"])
+            serialized = self.fastest(serialize, options["repeat"])
+            self.stdout.write(f"{name:>10} {fetched * 1000:>11.1f} {queried * 1000:>9.1f} {serialized * 1000:>13.1f}")
+
+        if options["profile"]:
+            for name, serialize in (("nested", nested_serialize), ("flat", flat_serialize)):
+                profile = cProfile.Profile()
+                profile.runcall(serialize)
+                stream = io.StringIO()
+                pstats.Stats(profile, stream=stream).sort_stats("tottime").print_stats(options["profile"])
+                self.stdout.write(f"\n{name}:{stream.getvalue()}")
+
+    def populate(self, run_id: str, rows: int) -> tuple[User, Session]:
+        domain = settings.WHITELISTED_EMAIL_DOMAINS[0]
+        teacher = User.objects.create_user(email=f"bench-{run_id}-teacher@{domain}", role=User.UserRoleChoices.TEACHER)
+        course = Course.objects.create(name=f"bench-{run_id}", teacher_id=teacher)
+        session = Session.objects.create(course_id=course, salt=uuid.uuid4().hex)
+        students = User.objects.bulk_create(
+            User(
+                email=f"bench-{run_id}-{i}@{domain}",
+                name=f"Student {i}",
+                password="!",
+                role=User.UserRoleChoices.STUDENT,
+            )
+            for i in range(rows)
+        )
+        Attendance.objects.bulk_create(
+            Attendance(session_id=session, student_id=student, is_present=True) for student in students
+        )
+        with connection.cursor() as cursor:
+            for model in (User, Course, Session, Attendance):
+                cursor.execute(f"ANALYZE {model._meta.db_table}")
+        return teacher, session
+
+    def get(self, client: APIClient, url: str, params: dict) -> None:
+        response = client.get(url, params)
+        if response.status_code != 200:
+            raise RuntimeError(f"Request failed with {response.status_code}: {response.content!r}")
+
+    def fastest(self, function, repeat: int) -> float:
+        best = float("inf")
+        for _ in range(repeat):
+            started = time.perf_counter()
+            function()
+            best = min(best, time.perf_counter() - started)
+        return best
@@ -0,0 +1,74 @@
+import time
+import uuid
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from attendance.core.checkin import mint_token
+from attendance.core.models import Course, Session
+from attendance.users.models import User
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark POST /api/v1/attendance/ in-process through AttendanceCreateSerializer "
+        "(ATTENDANCE_CHECKIN_FAST_PATH=False) and the check-in fast path. "
+        "Requests run one at a time like a sync gunicorn worker, so req/s is the per-worker ceiling."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--students", type=int, default=300)
+        parser.add_argument("--face-recognition", action="store_true")
+        parser.add_argument("--host", default="localhost", help="Host header, must be in ALLOWED_HOSTS")
+
+    def handle(self, *args, **options):
+        run_id = uuid.uuid4().hex[:8]
+        domain = settings.WHITELISTED_EMAIL_DOMAINS[0]
+        teacher = User.objects.create_user(email=f"bench-{run_id}-teacher@{domain}", role=User.UserRoleChoices.TEACHER)
+        course = Course.objects.create(name=f"bench-{run_id}", teacher_id=teacher)
+        students = User.objects.bulk_create(
+            User(email=f"bench-{run_id}-{i}@{domain}", password="!", role=User.UserRoleChoices.STUDENT)
+            for i in range(options["students"] + 1)
+        )
+        client = APIClient(HTTP_HOST=options["host"])
+        requests = options["students"]
+
+        try:
+            runs = (
+                ("serializer", {"ATTENDANCE_CHECKIN_FAST_PATH": False}),
+                ("fast path", {"ATTENDANCE_CHECKIN_FAST_PATH": True}),
+            )
+            for label, overrides in runs:
+                session = Session.objects.create(
+                    course_id=course,
+                    salt=uuid.uuid4().hex,
+                    face_recognition_enabled=options["face_recognition"],
+                )
+                token = mint_token(session, expires_in=60 * 60)
+                url = reverse("api:attendance-list-create")
+                with override_settings(**overrides):
+                    elapsed = self.check_in_all(client, url, token, students[:requests])
+                    with CaptureQueriesContext(connection) as queries:
+                        self.check_in_all(client, url, token, students[requests:])
+
+                self.stdout.write(
+                    f"{label:>10}: {requests / elapsed:8.1f} req/s, "
+                    f"{elapsed * 1000 / requests:6.2f} ms/req, "
+                    f"{len(queries)} queries/req"
+                )
+        finally:
+            course.delete()
+            User.objects.filter(email__startswith=f"bench-{run_id}-").delete()
+
+    def check_in_all(self, client: APIClient, url: str, token: str, students: list[User]) -> float:
+        start = time.perf_counter()
+        for student in students:
+            client.force_authenticate(student)
+            response = client.post(url, {"token": token}, format="json")
+            if response.status_code != 201:
+                raise RuntimeError(f"Check-in failed with {response.status_code}: {response.content!r}")
+        return time.perf_counter() - start
@@ -0,0 +1,80 @@
+import io
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand
+
+from attendance.core.embeddings import EmbeddingStore
+from attendance.core.faces import LocalFaceComparator, fake_embedder
+
+
+class MemoryS3:
+    """Just enough of an S3 client for LocalFaceComparator to run without AWS."""
+
+    class exceptions:
+        NoSuchKey = KeyError
+
+    def __init__(self):
+        self.objects: dict[str, bytes] = {}
+
+    def get_object(self, Bucket: str, Key: str) -> dict:
+        return {"Body": io.BytesIO(self.objects[f"{Bucket}/{Key}"])}
+
+    def put_object(self, Bucket: str, Key: str, Body: bytes, **kwargs) -> dict:
+        self.objects[f"{Bucket}/{Key}"] = Body
+        return {}
+
+
+class Command(BaseCommand):
+    help = (
+        "Enroll students and compare receive batches of attendance images with LocalFaceComparator offline, "
+        "using attendance.core.faces.fake_embedder and an in-memory S3. "
+        "It times the pipeline around the face model, not a model itself."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--students", type=int, default=1000)
+        parser.add_argument("--batch-size", type=int, default=10, help="Images per compare_batch call")
+        parser.add_argument("--threshold", type=float, default=0.8)
+
+    def handle(self, *args, **options):
+        students, batch_size = options["students"], options["batch_size"]
+        s3 = MemoryS3()
+        bucket = "media"
+        for student_id in range(1, students + 1):
+            s3.objects[f"{bucket}/{student_id}/init.jpeg"] = f"person {student_id}".encode()
+            # Every other student checks in as someone else
+            person = student_id if student_id % 2 else student_id + students
+            s3.objects[f"{bucket}/{student_id}/1.jpeg"] = f"person {person}#1".encode()
+
+        with tempfile.TemporaryDirectory() as path:
+            comparator = LocalFaceComparator(
+                lambda service_name: s3,
+                embedder=fake_embedder,
+                threshold=options["threshold"],
+                store=EmbeddingStore(path),
+            )
+            started = time.perf_counter()
+            face_ids = [
+                comparator.enroll(bucket, f"{student_id}/init.jpeg", student_id)
+                for student_id in range(1, students + 1)
+            ]
+            enrolled = time.perf_counter() - started
+
+            comparisons = [
+                (student_id, face_id, f"{student_id}/1.jpeg") for student_id, face_id in enumerate(face_ids, 1)
+            ]
+            started = time.perf_counter()
+            results = []
+            for start in range(0, len(comparisons), batch_size):
+                results += comparator.compare_batch(bucket, comparisons[start : start + batch_size])
+            compared = time.perf_counter() - started
+
+        correct = sum(matched == bool(student_id % 2) for (student_id, _, _), matched in zip(comparisons, results))
+        self.stdout.write(
+            f"Enrolled {students} students in {enrolled * 1000:.0f} ms ({enrolled * 1000 / students:.3f} ms each)"
+        )
+        self.stdout.write(
+            f"Compared {students} images in batches of {batch_size} in {compared * 1000:.0f} ms "
+            f"({students / compared:.0f} images/s), {correct} of {students} correct"
+        )
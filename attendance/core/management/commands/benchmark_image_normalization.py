@@ -0,0 +1,74 @@
+import io
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from PIL import Image, ImageOps
+
+from attendance.core.images import normalize_jpeg
+
+
+class Command(BaseCommand):
+    help = (
+        "Time attendance.core.images.normalize_jpeg over sample images and report the output sizes, "
+        "next to a full-resolution decode and resize without draft mode."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("paths", nargs="+", help="JPEG files, or directories to search for *.jpg and *.jpeg")
+        parser.add_argument("--max-size", type=int, default=settings.FACE_IMAGE_MAX_SIZE)
+        parser.add_argument("--repeat", type=int, default=5, help="Runs per image, the fastest is reported")
+
+    def images(self, paths: list[str]) -> list[Path]:
+        images = []
+        for path in map(Path, paths):
+            if path.is_dir():
+                images += sorted(p for p in path.rglob("*") if p.suffix.lower() in (".jpg", ".jpeg"))
+            else:
+                images.append(path)
+        return images
+
+    def fastest(self, function, repeat: int) -> tuple[float, bytes]:
+        best, result = float("inf"), b""
+        for _ in range(repeat):
+            started = time.perf_counter()
+            result = function()
+            best = min(best, time.perf_counter() - started)
+        return best, result
+
+    def full_decode(self, data: bytes, max_size: int) -> bytes:
+        with Image.open(io.BytesIO(data)) as image:
+            image = ImageOps.exif_transpose(image)
+            image.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
+            output = io.BytesIO()
+            image.convert("RGB").save(output, "JPEG", quality=85, optimize=True)
+        return output.getvalue()
+
+    def handle(self, *args, **options):
+        max_size, repeat = options["max_size"], options["repeat"]
+        totals = {"original": 0, "normalized": 0, "full": 0.0, "draft": 0.0}
+        self.stdout.write(f"{'image':<32} {'original':>18} {'full ms':>8} {'draft ms':>8} {'normalized':>18}")
+        for path in self.images(options["paths"]):
+            data = path.read_bytes()
+            with Image.open(io.BytesIO(data)) as image:
+                original_size = image.size
+            full, _ = self.fastest(lambda: self.full_decode(data, max_size), repeat)
+            draft, normalized = self.fastest(lambda: normalize_jpeg(data, max_size), repeat)
+            with Image.open(io.BytesIO(normalized)) as image:
+                normalized_size = image.size
+
+            totals["original"] += len(data)
+            totals["normalized"] += len(normalized)
+            totals["full"] += full
+            totals["draft"] += draft
+            self.stdout.write(
+                f"{path.name[:32]:<32} {'x'.join(map(str, original_size)):>10} {len(data) // 1024:>5} KB "
+                f"{full * 1000:>8.1f} {draft * 1000:>8.1f} "
+                f"{'x'.join(map(str, normalized_size)):>10} {len(normalized) // 1024:>5} KB"
+            )
+
+        self.stdout.write(
+            f"Total: {totals['original'] // 1024} KB -> {totals['normalized'] // 1024} KB, "
+            f"{totals['full'] * 1000:.0f} ms without draft mode, {totals['draft'] * 1000:.0f} ms with it"
+        )
@@ -0,0 +1,118 @@
+import time
+import uuid
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.urls import reverse
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+
+from attendance.core.models import Attendance, Course, Session
+from attendance.core.pagination import KeysetPagination
+from attendance.core.views import AttendanceListCreateAPIView
+from attendance.users.models import User
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark GET /api/v1/attendance/ pages at increasing depths of a teacher's attendance list, "
+        "with keyset cursors and with the LIMIT/OFFSET query they replace. The rows are committed and "
+        "vacuumed like a long-lived table's would be, and deleted at the end."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=1_000_000)
+        parser.add_argument("--students", type=int, default=1000)
+        parser.add_argument("--page-size", type=int, default=100)
+        parser.add_argument("--repeat", type=int, default=5, help="Requests per page, the fastest is reported")
+        parser.add_argument("--host", default="localhost", help="Host header, must be in ALLOWED_HOSTS")
+
+    def handle(self, *args, **options):
+        run_id = uuid.uuid4().hex[:8]
+        try:
+            self.benchmark(run_id, options)
+        finally:
+            Course.objects.filter(name=f"bench-{run_id}").delete()
+            User.objects.filter(email__startswith=f"bench-{run_id}-").delete()
+
+    def benchmark(self, run_id: str, options):
+        rows, page_size = options["rows"], options["page_size"]
+        teacher, queryset = self.populate(run_id, rows, options["students"])
+        client = APIClient(HTTP_HOST=options["host"])
+        client.force_authenticate(teacher)
+        url = reverse("api:attendance-list-create")
+        # Only used to encode cursors
+        pagination = KeysetPagination()
+        pagination.field = "created_at"
+
+        view = AttendanceListCreateAPIView()
+        factory = APIRequestFactory()
+
+        # The request includes serializing the page, the queries only fetch it
+        self.stdout.write(f"{'depth':>9} {'request ms':>11} {'keyset query ms':>16} {'offset query ms':>16}")
+        depths = [0, *(10**power for power in range(len(str(page_size)), len(str(rows))) if 10**power < rows)]
+        for depth in [*depths, rows - page_size - 1]:
+            params = {"page_size": page_size}
+            if depth:
+                params["cursor"] = pagination.encode_cursor(False, queryset.only("id", "created_at")[depth])
+            request = Request(factory.get(url, params))
+            fetched = self.fastest(lambda: self.get(client, url, params), options["repeat"])
+            keyset = self.fastest(
+                lambda: KeysetPagination().paginate_queryset(queryset, request, view), options["repeat"]
+            )
+            offset = self.fastest(lambda: list(queryset[depth + 1 : depth + 1 + page_size]), options["repeat"])
+            self.stdout.write(f"{depth:>9} {fetched * 1000:>11.1f} {keyset * 1000:>16.1f} {offset * 1000:>16.1f}")
+
+    def populate(self, run_id: str, rows: int, students: int):
+        domain = settings.WHITELISTED_EMAIL_DOMAINS[0]
+        teacher = User.objects.create_user(email=f"bench-{run_id}-teacher@{domain}", role=User.UserRoleChoices.TEACHER)
+        course = Course.objects.create(name=f"bench-{run_id}", teacher_id=teacher)
+        User.objects.bulk_create(
+            User(email=f"bench-{run_id}-{i}@{domain}", password="!", role=User.UserRoleChoices.STUDENT)
+            for i in range(students)
+        )
+        sessions = -(-rows // students)
+        Session.objects.bulk_create(Session(course_id=course, salt=uuid.uuid4().hex) for _ in range(sessions))
+
+        started = time.perf_counter()
+        fields = {field.name: field.column for field in Attendance._meta.fields}
+        with connection.cursor() as cursor:
+            # One row per session and student, sessions an hour apart and their check-ins a second apart
+            cursor.execute(
+                f"""
+                INSERT INTO {Attendance._meta.db_table}
+                    ({fields["session_id"]}, {fields["student_id"]}, {fields["created_at"]},
+                     {fields["is_present"]}, {fields["face_recognition_status"]})
+                SELECT s.id, u.id, now() - (s.id * interval '1 hour') + (u.id * interval '1 second'), true, %s
+                FROM {Session._meta.db_table} s CROSS JOIN {User._meta.db_table} u
+                WHERE s.{Session._meta.get_field("course_id").column} = %s AND u.email LIKE %s AND u.role = %s
+                LIMIT %s
+                """,
+                [
+                    Attendance.FaceRecognitionStatus.NOT_REQUIRED,
+                    course.id,
+                    f"bench-{run_id}-%",
+                    User.UserRoleChoices.STUDENT,
+                    rows,
+                ],
+            )
+            # Fresh rows the visibility map doesn't cover yet slow down planning, unlike a settled table
+            for model in (User, Course, Session, Attendance):
+                cursor.execute(f"VACUUM ANALYZE {model._meta.db_table}")
+        self.stdout.write(f"Inserted {rows} rows in {time.perf_counter() - started:.1f} s")
+        queryset = Attendance.objects.filter(session_id__course_id__teacher_id=teacher).order_by("-created_at", "-id")
+        return teacher, queryset
+
+    def get(self, client: APIClient, url: str, params: dict) -> None:
+        response = client.get(url, params)
+        if response.status_code != 200:
+            raise RuntimeError(f"Request failed with {response.status_code}: {response.content!r}")
+
+    def fastest(self, function, repeat: int) -> float:
+        best = float("inf")
+        for _ in range(repeat):
+            started = time.perf_counter()
+            function()
+            best = min(best, time.perf_counter() - started)
+        return best
@@ -0,0 +1,81 @@
+import io
+import time
+from typing import cast
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+
+from attendance.core.models import Attendance, Course, Session
+from attendance.core.parsers import ORJSONParser
+from attendance.core.renderers import ORJSONRenderer
+from attendance.core.serializers import AttendanceSerializer
+from attendance.users.models import User
+
+
+class Command(BaseCommand):
+    help = (
+        "Time rendering AttendanceSerializer output of increasing sizes with DRF's JSONRenderer and "
+        "attendance.core.renderers.ORJSONRenderer, and parsing it back with JSONParser and ORJSONParser. "
+        "Runs on unsaved objects, without the database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", type=int, nargs="+", default=[1, 10, 100, 1000, 10_000])
+        parser.add_argument("--repeat", type=int, default=5, help="Runs of each, the fastest is reported")
+
+    def data(self, rows: int) -> list[dict]:
+        now = timezone.now()
+        teacher = User(id=1, name="Teacher", email="teacher@ucf.edu", role=User.UserRoleChoices.TEACHER)
+        course = Course(id=1, name="COP3502", teacher_id=teacher)
+        session = Session(id=1, course_id=course, start_time=now, longitude=-81.2003, latitude=28.6024)
+        # NID-style emails, like the students' own, letters and digits around "@" and "."
+        students = [
+            User(id=i, name=f"Student {i}", email=f"ab{i:06d}@ucf.edu", role=User.UserRoleChoices.STUDENT)
+            for i in range(1, rows + 1)
+        ]
+        attendances = [
+            Attendance(
+                id=i,
+                session_id=session,
+                student_id=students[i - 1],
+                created_at=now,
+                is_present=True,
+                face_recognition_status=Attendance.FaceRecognitionStatus.SUCCESS,
+            )
+            for i in range(1, rows + 1)
+        ]
+        return cast(list[dict], AttendanceSerializer(attendances, many=True).data)
+
+    def fastest(self, function, repeat: int) -> float:
+        best = float("inf")
+        for _ in range(repeat):
+            started = time.perf_counter()
+            function()
+            best = min(best, time.perf_counter() - started)
+        return best
+
+    def handle(self, *args, **options):
+        repeat = options["repeat"]
+        self.stdout.write(
+            f"{'rows':>6} {'bytes':>9} {'json render ms':>15} {'orjson render ms':>17} "
+            f"{'json parse ms':>14} {'orjson parse ms':>16}"
+        )
+        for rows in options["sizes"]:
+            data = self.data(rows)
+            rendered = ORJSONRenderer().render(data)
+            if rendered != JSONRenderer().render(data):
+                raise RuntimeError(f"Renderers disagree on {rows} rows")
+
+            timings = [
+                self.fastest(lambda: JSONRenderer().render(data), repeat),
+                self.fastest(lambda: ORJSONRenderer().render(data), repeat),
+                self.fastest(lambda: JSONParser().parse(io.BytesIO(rendered)), repeat),
+                self.fastest(lambda: ORJSONParser().parse(io.BytesIO(rendered)), repeat),
+            ]
+            json_render, orjson_render, json_parse, orjson_parse = (timing * 1000 for timing in timings)
+            self.stdout.write(
+                f"{rows:>6} {len(rendered):>9} {json_render:>15.3f} {orjson_render:>17.3f} "
+                f"{json_parse:>14.3f} {orjson_parse:>16.3f}"
+            )
@@ -0,0 +1,16 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from attendance.core.embeddings import EmbeddingStore
+
+
+class Command(BaseCommand):
+    help = (
+        "Rewrite the local face embedding store without the rows replaced by re-enrollments. The processor "
+        "compacts on its own once replaced rows outnumber live ones; run this on a schedule to keep it tight."
+    )
+
+    def handle(self, *args, **options):
+        store = EmbeddingStore(settings.FACE_EMBEDDING_STORE)
+        dropped = store.compact(force=True)
+        self.stdout.write(f"Dropped {dropped} replaced embeddings, {store.size} rows left")
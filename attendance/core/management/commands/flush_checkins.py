@@ -0,0 +1,44 @@
+import json
+import socket
+
+from django.core.management.base import BaseCommand
+
+from attendance.core.buffer import CheckInFlusher, flush_stats
+
+
+class Command(BaseCommand):
+    help = "Drain buffered check-ins from Redis into Postgres"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument("--block", type=int, default=1000, help="Milliseconds to wait for new check-ins")
+        parser.add_argument(
+            "--consumer", default=socket.gethostname(), help="Stream consumer name, unique per flusher"
+        )
+        parser.add_argument(
+            "--claim-idle",
+            type=int,
+            default=60_000,
+            help="Milliseconds before check-ins another flusher read but didn't acknowledge are taken over",
+        )
+        parser.add_argument(
+            "--max-deliveries",
+            type=int,
+            default=5,
+            help="Attempts before a check-in that keeps failing is moved to the dead-letter stream",
+        )
+        parser.add_argument("--stats", action="store_true", help="Print backlog and last flush stats, then exit")
+
+    def handle(self, *args, **options):
+        if options["stats"]:
+            self.stdout.write(json.dumps(flush_stats()))
+            return
+
+        flusher = CheckInFlusher(
+            options["consumer"],
+            batch_size=options["batch_size"],
+            block_ms=options["block"],
+            claim_idle_ms=options["claim_idle"],
+            max_deliveries=options["max_deliveries"],
+        )
+        flusher.run()
@@ -0,0 +1,158 @@
+import json
+import statistics
+import time
+import urllib.error
+import urllib.request
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError, connection
+from rest_framework_simplejwt.tokens import AccessToken
+
+from attendance.core.checkin import mint_token
+from attendance.core.models import Course, Session
+from attendance.users.models import User
+
+
+class Command(BaseCommand):
+    help = (
+        "Reproduce a class-start burst against a running server: create a course, a session and N students, "
+        "then fire concurrent check-ins at POST /api/v1/attendance/. The server and this command must share "
+        "the database and the Redis cache, e.g. both running from docker-compose.local.yml. "
+        "Run it against the WSGI and the ASGI server with the same --concurrency to compare them."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--url", default="http://localhost:8000/api/v1/attendance/")
+        parser.add_argument("--students", type=int, default=300)
+        parser.add_argument("--concurrency", type=int, default=50)
+        parser.add_argument("--repeat", type=int, default=1, help="Check-ins per student, >1 simulates retries")
+        parser.add_argument("--face-recognition", action="store_true")
+        parser.add_argument(
+            "--face-status-polls",
+            type=int,
+            default=0,
+            help="Face status reads per successful check-in, like a client waiting on face recognition",
+        )
+        parser.add_argument("--keep", action="store_true", help="Keep the generated course, session and students")
+
+    def handle(self, *args, **options):
+        run_id = uuid.uuid4().hex[:8]
+        domain = settings.WHITELISTED_EMAIL_DOMAINS[0]
+        teacher = User.objects.create_user(
+            email=f"loadtest-{run_id}-teacher@{domain}",
+            role=User.UserRoleChoices.TEACHER,
+        )
+        course = Course.objects.create(name=f"loadtest-{run_id}", teacher_id=teacher)
+        session = Session.objects.create(
+            course_id=course,
+            salt=uuid.uuid4().hex,
+            face_recognition_enabled=options["face_recognition"],
+        )
+        students = User.objects.bulk_create(
+            User(email=f"loadtest-{run_id}-{i}@{domain}", password="!", role=User.UserRoleChoices.STUDENT)
+            for i in range(options["students"])
+        )
+        token = mint_token(session, expires_in=60 * 10)
+        requests = [str(AccessToken.for_user(student)) for student in students] * options["repeat"]
+
+        try:
+            db_before = self.db_stats()
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=options["concurrency"]) as executor:
+                results = [
+                    result
+                    for student_results in executor.map(
+                        lambda access: self.student(options["url"], token, access, options["face_status_polls"]),
+                        requests,
+                    )
+                    for result in student_results
+                ]
+            elapsed = time.perf_counter() - start
+            # Other backends publish their statistics at most once a second
+            time.sleep(1.5)
+            db_after = self.db_stats()
+
+            self.report(results, elapsed, db_before, db_after)
+        finally:
+            if not options["keep"]:
+                course.delete()
+                User.objects.filter(email__startswith=f"loadtest-{run_id}-").delete()
+
+    def student(self, url: str, token: str, access: str, face_status_polls: int) -> list[tuple[str, float, int, str]]:
+        latency, status, body = self.request(url, access, {"token": token})
+        results = [("check-in", latency, status, self.error_message(body) if status >= 400 else "")]
+        if status == 201 and (attendance_id := json.loads(body)["id"]):
+            for _ in range(face_status_polls):
+                latency, status, body = self.request(f"{url}{attendance_id}/face_status/", access)
+                results.append(("face status", latency, status, self.error_message(body) if status >= 400 else ""))
+        return results
+
+    def request(self, url: str, access: str, data: dict | None = None) -> tuple[float, int, bytes]:
+        request = urllib.request.Request(
+            url,
+            data=json.dumps(data).encode() if data is not None else None,
+            headers={"Content-Type": "application/json", "Authorization": f"Bearer {access}"},
+            method="POST" if data is not None else "GET",
+        )
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request, timeout=60) as response:
+                return time.perf_counter() - start, response.status, response.read()
+        except urllib.error.HTTPError as e:
+            return time.perf_counter() - start, e.code, e.read()
+        except OSError as e:
+            return time.perf_counter() - start, 0, type(e).__name__.encode()
+
+    @staticmethod
+    def error_message(body: bytes) -> str:
+        try:
+            errors = json.loads(body)
+        except ValueError:
+            return body.decode(errors="replace")[:80]
+        if isinstance(errors, dict):
+            return "; ".join(str(message) for messages in errors.values() for message in messages)
+        return str(errors)
+
+    def db_stats(self) -> dict[str, int]:
+        stats = {}
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT xact_commit + xact_rollback, tup_inserted, tup_updated "
+                "FROM pg_stat_database WHERE datname = current_database()"
+            )
+            stats["transactions"], stats["rows inserted"], stats["rows updated"] = cursor.fetchone()
+            try:
+                cursor.execute(
+                    "SELECT sum(calls) FROM pg_stat_statements "
+                    "WHERE dbid = (SELECT oid FROM pg_database WHERE datname = current_database())"
+                )
+                stats["queries"] = int(cursor.fetchone()[0] or 0)
+            except DatabaseError:
+                # pg_stat_statements is not installed, only report transactions and rows
+                pass
+        return stats
+
+    def report(
+        self, results: list[tuple[str, float, int, str]], elapsed: float, db_before: dict, db_after: dict
+    ) -> None:
+        self.stdout.write(f"requests:    {len(results)} in {elapsed:.2f} s")
+        self.stdout.write(f"throughput:  {len(results) / elapsed:.1f} req/s")
+        for endpoint in dict.fromkeys(endpoint for endpoint, _, _, _ in results):
+            latencies = sorted(latency * 1000 for name, latency, _, _ in results if name == endpoint)
+            percentiles = statistics.quantiles(latencies, n=100, method="inclusive")
+            self.stdout.write(
+                f"{endpoint + ':':<12} p50 {percentiles[49]:.1f} ms, p95 {percentiles[94]:.1f} ms, "
+                f"p99 {percentiles[98]:.1f} ms, max {latencies[-1]:.1f} ms"
+            )
+        outcomes = Counter((endpoint, status, message) for endpoint, _, status, message in results)
+        self.stdout.write("responses:")
+        for (endpoint, status, message), count in outcomes.most_common():
+            self.stdout.write(f"  {count:>6}  {endpoint} {status or 'connection error'} {message}".rstrip())
+        self.stdout.write("database:")
+        for name, value in db_after.items():
+            delta = value - db_before[name]
+            self.stdout.write(f"  {delta:>6}  {name} ({delta / len(results):.2f}/req)")
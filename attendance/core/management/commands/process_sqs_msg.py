@@ -1,142 +1,986 @@
+import http.server
 import json
 import logging
 import os
+import queue
+import random
 import re
+import signal
+import threading
 import time
+from datetime import datetime
+from pathlib import Path
 from typing import Any, Dict
 
 import boto3
+from botocore.config import Config
 from botocore.exceptions import ClientError
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
 from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connection, transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
 
+from attendance.core import metrics
+from attendance.core.checkin import mark_checked_in_many
+from attendance.core.counters import count_transition, state_of
+from attendance.core.faces import EMBEDDING_SUFFIX, Comparison, FaceComparator
+from attendance.core.images import normalize_jpeg
 from attendance.core.models import Attendance
 from attendance.users.models import User
 
 LOGGER = logging.getLogger(__name__)
 
 
-class FaceRecognitionProcessor:
+# SQS batch APIs take at most 10 entries
+BATCH_SIZE = 10
+# Retries for a delete that SQS failed on its side before the message is left to come back
+MAX_ACK_ATTEMPTS = 3
+# SQS' longest long poll
+MAX_WAIT_TIME = 20
+# Pause after a failed receive, doubling from 1 s up to a minute
+RECEIVE_BACKOFF_BASE = 1
+RECEIVE_BACKOFF_MAX = 60
+# Pause after an empty receive from a short poll, doubling from a tenth of a second
+IDLE_BACKOFF_BASE = 0.1
+# An attendance image that arrives before the student's init image is handled is put back
+# on the queue for INIT_IMAGE_RETRY_DELAY seconds, doubling every time, up to a limit
+INIT_IMAGE_RETRY_DELAY = 5
+MAX_INIT_IMAGE_DEFERRALS = 5
+# Seconds an attendance image waits for its init image in another message of the same receive
+# batch to be handled, before it is deferred like one whose init image hasn't arrived
+INIT_IMAGE_WAIT = 10
+# Throttled Rekognition calls are retried by botocore, whose adaptive mode also rate limits
+# the client once it is throttled, so the workers don't keep hitting the account's TPS limit
+CLIENT_CONFIGS = {"rekognition": Config(retries={"mode": "adaptive", "max_attempts": 8})}
+
+S3_EVENT_KEY = "s3:event:{bucket}:{key}:{version}"
+# {student id}/{attendance id}.jpeg, or {student id}/{attendance id}_init.jpeg for an init image
+OBJECT_KEY = re.compile(r"^(\d+)/(\d+)(?:_init)?\.jpeg$")
+
+# FACE_IMAGE_ORIGINALS values
+KEEP = "keep"
+REPLACE = "replace"
+# Where normalized copies go when the originals are kept. They end in .jpg, outside the media
+# bucket notification's .jpeg suffix filter, so they don't come back as S3 events.
+NORMALIZED_PREFIX = "normalized/"
+NORMALIZED_SUFFIX = ".jpg"
+# Marks normalized images, so an image isn't normalized twice
+NORMALIZED_METADATA = "normalized"
+
+# Seconds from an upload to its attendance record being updated, a backlog takes minutes
+LATENCY_BUCKETS = (0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+
+
+def event_key(bucket_name: str, s3_object: Dict[str, Any]) -> str | None:
+    """Identifies one upload of an object; None if the event carries neither a version id nor an ETag."""
+    version = s3_object.get("versionId") or s3_object.get("eTag")
+    if not version:
+        return None
+    return S3_EVENT_KEY.format(bucket=bucket_name, key=s3_object["key"], version=version)
+
+
+class InitImageNotReady(Exception):
+    """The student's init image hasn't been handled yet, so there is nothing to compare with."""
+
+
+def is_init_image(object_key: str) -> bool:
+    return object_key.endswith("_init.jpeg")
+
+
+def is_derived_object(object_key: str) -> bool:
+    """Objects the processor writes itself, which a notification without the .jpeg suffix filter sends back."""
+    return object_key.startswith(NORMALIZED_PREFIX) or object_key.endswith(EMBEDDING_SUFFIX)
+
+
+def init_image_students(message: Dict[str, Any]) -> list[int]:
+    """Students whose init image a message's S3 event carries, none for a test event or a malformed body."""
+    try:
+        keys = [s3_rec["s3"]["object"]["key"] for s3_rec in json.loads(message["Body"])["Records"]]
+    except (ValueError, KeyError, TypeError):
+        return []
+    return [int(match.group(1)) for key in keys if is_init_image(key) and (match := OBJECT_KEY.match(key))]
+
+
+def receive_count(message: Dict[str, Any]) -> int:
+    return int(message.get("Attributes", {}).get("ApproximateReceiveCount", 1))
+
+
+class Backoff:
+    """Exponential backoff with full jitter, so tasks that failed together don't retry together."""
+
+    def __init__(self, base: float, cap: float):
+        self.base = base
+        self.cap = cap
+        self.attempts = 0
+
+    def next(self) -> float:
+        limit = min(self.cap, self.base * 2**self.attempts)
+        if limit < self.cap:
+            self.attempts += 1
+        return random.uniform(0, limit)
+
+    def reset(self) -> None:
+        self.attempts = 0
+
+
+class InFlightMessages:
+    """
+    Receipt handles of received messages until they are acknowledged.
+
+    Successful messages are deleted with delete_message_batch, as soon as a
+    batch is full or on the next flush. While a message is in flight its
+    visibility timeout is extended before it runs out, so a slow Rekognition
+    call doesn't get the message delivered to another worker.
+    """
+
+    def __init__(self, processor: "FaceRecognitionProcessor", visibility_timeout: int):
+        self.processor = processor
+        self.visibility_timeout = visibility_timeout
+        self.lock = threading.Lock()
+        self.visible_until: dict[str, float] = {}
+        self.acks: list[tuple[str, int]] = []
+
+    def track(self, messages: list[Dict[str, Any]]) -> None:
+        visible_until = time.monotonic() + self.visibility_timeout
+        with self.lock:
+            for message in messages:
+                self.visible_until[message["ReceiptHandle"]] = visible_until
+
+    def forget(self, message: Dict[str, Any]) -> None:
+        with self.lock:
+            self.visible_until.pop(message["ReceiptHandle"], None)
+
+    def ack(self, message: Dict[str, Any]) -> None:
+        with self.lock:
+            self.visible_until.pop(message["ReceiptHandle"], None)
+            self.acks.append((message["ReceiptHandle"], 1))
+            full = len(self.acks) >= BATCH_SIZE
+        if full:
+            self.flush()
+
+    def flush(self) -> None:
+        # Entries that failed are retried on the next flush, not in a tight loop
+        with self.lock:
+            pending, self.acks = self.acks, []
+        for start in range(0, len(pending), BATCH_SIZE):
+            self.delete_batch(pending[start : start + BATCH_SIZE])
+
+    def delete_batch(self, batch: list[tuple[str, int]]) -> None:
+        entries = {str(i): ack for i, ack in enumerate(batch)}
+        try:
+            with self.processor.stage_seconds.time("ack"):
+                response = self.processor.sqs.delete_message_batch(
+                    QueueUrl=self.processor.queue_url,
+                    Entries=[
+                        {"Id": id, "ReceiptHandle": receipt_handle} for id, (receipt_handle, _) in entries.items()
+                    ],
+                )
+        except Exception as e:
+            LOGGER.error(f"Failed to delete message batch: {e}")
+            failed: list[Dict[str, Any]] = [
+                {"Id": id, "SenderFault": False, "Code": type(e).__name__} for id in entries
+            ]
+        else:
+            failed = response.get("Failed", [])
+
+        retries = []
+        for failure in failed:
+            receipt_handle, attempts = entries[failure["Id"]]
+            # Sender faults (e.g. an expired receipt handle) won't succeed on a retry, the message will come back
+            if failure.get("SenderFault") or attempts >= MAX_ACK_ATTEMPTS:
+                LOGGER.warning(f"Failed to delete message, it will be redelivered - code: {failure.get('Code')}")
+            else:
+                retries.append((receipt_handle, attempts + 1))
+        if retries:
+            with self.lock:
+                self.acks.extend(retries)
+
+    def heartbeat(self) -> None:
+        """Extend the visibility of messages that have less than half of their timeout left."""
+        now = time.monotonic()
+        with self.lock:
+            expiring = [
+                receipt_handle
+                for receipt_handle, visible_until in self.visible_until.items()
+                if visible_until - now < self.visibility_timeout / 2
+            ]
+
+        for start in range(0, len(expiring), BATCH_SIZE):
+            batch = {str(i): receipt_handle for i, receipt_handle in enumerate(expiring[start : start + BATCH_SIZE])}
+            try:
+                response = self.processor.sqs.change_message_visibility_batch(
+                    QueueUrl=self.processor.queue_url,
+                    Entries=[
+                        {"Id": id, "ReceiptHandle": receipt_handle, "VisibilityTimeout": self.visibility_timeout}
+                        for id, receipt_handle in batch.items()
+                    ],
+                )
+            except Exception as e:
+                LOGGER.error(f"Failed to extend message visibility: {e}")
+                continue
+
+            visible_until = time.monotonic() + self.visibility_timeout
+            with self.lock:
+                for success in response.get("Successful", []):
+                    receipt_handle = batch[success["Id"]]
+                    if receipt_handle in self.visible_until:
+                        self.visible_until[receipt_handle] = visible_until
+                for failure in response.get("Failed", []):
+                    # Already deleted or handed to another consumer, nothing left to extend
+                    self.visible_until.pop(batch[failure["Id"]], None)
+                    LOGGER.warning(f"Failed to extend message visibility - code: {failure.get('Code')}")
+
+    def maintain(self, done: threading.Event) -> None:
+        # Often enough to catch every message before its timeout runs out, at most once a second
+        interval = min(1, self.visibility_timeout / 4)
+        while not done.wait(interval):
+            try:
+                self.flush()
+                self.heartbeat()
+            except Exception as e:
+                LOGGER.error(f"Error maintaining in-flight messages: {e}")
+        self.flush()
+
+
+class FaceRecognitionResults:
+    """Database writes of handled messages, applied together in one transaction."""
+
     def __init__(self):
-        self.sqs = boto3.client("sqs")
-        self.s3 = boto3.client("s3")
-        self.rekognition = boto3.client("rekognition")
+        # attendance id -> (face recognition status, object key)
+        self.attendances: dict[int, tuple[str, str]] = {}
+        # Attendance images left for one compare_batch call, as (attendance id, object key, bucket, comparison)
+        self.comparisons: list[tuple[int, str, str, Comparison]] = []
+        # students whose init image was copied -> FaceId it was indexed with, empty if it wasn't
+        self.init_images: dict[int, str] = {}
+        # FaceIds of the init images these replace, deleted from the collection once committed
+        self.replaced_faces: list[str] = []
+        # S3 events handled, remembered once committed
+        self.events: list[str] = []
+        # When the handled objects were uploaded, for the end-to-end latency
+        self.event_times: list[datetime] = []
+
+    def __bool__(self) -> bool:
+        return bool(self.attendances or self.init_images or self.comparisons)
+
+    def update(self, other: "FaceRecognitionResults") -> None:
+        self.attendances.update(other.attendances)
+        self.comparisons += other.comparisons
+        self.init_images.update(other.init_images)
+        self.replaced_faces += other.replaced_faces
+        self.events += other.events
+        self.event_times += other.event_times
+
+
+class ReceiveBatch:
+    """
+    The messages of one receive call. Their results are written once the last
+    of them has been handled, and only then are they acknowledged.
+
+    Init images are only written to their users then too, so the workers share
+    the batch's results: an attendance image whose init image is in another
+    message of the batch waits for it instead of being deferred.
+    """
+
+    def __init__(self, messages: list[Dict[str, Any]]):
+        self.lock = threading.Lock()
+        self.remaining = len(messages)
+        self.handled: list[Dict[str, Any]] = []
+        self.results = FaceRecognitionResults()
+        # message id with init images -> set once it has been handled
+        self.init_image_messages: dict[str, threading.Event] = {}
+        # student id -> the event of the (last) message with their init image
+        self.init_images_ready: dict[int, threading.Event] = {}
+        for message in messages:
+            if students := init_image_students(message):
+                ready = self.init_image_messages[message["MessageId"]] = threading.Event()
+                self.init_images_ready.update(dict.fromkeys(students, ready))
+
+    def carries_init_images(self, message: Dict[str, Any]) -> bool:
+        return message["MessageId"] in self.init_image_messages
+
+    def init_image(self, student_id: int, timeout: float) -> str | None:
+        """
+        The FaceId of the student's init image if another message of the batch
+        carries it, waiting up to ``timeout`` seconds for that message to be
+        handled. None if none does, or it failed or didn't finish in time.
+        """
+        ready = self.init_images_ready.get(student_id)
+        if ready is None or not ready.wait(timeout):
+            return None
+        with self.lock:
+            return self.results.init_images.get(student_id)
+
+    def done(self, message: Dict[str, Any], results: FaceRecognitionResults | None) -> bool:
+        """Record a handled message, ``results`` is None if it failed. True for the batch's last message."""
+        with self.lock:
+            if results is not None:
+                self.handled.append(message)
+                self.results.update(results)
+            self.remaining -= 1
+            last = self.remaining == 0
+        if ready := self.init_image_messages.get(message["MessageId"]):
+            ready.set()
+        return last
+
+
+class FaceRecognitionProcessor:
+    def __init__(
+        self,
+        concurrency: int = 1,
+        wait_time: int = 20,
+        visibility_timeout: int = 30,
+        comparator_class=None,
+        session_factory=boto3.session.Session,
+    ):
         self.queue_url = os.environ.get("SQS_QUEUE_URL")
+        if settings.FACE_IMAGE_ORIGINALS not in (KEEP, REPLACE):
+            raise ImproperlyConfigured(f"FACE_IMAGE_ORIGINALS must be {KEEP!r} or {REPLACE!r}")
+        self.concurrency = concurrency
+        self.wait_time = wait_time
+        self.in_flight = InFlightMessages(self, visibility_timeout)
+        self.session_factory = session_factory
+        self.clients = threading.local()
+        comparator_class = comparator_class or import_string(settings.FACE_COMPARATOR)
+        self.comparator: FaceComparator = comparator_class(self.client)
+        self.stopping = threading.Event()
+        self.stats_lock = threading.Lock()
+        self.processed = self.failed = 0
+        self.stage_seconds = metrics.Histogram(
+            "face_recognition_stage_seconds", "Time spent in each stage of handling messages", label="stage"
+        )
+        self.event_latency = metrics.Histogram(
+            "face_recognition_event_latency_seconds",
+            "Time from an S3 upload to its attendance record being updated",
+            buckets=LATENCY_BUCKETS,
+        )
+        self.messages_received = metrics.Counter("face_recognition_messages_received_total", "Messages received")
+        self.messages_failed = metrics.Counter(
+            "face_recognition_messages_failed_total", "Messages left on the queue after a failure"
+        )
+        self.invalid_keys = metrics.Counter(
+            "face_recognition_invalid_keys_total", "S3 records for object keys that aren't face images"
+        )
+        self.messages_deferred = metrics.Counter(
+            "face_recognition_messages_deferred_total", "Messages put back until the student's init image is handled"
+        )
+        self.queue_backlog = metrics.Gauge(
+            "face_recognition_queue_backlog", "Messages waiting on the queue, as last sampled"
+        )
+        self.receive_backoff = Backoff(RECEIVE_BACKOFF_BASE, RECEIVE_BACKOFF_MAX)
+        # Receives that come back empty from a short poll back off until they add up to a long one
+        self.idle_backoff = Backoff(IDLE_BACKOFF_BASE, max(MAX_WAIT_TIME - wait_time, 0))
+
+    def client(self, service_name: str):
+        # boto3's default session isn't thread safe, so every worker builds its clients from its own session
+        clients = self.clients.__dict__
+        if service_name not in clients:
+            if "session" not in clients:
+                clients["session"] = self.session_factory()
+            clients[service_name] = clients["session"].client(service_name, config=CLIENT_CONFIGS.get(service_name))
+        return clients[service_name]
+
+    @property
+    def sqs(self):
+        return self.client("sqs")
 
-    def process_message(self, message: Dict[str, Any]) -> None:
+    @property
+    def s3(self):
+        return self.client("s3")
+
+    def process_message(self, message: Dict[str, Any], batch: ReceiveBatch | None = None) -> FaceRecognitionResults:
+        results = FaceRecognitionResults()
         try:
-            s3_event = json.loads(message["Body"])
+            with self.stage_seconds.time("parse"):
+                s3_event = json.loads(message["Body"])
+
+                if "Event" in s3_event and s3_event["Event"] == "s3:TestEvent":
+                    return results
 
-            if "Event" in s3_event and s3_event["Event"] == "s3:TestEvent":
-                return
+                records = [
+                    (s3_rec, event_key(s3_rec["s3"]["bucket"]["name"], s3_rec["s3"]["object"]))
+                    for s3_rec in s3_event["Records"]
+                ]
+                # Init images first, the attendance images of the same students are compared with them
+                records.sort(key=lambda record: not is_init_image(record[0]["s3"]["object"]["key"]))
+            with self.stage_seconds.time("dedup"):
+                handled = self.handled_events([key for _, key in records if key])
 
-            for s3_rec in s3_event["Records"]:
+            for s3_rec, key in records:
                 bucket_name: str = s3_rec["s3"]["bucket"]["name"]
                 object_key: str = s3_rec["s3"]["object"]["key"]
+                if is_derived_object(object_key):
+                    LOGGER.debug(f"Skipping S3 Record for a derived object: {bucket_name}/{object_key}")
+                    continue
+                if key in handled:
+                    LOGGER.info(f"Skipping S3 Record already handled: {bucket_name}/{object_key}")
+                    metrics.incr(metrics.S3_EVENTS_DUPLICATE_SKIPPED)
+                    if not is_init_image(object_key):
+                        metrics.incr(metrics.FACE_COMPARISONS_SKIPPED)
+                    continue
                 LOGGER.info(f"Processing S3 Record: {bucket_name}/{object_key}")
 
                 # Validate object key format
-                REGEX = r"^(\d+)/(\d+)(?:_init)?\.jpeg$"
-                match_obj = re.match(REGEX, object_key)
+                match_obj = OBJECT_KEY.match(object_key)
                 if not match_obj:
                     LOGGER.warning(f"Invalid object key format: {object_key}")
-                    return
+                    self.invalid_keys.inc()
+                    return results
 
                 # Parse the object key
                 student_id = int(match_obj.group(1))
                 attendance_id = int(match_obj.group(2))
-                is_init = "_init" in object_key
-
-                if is_init:
-                    self.handle_init_image(bucket_name, object_key, student_id, attendance_id)
+                if is_init_image(object_key):
+                    self.handle_init_image(bucket_name, object_key, student_id, attendance_id, results)
                 else:
-                    self.handle_attendance_image(bucket_name, object_key, student_id, attendance_id)
+                    self.handle_attendance_image(
+                        bucket_name,
+                        object_key,
+                        student_id,
+                        attendance_id,
+                        results,
+                        receives=receive_count(message),
+                        batch=batch,
+                    )
+                if key:
+                    results.events.append(key)
+                if "eventTime" in s3_rec:
+                    results.event_times.append(datetime.fromisoformat(s3_rec["eventTime"]))
 
+        except InitImageNotReady:
+            raise
         except Exception as e:
             LOGGER.error(f"Error processing message: {e}")
             raise
+        return results
 
-    def handle_init_image(self, bucket_name, object_key: str, student_id: str, attendance_id: str) -> None:
+    def handled_events(self, keys: list[str]) -> dict:
+        if not keys:
+            return {}
+        try:
+            return cache.get_many(keys)
+        except Exception as e:
+            # Without the cache every event is handled, as if it were new
+            LOGGER.error(f"Failed to look up handled S3 events: {e}")
+            return {}
+
+    def remember_events(self, keys: list[str]) -> None:
+        try:
+            cache.set_many(dict.fromkeys(keys, True), timeout=settings.S3_EVENT_DEDUP_TTL)
+        except Exception as e:
+            LOGGER.error(f"Failed to remember handled S3 events: {e}")
+
+    def handle_init_image(
+        self, bucket_name, object_key: str, student_id: int, attendance_id: int, results: FaceRecognitionResults
+    ) -> None:
         LOGGER.info(f"Copying init image to {student_id}/init.jpeg")
         try:
-            self.s3.copy_object(
-                Bucket=bucket_name, CopySource=f"{bucket_name}/{object_key}", Key=f"{student_id}/init.jpeg"
-            )
-            User.objects.filter(id=student_id).update(init_image=True)
-            self.update_attendance_record(attendance_id, Attendance.FaceRecognitionStatus.SUCCESS, object_key)
+            source = self.normalize_image(bucket_name, object_key, results)
+            with self.stage_seconds.time("copy"):
+                self.s3.copy_object(
+                    Bucket=bucket_name, CopySource=f"{bucket_name}/{source}", Key=f"{student_id}/init.jpeg"
+                )
+            with self.stage_seconds.time("enroll"):
+                face_id = self.comparator.enroll(bucket_name, f"{student_id}/init.jpeg", student_id)
+            if face_id:
+                previous = User.objects.filter(id=student_id).values_list("face_id", flat=True).first()
+                if previous and previous != face_id:
+                    results.replaced_faces.append(previous)
+            results.init_images[student_id] = face_id
+            results.attendances[attendance_id] = (Attendance.FaceRecognitionStatus.SUCCESS, object_key)
         except ClientError as e:
             LOGGER.error(f"Failed to copy init image: {e}")
             raise
 
-    def handle_attendance_image(self, bucket_name: str, object_key: str, student_id: str, attendance_id: str) -> None:
-        LOGGER.info(f"Comparing face with {student_id}/init.jpeg")
+    def handle_attendance_image(
+        self,
+        bucket_name: str,
+        object_key: str,
+        student_id: int,
+        attendance_id: int,
+        results: FaceRecognitionResults,
+        receives: int | None = None,
+        batch: ReceiveBatch | None = None,
+    ) -> None:
+        """
+        Compare an attendance image with the student's init image, or leave it
+        for the receive batch's compare_batch call if the comparator compares in
+        batches. If the init image hasn't been handled yet, in this message,
+        another message of ``batch`` or an earlier batch, raises
+        InitImageNotReady for the message received ``receives`` times to be
+        deferred, up to MAX_INIT_IMAGE_DEFERRALS times.
+        """
+        if student_id in results.init_images:
+            # Handled earlier in the same message
+            init_image, face_id = True, results.init_images[student_id]
+        elif batch is not None and (batch_face_id := batch.init_image(student_id, INIT_IMAGE_WAIT)) is not None:
+            # Handled by another worker, but only written with the rest of the batch
+            init_image, face_id = True, batch_face_id
+        else:
+            row = User.objects.filter(id=student_id).values_list("init_image", "face_id").first()
+            # No init image is coming for a student who doesn't exist, there's nothing to wait for
+            init_image, face_id = row or (True, "")
+        if not init_image:
+            if receives is not None and receives <= MAX_INIT_IMAGE_DEFERRALS:
+                raise InitImageNotReady(f"Student {student_id} has no init image yet")
+            LOGGER.warning(f"Student {student_id} still has no init image, comparing {object_key} anyway")
+        if not self.comparator.uses_face_ids:
+            face_id = ""
+
+        target_image = self.normalize_image(bucket_name, object_key, results)
+        if self.comparator.compares_in_batches:
+            results.comparisons.append((attendance_id, object_key, bucket_name, (student_id, face_id, target_image)))
+            return
+        with self.stage_seconds.time("compare"):
+            matched = self.comparator.compare(bucket_name, student_id, face_id, target_image)
+        self.record_comparison(attendance_id, object_key, matched, results)
+
+    def compare_batch(self, results: FaceRecognitionResults) -> None:
+        """Compare the attendance images a receive batch collected, with one compare_batch call per bucket."""
+        buckets: dict[str, list] = {}
+        for attendance_id, object_key, bucket_name, comparison in results.comparisons:
+            buckets.setdefault(bucket_name, []).append((attendance_id, object_key, comparison))
+        for bucket_name, pending in buckets.items():
+            matches = self.comparator.compare_batch(bucket_name, [comparison for _, _, comparison in pending])
+            for (attendance_id, object_key, _), matched in zip(pending, matches):
+                self.record_comparison(attendance_id, object_key, matched, results)
+        results.comparisons = []
+
+    def record_comparison(
+        self, attendance_id: int, object_key: str, matched: bool, results: FaceRecognitionResults
+    ) -> None:
         face_compare_result = Attendance.FaceRecognitionStatus.FAILED
-        if self.compare_face(bucket_name, f"{student_id}/init.jpeg", object_key):
+        if matched:
             face_compare_result = Attendance.FaceRecognitionStatus.SUCCESS
 
         LOGGER.info(f"Face compare result: {face_compare_result}")
-        self.update_attendance_record(attendance_id, face_compare_result, object_key)
-
-    def compare_face(self, bucket_name: str, init_image: str, target_image: str) -> bool:
-        try:
-            response = self.rekognition.compare_faces(
-                SourceImage={
-                    "S3Object": {
-                        "Bucket": bucket_name,
-                        "Name": init_image,
-                    }
-                },
-                TargetImage={
-                    "S3Object": {
-                        "Bucket": bucket_name,
-                        "Name": target_image,
-                    }
-                },
+        results.attendances[attendance_id] = (face_compare_result, object_key)
+
+    def normalize_image(self, bucket_name: str, object_key: str, results: FaceRecognitionResults) -> str:
+        """Normalize the uploaded image if FACE_IMAGE_NORMALIZE is set, returning the key of the image to use."""
+        if not settings.FACE_IMAGE_NORMALIZE:
+            return object_key
+        with self.stage_seconds.time("normalize"):
+            return self.normalize_object(bucket_name, object_key, results)
+
+    def normalize_object(self, bucket_name: str, object_key: str, results: FaceRecognitionResults) -> str:
+        response = self.s3.get_object(Bucket=bucket_name, Key=object_key)
+        if NORMALIZED_METADATA in response.get("Metadata", {}):
+            return object_key
+        original = response["Body"].read()
+        try:
+            normalized = normalize_jpeg(original, settings.FACE_IMAGE_MAX_SIZE)
+        except Exception as e:
+            # Let the comparison reject it
+            LOGGER.warning(f"Failed to normalize {object_key}: {e}")
+            return object_key
+        if len(normalized) >= len(original):
+            return object_key
+
+        replace = settings.FACE_IMAGE_ORIGINALS == REPLACE
+        key = object_key if replace else f"{NORMALIZED_PREFIX}{object_key.removesuffix('.jpeg')}{NORMALIZED_SUFFIX}"
+        LOGGER.info(f"Normalized {object_key} from {len(original)} to {len(normalized)} bytes")
+        response = self.s3.put_object(
+            Bucket=bucket_name,
+            Key=key,
+            Body=normalized,
+            ContentType="image/jpeg",
+            Metadata={NORMALIZED_METADATA: "1"},
+        )
+        if replace:
+            # The upload it replaces is being handled, so the event for the replacement is skipped
+            s3_object = {"key": key, "versionId": response.get("VersionId"), "eTag": response["ETag"].strip('"')}
+            if replaced := event_key(bucket_name, s3_object):
+                results.events.append(replaced)
+        return key
+
+    def update_attendance_record(self, attendance_id: int, face_recognition_status: str, object_key: str) -> None:
+        results = FaceRecognitionResults()
+        results.attendances[attendance_id] = (face_recognition_status, object_key)
+        self.write_results(results)
+
+    def write_results(self, results: FaceRecognitionResults) -> None:
+        """Apply a batch's results with one UPDATE for users and one for attendance records."""
+        with transaction.atomic():
+            if results.init_images:
+                # A new init image without an indexed face clears the previous one's FaceId too
+                User.objects.bulk_update(
+                    [User(id=id, init_image=True, face_id=face_id) for id, face_id in results.init_images.items()],
+                    ["init_image", "face_id"],
+                )
+
+            # Lock in id order, so tasks writing overlapping batches can't deadlock. Only the
+            # attendance rows, the teacher id joined in for the cache keys needs no lock
+            before = {
+                row["id"]: row
+                for row in Attendance.objects.select_for_update(of=("self",))
+                .filter(id__in=results.attendances)
+                .order_by("id")
+                .values(
+                    "id",
+                    "session_id",
+                    "session_id__course_id__teacher_id",
+                    "student_id",
+                    "is_present",
+                    "face_recognition_status",
+                )
+            }
+            updated = [
+                Attendance(
+                    id=attendance_id,
+                    face_image=object_key,
+                    face_recognition_status=face_recognition_status,
+                    is_present=face_recognition_status == Attendance.FaceRecognitionStatus.SUCCESS,
+                )
+                for attendance_id, (face_recognition_status, object_key) in results.attendances.items()
+                if attendance_id in before
+            ]
+            Attendance.objects.bulk_update(updated, ["face_image", "face_recognition_status", "is_present"])
+            for attendance in updated:
+                row = before[attendance.id]
+                count_transition(
+                    row["session_id"],
+                    state_of(row["is_present"], row["face_recognition_status"]),
+                    state_of(attendance.is_present, attendance.face_recognition_status),
+                )
+        LOGGER.info(
+            f"Successfully updated {len(updated)} attendance records and {len(results.init_images)} init images"
+        )
+
+        # Let check-in retries for these sessions be rejected from the cache
+        mark_checked_in_many(
+            [
+                (row["session_id__course_id__teacher_id"], row["session_id"], row["student_id"])
+                for row in (before[attendance.id] for attendance in updated if attendance.is_present)
+            ]
+        )
+
+    def count(self, processed: int, failed: int) -> None:
+        with self.stats_lock:
+            self.processed += processed
+            self.failed += failed
+        if processed:
+            metrics.incr(metrics.SQS_MESSAGES_PROCESSED, processed)
+        if failed:
+            metrics.incr(metrics.SQS_MESSAGES_FAILED, failed)
+            self.messages_failed.inc(amount=failed)
+
+    def handle_message(
+        self, message: Dict[str, Any], batch: ReceiveBatch | None = None
+    ) -> FaceRecognitionResults | None:
+        # Worker threads keep their connection between messages, like a request cycle would
+        close_old_connections()
+        try:
+            return self.process_message(message, batch)
+        except InitImageNotReady as e:
+            self.defer_message(message, str(e))
+            return None
+        except Exception as e:
+            LOGGER.error(f"Failed to process message: {e}")
+            # Don't delete message on failure - it will return to queue
+            self.in_flight.forget(message)
+            self.count(processed=0, failed=1)
+            return None
+
+    def defer_message(self, message: Dict[str, Any], reason: str) -> None:
+        """Put a message back on the queue for later, without counting it as failed."""
+        delay = INIT_IMAGE_RETRY_DELAY * 2 ** (receive_count(message) - 1)
+        LOGGER.info(f"Deferring message for {delay} s: {reason}")
+        self.in_flight.forget(message)
+        self.messages_deferred.inc()
+        try:
+            self.sqs.change_message_visibility(
+                QueueUrl=self.queue_url, ReceiptHandle=message["ReceiptHandle"], VisibilityTimeout=delay
             )
-            return len(response["FaceMatches"]) > 0
+        except Exception as e:
+            # It comes back once its visibility timeout runs out
+            LOGGER.error(f"Failed to defer message: {e}")
 
-        except self.rekognition.exceptions.InvalidParameterException:
-            return False
+    def commit(self, batch: ReceiveBatch) -> None:
+        """Write a receive batch's results, then acknowledge its messages."""
+        if not batch.handled:
+            return
+        try:
+            if batch.results.comparisons:
+                with self.stage_seconds.time("compare"):
+                    self.compare_batch(batch.results)
+            if batch.results:
+                with self.stage_seconds.time("db_update"):
+                    self.write_results(batch.results)
+        except Exception as e:
+            LOGGER.error(f"Failed to compare faces or update attendance records: {e}")
+            # Nothing was written, every message of the batch returns to the queue
+            for message in batch.handled:
+                self.in_flight.forget(message)
+            self.count(processed=0, failed=len(batch.handled))
+            # The faces were indexed again with new FaceIds on the next delivery
+            if indexed := [face_id for face_id in batch.results.init_images.values() if face_id]:
+                self.comparator.delete_faces(indexed)
+            return
+        finally:
+            close_old_connections()
+
+        now = timezone.now()
+        for event_time in batch.results.event_times:
+            self.event_latency.observe((now - event_time).total_seconds())
+        if batch.results.events:
+            self.remember_events(batch.results.events)
+        if batch.results.replaced_faces:
+            self.comparator.delete_faces(batch.results.replaced_faces)
 
-    def update_attendance_record(self, attendance_id: str, face_recognition_status: str, object_key: str) -> None:
+        # Delete messages only once their results are committed, batched with the other workers'
+        for message in batch.handled:
+            self.in_flight.ack(message)
+        self.count(processed=len(batch.handled), failed=0)
+
+    def release_message(self, message: Dict[str, Any]) -> None:
+        # Make a message that was received but never started visible to other tasks right away
+        self.in_flight.forget(message)
         try:
-            Attendance.objects.filter(id=attendance_id).update(
-                face_image=object_key,
-                face_recognition_status=face_recognition_status,
-                is_present=True if face_recognition_status == Attendance.FaceRecognitionStatus.SUCCESS else False,
+            self.sqs.change_message_visibility(
+                QueueUrl=self.queue_url, ReceiptHandle=message["ReceiptHandle"], VisibilityTimeout=0
             )
-            LOGGER.info(
-                f"Successfully updated attendance record - id: {attendance_id}, " f"status: {face_recognition_status}"
+        except Exception as e:
+            LOGGER.error(f"Failed to release message: {e}")
+
+    def work(self, messages: queue.Queue, slots: threading.Semaphore) -> None:
+        try:
+            while (item := messages.get()) is not None:
+                message, batch = item
+                try:
+                    results = None
+                    if self.stopping.is_set():
+                        self.release_message(message)
+                    else:
+                        results = self.handle_message(message, batch)
+                    # The worker that finishes a batch's last message writes the whole batch
+                    if batch.done(message, results):
+                        self.commit(batch)
+                finally:
+                    slots.release()
+        finally:
+            connection.close()
+
+    def acquire_slots(self, slots: threading.Semaphore) -> int:
+        """Wait for an idle worker, then take every idle worker up to a full receive batch."""
+        while not slots.acquire(timeout=1):
+            if self.stopping.is_set():
+                return 0
+        free = 1
+        while free < 10 and slots.acquire(blocking=False):
+            free += 1
+        return free
+
+    def log_throughput(self, since: float, processed: int, failed: int) -> tuple[float, int, int]:
+        now = time.monotonic()
+        with self.stats_lock:
+            total_processed, total_failed = self.processed, self.failed
+        count = total_processed - processed + total_failed - failed
+        LOGGER.info(
+            f"Handled {count} messages in {now - since:.0f} s ({count / (now - since):.2f} msg/s), "
+            f"failed: {total_failed - failed}, concurrency: {self.concurrency}"
+        )
+        return now, total_processed, total_failed
+
+    def sample_backlog(self) -> None:
+        """
+        Publish the queue's backlog as a scaling signal: every task sends the
+        messages waiting and its number of workers to CloudWatch, so the backlog
+        per worker is MAX(QueueBacklog) / SUM(Workers) over each period.
+        """
+        try:
+            response = self.sqs.get_queue_attributes(
+                QueueUrl=self.queue_url, AttributeNames=["ApproximateNumberOfMessages"]
             )
+            backlog = int(response["Attributes"]["ApproximateNumberOfMessages"])
+        except Exception as e:
+            LOGGER.error(f"Failed to sample the queue backlog: {e}")
+            return
+        self.queue_backlog.set(backlog)
+        LOGGER.info(f"Queue backlog: {backlog} messages, {backlog / self.concurrency:.1f} per worker of this task")
 
+        if not settings.SQS_PROCESSOR_METRICS_NAMESPACE:
+            return
+        dimensions = [{"Name": "QueueName", "Value": (self.queue_url or "").rsplit("/", 1)[-1]}]
+        try:
+            self.client("cloudwatch").put_metric_data(
+                Namespace=settings.SQS_PROCESSOR_METRICS_NAMESPACE,
+                MetricData=[
+                    {"MetricName": "QueueBacklog", "Dimensions": dimensions, "Value": backlog, "Unit": "Count"},
+                    {"MetricName": "Workers", "Dimensions": dimensions, "Value": self.concurrency, "Unit": "Count"},
+                ],
+            )
         except Exception as e:
-            LOGGER.error(f"Failed to update attendance record: {e}")
-            raise e
+            LOGGER.error(f"Failed to publish the queue backlog: {e}")
 
-    def run(self):
-        while True:
-            try:
-                response = self.sqs.receive_message(
-                    QueueUrl=self.queue_url, MaxNumberOfMessages=10, WaitTimeSeconds=20
-                )
+    def pause(self, seconds: float) -> None:
+        """Sleep, unless the processor is stopped."""
+        self.stopping.wait(seconds)
 
-                if "Messages" in response:
-                    for message in response["Messages"]:
-                        try:
-                            self.process_message(message)
-                            # Delete message after successful processing
-                            self.sqs.delete_message(QueueUrl=self.queue_url, ReceiptHandle=message["ReceiptHandle"])
-                        except Exception as e:
-                            LOGGER.error(f"Failed to process message: {e}")
-                            # Don't delete message on failure - it will return to queue
-                            continue
-            except Exception as e:
-                LOGGER.error(f"Error in main processing loop: {e}")
-                time.sleep(5)  # Prevent tight loop on persistent errors
+    def render_metrics(self) -> str:
+        return metrics.render(
+            self.messages_received,
+            self.messages_failed,
+            self.messages_deferred,
+            self.invalid_keys,
+            self.queue_backlog,
+            self.stage_seconds,
+            self.event_latency,
+        )
+
+    def dump_metrics(self, path: str) -> None:
+        """Write the metrics for node_exporter's textfile collector, replaced atomically so it never reads half."""
+        try:
+            temporary = Path(f"{path}.{os.getpid()}.tmp")
+            temporary.write_text(self.render_metrics())
+            os.replace(temporary, path)
+        except OSError as e:
+            LOGGER.error(f"Failed to write metrics to {path}: {e}")
+
+    def serve_metrics(self, port: int) -> http.server.ThreadingHTTPServer:
+        """Serve the metrics for Prometheus to scrape on a background thread, shut down by the caller."""
+        processor = self
+
+        class MetricsHandler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = processor.render_metrics().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                LOGGER.debug(f"Metrics request: {format % args}")
+
+        server = http.server.ThreadingHTTPServer(("", port), MetricsHandler)
+        threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+        LOGGER.info(f"Serving metrics on port {server.server_address[1]}")
+        return server
+
+    def run(self, stats_interval: int = 60, metrics_file: str | None = None, backlog_interval: int = 60):
+        messages: queue.Queue[tuple[Dict[str, Any], ReceiveBatch] | None] = queue.Queue()
+        # Only receive as many messages as there are idle workers, the rest stay visible to other tasks
+        slots = threading.Semaphore(self.concurrency)
+        workers = [
+            threading.Thread(target=self.work, args=(messages, slots), name=f"processor-{i}")
+            for i in range(self.concurrency)
+        ]
+        for worker in workers:
+            worker.start()
+        maintenance_done = threading.Event()
+        maintenance = threading.Thread(target=self.in_flight.maintain, args=(maintenance_done,), name="maintenance")
+        maintenance.start()
+
+        since, processed, failed = time.monotonic(), 0, 0
+        started, sampled = since, float("-inf")
+        try:
+            while not self.stopping.is_set():
+                if time.monotonic() - since >= stats_interval:
+                    since, processed, failed = self.log_throughput(since, processed, failed)
+                    if metrics_file:
+                        self.dump_metrics(metrics_file)
+                if backlog_interval and time.monotonic() - sampled >= backlog_interval:
+                    sampled = time.monotonic()
+                    self.sample_backlog()
+
+                if not (free := self.acquire_slots(slots)):
+                    break
+                try:
+                    with self.stage_seconds.time("receive"):
+                        response = self.sqs.receive_message(
+                            QueueUrl=self.queue_url,
+                            MaxNumberOfMessages=free,
+                            WaitTimeSeconds=self.wait_time,
+                            VisibilityTimeout=self.in_flight.visibility_timeout,
+                            MessageSystemAttributeNames=["ApproximateReceiveCount"],
+                        )
+                except Exception as e:
+                    delay = self.receive_backoff.next()
+                    LOGGER.error(f"Error in main processing loop, retrying in {delay:.1f} s: {e}")
+                    for _ in range(free):
+                        slots.release()
+                    self.pause(delay)
+                    continue
+                self.receive_backoff.reset()
+
+                received = response.get("Messages", [])
+                self.messages_received.inc(amount=len(received))
+                if received:
+                    self.idle_backoff.reset()
+                elif self.wait_time < MAX_WAIT_TIME:
+                    # A long poll waits for messages on SQS' side, shorter ones would spin on an idle queue
+                    self.pause(self.idle_backoff.next())
+                self.in_flight.track(received)
+                for _ in range(free - len(received)):
+                    slots.release()
+                batch = ReceiveBatch(received)
+                # Workers start on init images first, so the batch's attendance images find them handled
+                for message in sorted(received, key=lambda message: not batch.carries_init_images(message)):
+                    messages.put((message, batch))
+        finally:
+            # Messages already started finish, the ones still queued are released by the workers
+            for _ in workers:
+                messages.put(None)
+            for worker in workers:
+                worker.join()
+            # Sends the acknowledgements that are left
+            maintenance_done.set()
+            maintenance.join()
+            self.log_throughput(started, 0, 0)
+            if metrics_file:
+                self.dump_metrics(metrics_file)
+
+    def stop(self, *args) -> None:
+        LOGGER.info("Stopping, waiting for in-flight messages")
+        self.stopping.set()
 
 
 class Command(BaseCommand):
     help = "Process messages from SQS"
 
+    def add_arguments(self, parser):
+        parser.add_argument("--concurrency", type=int, default=1, help="Messages processed in parallel")
+        parser.add_argument(
+            "--wait-time", type=int, default=20, help="Long poll seconds, also bounds how long SIGTERM takes"
+        )
+        parser.add_argument(
+            "--visibility-timeout",
+            type=int,
+            default=30,
+            help="Seconds a received message stays invisible, extended while it is being processed",
+        )
+        parser.add_argument("--stats-interval", type=int, default=60, help="Seconds between throughput logs")
+        parser.add_argument(
+            "--metrics-port", type=int, default=0, help="Serve Prometheus metrics on this port, 0 to not serve them"
+        )
+        parser.add_argument(
+            "--metrics-file", help="Also write the Prometheus metrics to this file every stats interval"
+        )
+        parser.add_argument(
+            "--backlog-interval",
+            type=int,
+            default=60,
+            help="Seconds between samples of the queue backlog published for autoscaling, 0 to not sample it",
+        )
+
     def handle(self, *args, **options):
-        processor = FaceRecognitionProcessor()
-        processor.run()
+        processor = FaceRecognitionProcessor(
+            concurrency=options["concurrency"],
+            wait_time=options["wait_time"],
+            visibility_timeout=options["visibility_timeout"],
+        )
+        signal.signal(signal.SIGTERM, processor.stop)
+        signal.signal(signal.SIGINT, processor.stop)
+        server = processor.serve_metrics(options["metrics_port"]) if options["metrics_port"] else None
+        try:
+            processor.run(
+                stats_interval=options["stats_interval"],
+                metrics_file=options["metrics_file"],
+                backlog_interval=options["backlog_interval"],
+            )
+        finally:
+            if server:
+                server.shutdown()
@@ -0,0 +1,42 @@
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from django.utils import timezone
+
+from attendance.core.counters import STATES, count_keys, counts_from_db, set_counts
+from attendance.core.models import SESSION_CACHE_TIMEOUT, Session
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild the live per-session attendance counters from SQL. By default every session that is still "
+        "running or started within the session cache timeout is reconciled."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--session", type=int, action="append", dest="sessions", help="Session id, repeatable")
+
+    def handle(self, *args, **options):
+        session_ids = options["sessions"]
+        if not session_ids:
+            since = timezone.now() - timedelta(seconds=SESSION_CACHE_TIMEOUT)
+            session_ids = list(
+                Session.objects.filter(Q(end_time__isnull=True) | Q(start_time__gte=since)).values_list(
+                    "id", flat=True
+                )
+            )
+
+        counts = counts_from_db(session_ids)
+        cached = cache.get_many([key for session_id in session_ids for key in count_keys(session_id).values()])
+        drifted = 0
+        for session_id, session_counts in counts.items():
+            keys = count_keys(session_id)
+            previous = {state: cached.get(keys[state]) for state in STATES}
+            if previous != session_counts:
+                drifted += 1
+                self.stdout.write(f"session {session_id}: {previous} -> {session_counts}")
+            set_counts(session_id, session_counts)
+
+        self.stdout.write(f"Reconciled {len(counts)} sessions, {drifted} had drifted")
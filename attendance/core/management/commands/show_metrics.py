@@ -0,0 +1,12 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from attendance.core.metrics import get_counters
+
+
+class Command(BaseCommand):
+    help = "Print the shared counters kept in the cache"
+
+    def handle(self, *args, **options):
+        self.stdout.write(json.dumps(get_counters(), indent=2))
@@ -0,0 +1,157 @@
+"""
+Counters shared by every worker, kept in the cache so they survive restarts and
+add up across gunicorn workers and processor tasks.
+
+Long-running workers also keep in-process ``Counter``, ``Gauge`` and ``Histogram`` series,
+rendered in the Prometheus text format by ``render``.
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+
+from django.core.cache import cache
+
+COUNTER_KEY = "metrics:{name}"
+
+CHECK_IN_DUPLICATES_REJECTED = "checkin_duplicates_rejected_total"
+PRESIGNED_URL_CACHE_HITS = "presigned_url_cache_hits_total"
+PRESIGNED_URL_CACHE_MISSES = "presigned_url_cache_misses_total"
+SQS_MESSAGES_PROCESSED = "sqs_messages_processed_total"
+SQS_MESSAGES_FAILED = "sqs_messages_failed_total"
+S3_EVENTS_DUPLICATE_SKIPPED = "s3_events_duplicate_skipped_total"
+# Attendance images among them, each one a face comparison not paid for again
+FACE_COMPARISONS_SKIPPED = "face_comparisons_skipped_total"
+
+COUNTERS = (
+    CHECK_IN_DUPLICATES_REJECTED,
+    PRESIGNED_URL_CACHE_HITS,
+    PRESIGNED_URL_CACHE_MISSES,
+    SQS_MESSAGES_PROCESSED,
+    SQS_MESSAGES_FAILED,
+    S3_EVENTS_DUPLICATE_SKIPPED,
+    FACE_COMPARISONS_SKIPPED,
+)
+
+
+def incr(name: str, delta: int = 1) -> None:
+    key = COUNTER_KEY.format(name=name)
+    try:
+        cache.incr(key, delta)
+    except ValueError:
+        # First increment: the key doesn't exist yet
+        if not cache.add(key, delta, timeout=None):
+            cache.incr(key, delta)
+
+
+async def aincr(name: str, delta: int = 1) -> None:
+    key = COUNTER_KEY.format(name=name)
+    try:
+        await cache.aincr(key, delta)
+    except ValueError:
+        if not await cache.aadd(key, delta, timeout=None):
+            await cache.aincr(key, delta)
+
+
+def get_counters(names=COUNTERS) -> dict[str, int]:
+    values = cache.get_many([COUNTER_KEY.format(name=name) for name in names])
+    return {name: values.get(COUNTER_KEY.format(name=name), 0) for name in names}
+
+
+# Prometheus' default buckets, in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _labels(label: str | None, value: str | None, **extra) -> str:
+    pairs = ([(label, value)] if label else []) + list(extra.items())
+    return "{" + ",".join(f'{name}="{value}"' for name, value in pairs) + "}" if pairs else ""
+
+
+class Counter:
+    """An in-process counter, optionally split by the values of one label."""
+
+    def __init__(self, name: str, help: str, label: str | None = None):
+        self.name, self.help, self.label = name, help, label
+        self.lock = threading.Lock()
+        self.values: dict[str | None, float] = {}
+
+    def inc(self, value: str | None = None, amount: float = 1) -> None:
+        with self.lock:
+            self.values[value] = self.values.get(value, 0) + amount
+
+    def get(self, value: str | None = None) -> float:
+        return self.values.get(value, 0)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            # An unlabelled counter starts at 0 rather than missing
+            values = self.values if self.values or self.label else {None: 0}
+            for value, total in sorted(values.items(), key=lambda item: item[0] or ""):
+                lines.append(f"{self.name}{_labels(self.label, value)} {total:g}")
+        return lines
+
+
+class Gauge:
+    """An in-process value that goes up and down, the last one set."""
+
+    def __init__(self, name: str, help: str):
+        self.name, self.help = name, help
+        self.value: float | None = None
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        if self.value is not None:
+            lines.append(f"{self.name} {self.value:g}")
+        return lines
+
+
+class Histogram:
+    """An in-process histogram with cumulative buckets, optionally split by the values of one label."""
+
+    def __init__(self, name: str, help: str, label: str | None = None, buckets=DEFAULT_BUCKETS):
+        self.name, self.help, self.label = name, help, label
+        self.buckets = tuple(buckets)
+        self.lock = threading.Lock()
+        # label value -> (per-bucket counts with +Inf last, sum)
+        self.series: dict[str | None, tuple[list[int], float]] = {}
+
+    def observe(self, amount: float, value: str | None = None) -> None:
+        index = next((i for i, bound in enumerate(self.buckets) if amount <= bound), len(self.buckets))
+        with self.lock:
+            counts, total = self.series.get(value) or ([0] * (len(self.buckets) + 1), 0.0)
+            counts[index] += 1
+            self.series[value] = (counts, total + amount)
+
+    @contextmanager
+    def time(self, value: str | None = None):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, value)
+
+    def count(self, value: str | None = None) -> int:
+        with self.lock:
+            return sum(self.series[value][0]) if value in self.series else 0
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            series = sorted(self.series.items(), key=lambda item: item[0] or "")
+            for value, (counts, total) in series:
+                cumulative = 0
+                for bound, count in zip([f"{bound:g}" for bound in self.buckets] + ["+Inf"], counts):
+                    cumulative += count
+                    lines.append(f"{self.name}_bucket{_labels(self.label, value, le=bound)} {cumulative}")
+                lines.append(f"{self.name}_sum{_labels(self.label, value)} {total:g}")
+                lines.append(f"{self.name}_count{_labels(self.label, value)} {cumulative}")
+        return lines
+
+
+def render(*series) -> str:
+    """The Prometheus text exposition of in-process metrics."""
+    return "\n".join(line for metric in series for line in metric.render()) + "\n"
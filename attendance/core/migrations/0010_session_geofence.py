@@ -0,0 +1,43 @@
+# Generated by Django 5.0.11 on 2026-10-18 18:38
+
+from django.db import migrations, models
+
+
+def build_session_geometry(apps, schema_editor):
+    # Frozen copy of attendance.core.geofence.build_geometry for a session's point, which is
+    # all existing sessions have: geofence was only just added.
+    Session = apps.get_model('core', 'Session')
+    sessions = Session.objects.filter(latitude__isnull=False, longitude__isnull=False)
+    for session in sessions.iterator():
+        session.geometry = {
+            'origin': (session.latitude, session.longitude),
+            'circles': [[0.0, 0.0, session.radius]],
+            'polygons': [],
+        }
+        session.save(update_fields=['geometry'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_attendance_is_present_attendance_latitude_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='session',
+            name='geofence',
+            field=models.JSONField(blank=True, default=None, null=True),
+        ),
+        migrations.AddField(
+            model_name='session',
+            name='geometry',
+            field=models.JSONField(blank=True, default=None, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='session',
+            name='radius',
+            field=models.FloatField(default=100),
+        ),
+        migrations.RunPython(build_session_geometry, migrations.RunPython.noop),
+    ]
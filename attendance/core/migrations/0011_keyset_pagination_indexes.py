@@ -0,0 +1,24 @@
+# Generated by Django 5.0.11 on 2026-10-18 19:29
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # Build the indexes without locking the tables against writes
+    atomic = False
+
+    dependencies = [
+        ('core', '0010_session_geofence'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='attendance',
+            index=models.Index(fields=['created_at', 'id'], name='attendance_created_at_id_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='session',
+            index=models.Index(fields=['start_time', 'id'], name='session_start_time_id_idx'),
+        ),
+    ]
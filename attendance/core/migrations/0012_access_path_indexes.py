@@ -0,0 +1,67 @@
+# Generated by Django 5.0.11 on 2026-10-18 19:39
+
+import django.db.models.deletion
+from django.conf import settings
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # Build the indexes without locking the tables against writes
+    atomic = False
+
+    dependencies = [
+        ('core', '0011_keyset_pagination_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='attendance',
+            index=models.Index(fields=['session_id', 'created_at'], name='attendance_session_created_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='attendance',
+            index=models.Index(fields=['student_id', 'created_at'], name='attendance_student_created_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='attendance',
+            index=models.Index(condition=models.Q(('face_recognition_status', 'FAILED')), fields=['created_at', 'id'], name='attendance_failed_created_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='session',
+            index=models.Index(fields=['course_id', 'start_time'], name='session_course_start_time_idx'),
+        ),
+        # The foreign key indexes are prefixes of the ones above. Dropping them through AlterField
+        # would also drop and re-validate the foreign keys, so only the indexes are dropped here.
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AlterField(
+                    model_name='attendance',
+                    name='session_id',
+                    field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='core.session'),
+                ),
+                migrations.AlterField(
+                    model_name='attendance',
+                    name='student_id',
+                    field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+                ),
+                migrations.AlterField(
+                    model_name='session',
+                    name='course_id',
+                    field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='core.course'),
+                ),
+            ],
+            database_operations=[
+                migrations.RunSQL(
+                    f'DROP INDEX CONCURRENTLY IF EXISTS "{index}"',
+                    reverse_sql=f'CREATE INDEX CONCURRENTLY IF NOT EXISTS "{index}" ON "{table}" ("{column}")',
+                )
+                for index, table, column in (
+                    ('core_attendance_session_id_id_78213e05', 'core_attendance', 'session_id_id'),
+                    ('core_attendance_student_id_id_94cbf1c4', 'core_attendance', 'student_id_id'),
+                    ('core_session_course_id_id_02f3c310', 'core_session', 'course_id_id'),
+                )
+            ],
+        ),
+    ]
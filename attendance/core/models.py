@@ -1,8 +1,14 @@
 import hashlib
+import time
 
 from django.core.cache import cache
 from django.db import models
 
+from .geofence import DEFAULT_RADIUS, build_geometry
+
+SESSION_CACHE_KEY = "teacher:{teacher_id}:session:{session_id}"
+SESSION_CACHE_TIMEOUT = 60 * 60 * 3
+
 
 class Course(models.Model):
     name = models.CharField(max_length=50)
@@ -16,7 +22,8 @@ class Course(models.Model):
 
 
 class Session(models.Model):
-    course_id = models.ForeignKey(Course, on_delete=models.CASCADE)
+    # Indexed by (course_id, start_time)
+    course_id = models.ForeignKey(Course, on_delete=models.CASCADE, db_index=False)
     start_time = models.DateTimeField(auto_now_add=True)
     end_time = models.DateTimeField(blank=True, null=True)
     salt = models.CharField(max_length=32, editable=False)
@@ -24,28 +31,54 @@ class Session(models.Model):
     location_enabled = models.BooleanField(default=False)
     longitude = models.FloatField(blank=True, null=True, default=None)
     latitude = models.FloatField(blank=True, null=True, default=None)
+    # Radius in meters around longitude/latitude, unless a polygon geofence is set
+    radius = models.FloatField(default=DEFAULT_RADIUS)
+    # GeoJSON Polygon or MultiPolygon, see attendance.core.geofence
+    geofence = models.JSONField(blank=True, null=True, default=None)
+    geometry = models.JSONField(blank=True, null=True, default=None, editable=False)
+
+    class Meta:
+        indexes = [
+            # Keyset pagination of session lists, see attendance.core.pagination
+            models.Index(fields=["start_time", "id"], name="session_start_time_id_idx"),
+            # A teacher's sessions, newest first
+            models.Index(fields=["course_id", "start_time"], name="session_course_start_time_idx"),
+        ]
 
     def __str__(self):
         return f"{self.course_id} - {self.start_time} - {self.end_time}"
 
-    def generate_secret(self) -> str:
+    def save(self, *args, **kwargs):
+        self.geometry = build_geometry(self.latitude, self.longitude, self.radius, self.geofence)
+        if update_fields := kwargs.get("update_fields"):
+            kwargs["update_fields"] = {*update_fields, "geometry"}
+        super().save(*args, **kwargs)
+
+    def secret_cache_entry(self) -> tuple[str, dict]:
         # Generate secret from session data
         data = f"{self.course_id}-{self.id}-{self.start_time}-{self.salt}"
         secret = hashlib.sha256((data).encode("utf-8")).hexdigest()
 
+        return SESSION_CACHE_KEY.format(teacher_id=self.course_id.teacher_id.id, session_id=self.id), {
+            "secret": secret,
+            "face_recognition_enabled": self.face_recognition_enabled,
+            "location_enabled": self.location_enabled,
+            "longitude": self.longitude,
+            "latitude": self.latitude,
+            "geometry": self.geometry,
+            "expires_at": time.time() + SESSION_CACHE_TIMEOUT,
+        }
+
+    def generate_secret(self) -> str:
         # Store secret in cache
-        cache.set(
-            f"teacher:{self.course_id.teacher_id.id}:session:{self.id}",
-            {
-                "secret": secret,
-                "face_recognition_enabled": self.face_recognition_enabled,
-                "location_enabled": self.location_enabled,
-                "longitude": self.longitude,
-                "latitude": self.latitude,
-            },
-            timeout=60 * 60 * 3,
-        )
-        return secret
+        key, session_data = self.secret_cache_entry()
+        cache.set(key, session_data, timeout=SESSION_CACHE_TIMEOUT)
+        return session_data["secret"]
+
+    async def agenerate_secret(self) -> str:
+        key, session_data = self.secret_cache_entry()
+        await cache.aset(key, session_data, timeout=SESSION_CACHE_TIMEOUT)
+        return session_data["secret"]
 
 
 def get_face_image_path(instance: "Attendance", filename: str):
@@ -53,8 +86,9 @@ def get_face_image_path(instance: "Attendance", filename: str):
 
 
 class Attendance(models.Model):
-    session_id = models.ForeignKey(Session, on_delete=models.CASCADE)
-    student_id = models.ForeignKey("users.User", on_delete=models.CASCADE)
+    # Both indexed by the composite indexes below
+    session_id = models.ForeignKey(Session, on_delete=models.CASCADE, db_index=False)
+    student_id = models.ForeignKey("users.User", on_delete=models.CASCADE, db_index=False)
     created_at = models.DateTimeField(auto_now_add=True)
 
     longitude = models.FloatField(blank=True, null=True, default=None)
@@ -76,6 +110,19 @@ class Attendance(models.Model):
 
     class Meta:
         unique_together = ("session_id", "student_id")
+        indexes = [
+            # Keyset pagination of attendance lists, see attendance.core.pagination
+            models.Index(fields=["created_at", "id"], name="attendance_created_at_id_idx"),
+            # A teacher's attendance goes through their sessions, a student's is their own, both newest first
+            models.Index(fields=["session_id", "created_at"], name="attendance_session_created_idx"),
+            models.Index(fields=["student_id", "created_at"], name="attendance_student_created_idx"),
+            # The failed face recognition report, a small fraction of the table
+            models.Index(
+                fields=["created_at", "id"],
+                name="attendance_failed_created_idx",
+                condition=models.Q(face_recognition_status="FAILED"),
+            ),
+        ]
 
     def __str__(self):
         return f"{self.session_id} - {self.student_id} - {self.created_at} - {self.is_present}"
@@ -0,0 +1,158 @@
+"""
+Keyset pagination for lists that grow without bound.
+
+``KeysetPagination`` orders a list on the view's ordering field with the id as
+a tie-breaker and pages through it with opaque cursors holding the (value, id)
+of the last row of a page. The next page is the rows past that key, which an
+index on (field, id) finds however deep the page is, and rows inserted
+meanwhile don't shift it the way they would an offset.
+
+Lists are only paginated when the request opts in with ``cursor`` or
+``page_size``; clients that expect the whole list keep getting a plain array
+while they migrate.
+"""
+
+import base64
+import json
+from datetime import datetime
+
+from django.db.models import Q, QuerySet
+from rest_framework.exceptions import NotFound
+from rest_framework.filters import OrderingFilter
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    cursor_query_param = "cursor"
+    page_size_query_param = "page_size"
+    page_size = 100
+    max_page_size = 1000
+    invalid_cursor_message = "Invalid cursor"
+
+    def is_paginated(self, request) -> bool:
+        params = request.query_params
+        return self.cursor_query_param in params or self.page_size_query_param in params
+
+    def paginate_queryset(self, queryset: QuerySet, request, view=None) -> list | None:
+        if not self.is_paginated(request):
+            return None
+
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.field, descending = self.get_ordering(request, queryset, view)
+        self.model_field = queryset.model._meta.get_field(self.field)
+        cursor = self.decode_cursor(request)
+        # Walking back reads the rows before the cursor in the opposite order
+        self.reverse = cursor is not None and cursor[0]
+        backwards = descending != self.reverse
+
+        ordering = (f"-{self.field}", "-id") if backwards else (self.field, "id")
+        queryset = queryset.order_by(*ordering)
+        if cursor is not None:
+            _, value, id = cursor
+            if backwards:
+                # The redundant bound lets the planner range scan the (field, id) index
+                queryset = queryset.filter(**{f"{self.field}__lte": value}).filter(
+                    Q(**{f"{self.field}__lt": value}) | Q(**{self.field: value, "id__lt": id})
+                )
+            else:
+                queryset = queryset.filter(**{f"{self.field}__gte": value}).filter(
+                    Q(**{f"{self.field}__gt": value}) | Q(**{self.field: value, "id__gt": id})
+                )
+
+        rows = list(queryset[: self.page_size + 1])
+        self.has_more = len(rows) > self.page_size
+        self.rows = rows[: self.page_size]
+        if self.reverse:
+            self.rows.reverse()
+        self.has_cursor = cursor is not None
+        return self.rows
+
+    def get_page_size(self, request) -> int:
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(page_size, 1), self.max_page_size)
+
+    def get_ordering(self, request, queryset: QuerySet, view) -> tuple[str, bool]:
+        """The field to page on and whether it is descending, the first of the view's ordering."""
+        ordering = None
+        for backend in getattr(view, "filter_backends", ()):
+            if issubclass(backend, OrderingFilter):
+                ordering = backend().get_ordering(request, queryset, view)
+                break
+        ordering = ordering or getattr(view, "ordering", None) or ("-id",)
+        field = ordering[0] if isinstance(ordering, (list, tuple)) else ordering
+        return field.lstrip("-"), field.startswith("-")
+
+    def encode_cursor(self, reverse: bool, row) -> str:
+        # Rows are model instances, or dicts when the view pages through values()
+        value, id = (row[self.field], row["id"]) if isinstance(row, dict) else (getattr(row, self.field), row.id)
+        value = value.isoformat() if isinstance(value, datetime) else value
+        data = json.dumps([reverse, value, id], separators=(",", ":"))
+        return base64.urlsafe_b64encode(data.encode()).decode()
+
+    def link(self, reverse: bool, row) -> str:
+        cursor = self.encode_cursor(reverse, row)
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, cursor)
+
+    def decode_cursor(self, request) -> tuple[bool, object, int] | None:
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            reverse, value, id = json.loads(base64.urlsafe_b64decode(encoded.encode()))
+            return bool(reverse), self.model_field.to_python(value), int(id)
+        except Exception:
+            raise NotFound(self.invalid_cursor_message)
+
+    def get_next_link(self) -> str | None:
+        # Coming back from a later page, there is always one after
+        if self.rows and (self.reverse or self.has_more):
+            return self.link(False, self.rows[-1])
+        return None
+
+    def get_previous_link(self) -> str | None:
+        if not self.rows:
+            if not self.has_cursor:
+                return None
+            # Past either end, start over
+            return remove_query_param(self.request.build_absolute_uri(), self.cursor_query_param)
+        if self.has_more if self.reverse else self.has_cursor:
+            return self.link(True, self.rows[0])
+        return None
+
+    def get_paginated_response(self, data) -> Response:
+        return Response({"next": self.get_next_link(), "previous": self.get_previous_link(), "results": data})
+
+    def get_paginated_response_schema(self, schema: dict) -> dict:
+        return {
+            "type": "object",
+            "required": ["results"],
+            "properties": {
+                "next": {"type": "string", "nullable": True, "format": "uri"},
+                "previous": {"type": "string", "nullable": True, "format": "uri"},
+                "results": schema,
+            },
+        }
+
+    def get_schema_operation_parameters(self, view) -> list[dict]:
+        return [
+            {
+                "name": self.cursor_query_param,
+                "required": False,
+                "in": "query",
+                "description": "The pagination cursor value.",
+                "schema": {"type": "string"},
+            },
+            {
+                "name": self.page_size_query_param,
+                "required": False,
+                "in": "query",
+                "description": "Number of results per page. Without it or a cursor the list isn't paginated.",
+                "schema": {"type": "integer"},
+            },
+        ]
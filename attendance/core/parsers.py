@@ -0,0 +1,40 @@
+"""
+An orjson parser that returns what DRF's JSONParser would.
+
+orjson reads numbers with 19 or more digits as floats where json reads ints
+of any size, and rejects some documents json accepts, like lone surrogate
+escapes. Those bodies, and any orjson fails on, are parsed by JSONParser,
+which also reports the errors the way it always has.
+"""
+
+import io
+import string
+
+import orjson
+from django.conf import settings
+from rest_framework.parsers import JSONParser
+
+from .renderers import ORJSONRenderer
+
+# Maps digits to 0 and everything else to a space, so long numbers can be found with a substring search
+DIGITS = bytes(ord("0") if chr(i) in string.digits else ord(" ") for i in range(256))
+LONG_NUMBER = b"0" * 19
+
+
+class ORJSONParser(JSONParser):
+    renderer_class = ORJSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get("encoding", settings.DEFAULT_CHARSET)
+        if encoding.lower() not in ("utf-8", "utf8") or not self.strict:
+            return super().parse(stream, media_type, parser_context)
+
+        body = stream.read()
+        # Much faster than a regular expression on large bodies
+        if LONG_NUMBER not in body.translate(DIGITS):
+            try:
+                return orjson.loads(body)
+            except orjson.JSONDecodeError:
+                pass
+        return super().parse(io.BytesIO(body), media_type, parser_context)
@@ -0,0 +1,78 @@
+"""
+An orjson renderer that writes the same bytes as DRF's JSONRenderer.
+
+orjson covers what the API returns: dicts, lists, strings, numbers and the
+serializers' dict and list subclasses. Dates and times, Decimals, lazy
+translation strings and anything else orjson doesn't know go through DRF's
+encoder like before, so they come out the same. Where orjson would write
+different bytes, the response is rendered by JSONRenderer instead:
+
+- floats orjson writes without an exponent, or with one json writes
+  differently (``0.00001`` for ``1e-05``, ``1e16`` for ``1e+16``), and NaN and
+  the infinities, which orjson writes as null and JSONRenderer refuses
+- data orjson refuses, like ints over 64 bits or non-string keys
+- indented, non-compact or ASCII-only output
+
+The floats are found by walking the data, strings and ints are skipped.
+"""
+
+import orjson
+from rest_framework.renderers import JSONRenderer
+
+SCALARS = frozenset((str, int, bool, type(None)))
+
+LINE_SEPARATOR = "\u2028".encode()
+PARAGRAPH_SEPARATOR = "\u2029".encode()
+
+
+def same_float(value: float) -> bool:
+    # repr switches to an exponent below 1e-4 and from 1e16 on, orjson at other thresholds
+    return value == 0.0 or 1e-4 <= abs(value) < 1e16
+
+
+def has_json_floats(data) -> bool:
+    """Whether the dicts, lists and tuples of ``data`` hold a float orjson would write differently."""
+    if isinstance(data, float):
+        return not same_float(data)
+    if not isinstance(data, dict | list | tuple):
+        return False
+    for value in data.values() if isinstance(data, dict) else data:
+        if type(value) in SCALARS:
+            continue
+        if isinstance(value, float):
+            if not same_float(value):
+                return True
+        elif has_json_floats(value):
+            return True
+    return False
+
+
+class ORJSONRenderer(JSONRenderer):
+    options = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+
+    def render(self, data, accepted_media_type=None, renderer_context=None) -> bytes:
+        if data is None:
+            return b""
+
+        indent = self.get_indent(accepted_media_type, renderer_context or {})
+        if indent is not None or not self.compact or self.ensure_ascii or has_json_floats(data):
+            return super().render(data, accepted_media_type, renderer_context)
+
+        encoder_default = self.encoder_class().default
+
+        def default(obj):
+            # Decimals come back as floats, querysets as tuples
+            value = encoder_default(obj)
+            if has_json_floats(value):
+                # orjson raises it as a JSONEncodeError
+                raise TypeError(f"{value!r} is rendered by JSONRenderer")
+            return value
+
+        try:
+            ret = orjson.dumps(data, default=default, option=self.options)
+        except orjson.JSONEncodeError:
+            # json either manages or raises the error it always has
+            return super().render(data, accepted_media_type, renderer_context)
+
+        # Like JSONRenderer, escape the separators JavaScript doesn't allow in string literals
+        return ret.replace(LINE_SEPARATOR, b"\\u2028").replace(PARAGRAPH_SEPARATOR, b"\\u2029")
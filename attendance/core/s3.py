@@ -0,0 +1,120 @@
+"""
+S3 helpers.
+
+Presigned URLs are reused instead of being signed again on every response, so a
+teacher paging through the failed face recognition report or a student retrying
+a check-in gets the same links. A URL is handed out for at most half of its
+lifetime, so whoever receives it always has at least half of ``expires_in``
+left to use it. URLs are cached in-process and, with
+``PRESIGNED_URL_CACHE_SHARED``, in the default cache so every worker shares
+them.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+import boto3
+from django.conf import settings
+from django.core.cache import cache
+
+from . import metrics
+
+if "storages" in settings.INSTALLED_APPS:
+    s3_client = boto3.client("s3", region_name=settings.AWS_REGION)
+
+PRESIGNED_URL_KEY = "s3:presigned:{client_method}:{bucket}:{key}:{params}"
+
+# Hits and misses are published to the shared counters in batches, not on every lookup
+COUNTER_FLUSH_EVERY = 100
+
+
+class PresignedURLCache:
+    def __init__(self, max_size: int = 10000):
+        self.max_size = max_size
+        self.urls: OrderedDict[str, tuple[str, float]] = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = self.misses = 0
+        self.unflushed = {metrics.PRESIGNED_URL_CACHE_HITS: 0, metrics.PRESIGNED_URL_CACHE_MISSES: 0}
+
+    def get(self, key: str) -> str | None:
+        with self.lock:
+            entry = self.urls.get(key)
+            if entry is None or entry[1] <= time.time():
+                return None
+            self.urls.move_to_end(key)
+            return entry[0]
+
+    def set(self, key: str, url: str, reuse_until: float) -> None:
+        with self.lock:
+            self.urls[key] = (url, reuse_until)
+            self.urls.move_to_end(key)
+            while len(self.urls) > self.max_size:
+                self.urls.popitem(last=False)
+
+    def count(self, hit: bool) -> None:
+        name = metrics.PRESIGNED_URL_CACHE_HITS if hit else metrics.PRESIGNED_URL_CACHE_MISSES
+        with self.lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+            self.unflushed[name] += 1
+            if sum(self.unflushed.values()) < COUNTER_FLUSH_EVERY:
+                return
+            unflushed, self.unflushed = self.unflushed, dict.fromkeys(self.unflushed, 0)
+
+        for name, delta in unflushed.items():
+            if delta:
+                metrics.incr(name, delta)
+
+    def stats(self) -> dict[str, int]:
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self.urls)}
+
+    def clear(self) -> None:
+        with self.lock:
+            self.urls.clear()
+            self.hits = self.misses = 0
+            self.unflushed = dict.fromkeys(self.unflushed, 0)
+
+
+presigned_urls = PresignedURLCache()
+
+
+def generate_presigned_url(client_method: str, key: str, expires_in: int, **params) -> str:
+    bucket = settings.MEDIA_BUCKET_NAME
+    cache_key = PRESIGNED_URL_KEY.format(
+        client_method=client_method,
+        bucket=bucket,
+        key=key,
+        params=",".join(f"{name}={value}" for name, value in sorted(params.items())),
+    )
+
+    if cached_url := presigned_urls.get(cache_key):
+        presigned_urls.count(hit=True)
+        return cached_url
+
+    if settings.PRESIGNED_URL_CACHE_SHARED and (entry := cache.get(cache_key)):
+        shared_url, reuse_until = entry
+        presigned_urls.set(cache_key, shared_url, reuse_until)
+        presigned_urls.count(hit=True)
+        return shared_url
+
+    presigned_urls.count(hit=False)
+    # botocore refreshes temporary credentials well before they expire, so they outlive the URL
+    url = s3_client.generate_presigned_url(
+        ClientMethod=client_method,
+        Params={
+            "Bucket": bucket,
+            "Key": key,
+            **params,
+        },
+        ExpiresIn=expires_in,
+    )
+    reuse_for = expires_in // 2
+    reuse_until = time.time() + reuse_for
+    presigned_urls.set(cache_key, url, reuse_until)
+    if settings.PRESIGNED_URL_CACHE_SHARED:
+        cache.set(cache_key, (url, reuse_until), timeout=reuse_for)
+    return url
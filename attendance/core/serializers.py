@@ -1,21 +1,21 @@
-import math
 import uuid
 from typing import Any
 
-import boto3
-import jwt
 from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.core.cache import cache
+from django.db import transaction
+from django.db.models import QuerySet
 from rest_framework import serializers
 
 from attendance.users.serializers import UserSerializer
 
-from .models import Attendance, Course, Session, get_face_image_path
+from .checkin import face_image_upload_url, mark_checked_in_many, record_check_in, validate_check_in
+from .counters import PRESENT, count_transition, state_of
+from .geofence import validate_geojson
+from .models import Attendance, Course, Session
+from .s3 import generate_presigned_url
 
 User = get_user_model()
-if "storages" in settings.INSTALLED_APPS:
-    s3_client = boto3.client("s3", region_name=settings.AWS_REGION)
 
 
 class CourseSerializer(serializers.ModelSerializer):
@@ -38,6 +38,8 @@ class SessionReadSerializer(serializers.ModelSerializer):
             "location_enabled",
             "longitude",
             "latitude",
+            "radius",
+            "geofence",
         )
 
 
@@ -51,6 +53,8 @@ class SessionWriteSerializer(serializers.ModelSerializer):
             "location_enabled",
             "longitude",
             "latitude",
+            "radius",
+            "geofence",
         )
 
     def validate_course_id(self, value):
@@ -58,8 +62,23 @@ class SessionWriteSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError("Course does not belong to you.")
         return value
 
+    def validate_radius(self, value):
+        if value <= 0:
+            raise serializers.ValidationError("Radius must be positive.")
+        return value
+
+    def validate_geofence(self, value):
+        if value is None:
+            return value
+        try:
+            validate_geojson(value)
+        except (ValueError, KeyError, TypeError) as e:
+            message = str(e) if isinstance(e, ValueError) else "Geofence must be a GeoJSON Polygon or MultiPolygon."
+            raise serializers.ValidationError(message)
+        return value
+
     def validate(self, data):
-        if data.get("location_enabled", False):
+        if data.get("location_enabled", False) and not data.get("geofence"):
             if not data.get("longitude") or not data.get("latitude"):
                 raise serializers.ValidationError("Longitude and latitude are required if location_enabled is True.")
         return data
@@ -85,6 +104,66 @@ class AttendanceSerializer(serializers.ModelSerializer):
         )
 
 
+class FlatAttendanceSerializer:
+    """
+    AttendanceSerializer's representation of a list, built from ``.values()``
+    rows instead of a serializer and model instances per row.
+
+    Rows only carry their session's id; the sessions they share are serialized
+    once with ``sessions()``. Values are converted by the nested serializers'
+    own fields, so each row and session matches what AttendanceSerializer would
+    have nested.
+    """
+
+    def __init__(self):
+        self.fields = AttendanceSerializer().fields
+        self.student_fields = UserSerializer().fields
+        self.session_fields = SessionReadSerializer().fields
+        self.course_fields = CourseSerializer().fields
+        related = ("session_id", "student_id")
+        self.row_names = [name for name in AttendanceSerializer.Meta.fields if name not in related]
+
+    def values(self, queryset: QuerySet) -> QuerySet:
+        """The values() rows of an Attendance queryset, for pagination and ``to_representation``."""
+        student = [f"student_id__{name}" for name in self.student_fields]
+        return queryset.values(*self.row_names, "session_id", *student)
+
+    def to_representation(self, rows) -> list[dict]:
+        return [self.row(row) for row in rows]
+
+    def row(self, row: dict) -> dict:
+        data = represent(self.fields, self.row_names, row)
+        data["session_id"] = row["session_id"]
+        data["student_id"] = represent(self.student_fields, self.student_fields, row, "student_id__")
+        # Keep the field order of AttendanceSerializer
+        return {name: data[name] for name in AttendanceSerializer.Meta.fields}
+
+    def sessions(self, session_ids) -> list[dict]:
+        """The sessions with the given ids, in that order."""
+        names = [name for name in self.session_fields.keys() if name != "course_id"]
+        course = [f"course_id__{name}" for name in self.course_fields.keys()]
+        rows = {row["id"]: row for row in Session.objects.filter(id__in=session_ids).values(*names, *course)}
+        sessions = []
+        for session_id in dict.fromkeys(session_ids):
+            if session_id in rows:
+                data = represent(self.session_fields, names, rows[session_id])
+                data["course_id"] = represent(self.course_fields, self.course_fields, rows[session_id], "course_id__")
+                sessions.append({name: data[name] for name in self.session_fields})
+        return sessions
+
+
+def represent(fields, names, row: dict, prefix: str = "") -> dict:
+    """Serializer.to_representation for a values() row, with the fields of a related object under ``prefix``."""
+    data = {}
+    for name in names:
+        value = row[prefix + name]
+        # values() already has the primary keys of related objects
+        if value is not None and not isinstance(fields[name], serializers.PrimaryKeyRelatedField):
+            value = fields[name].to_representation(value)
+        data[name] = value
+    return data
+
+
 class AttendanceImageSerializer(serializers.ModelSerializer):
     session_id = SessionReadSerializer()
     student_id = UserSerializer()
@@ -108,24 +187,10 @@ class AttendanceImageSerializer(serializers.ModelSerializer):
         if "storages" not in settings.INSTALLED_APPS:
             return "init.jpeg"
 
-        return s3_client.generate_presigned_url(
-            ClientMethod="get_object",
-            Params={
-                "Bucket": settings.MEDIA_BUCKET_NAME,
-                "Key": f"{obj.student_id.id}/init.jpeg",
-            },
-            ExpiresIn=900,
-        )
+        return generate_presigned_url("get_object", f"{obj.student_id.id}/init.jpeg", 900)
 
     def get_signed_face_image(self, obj):
-        return s3_client.generate_presigned_url(
-            ClientMethod="get_object",
-            Params={
-                "Bucket": settings.MEDIA_BUCKET_NAME,
-                "Key": f"{obj.student_id.id}/{obj.id}.jpeg",
-            },
-            ExpiresIn=900,
-        )
+        return generate_presigned_url("get_object", f"{obj.student_id.id}/{obj.id}.jpeg", 900)
 
 
 class AttendanceCreateSerializer(serializers.Serializer):
@@ -133,110 +198,31 @@ class AttendanceCreateSerializer(serializers.Serializer):
     longitude = serializers.FloatField(required=False)
     latitude = serializers.FloatField(required=False)
 
-    @staticmethod
-    def approx_distance(lat1, lon1, lat2, lon2):
-        # Earth radius in meters
-        R = 6371000
-
-        # Convert latitude and longitude from degrees to radians
-        lat1_rad = math.radians(lat1)
-        lat2_rad = math.radians(lat2)
-
-        # Approximate formula (works well for short distances)
-        x = (lon2 - lon1) * math.cos((lat1_rad + lat2_rad) / 2)
-        y = lat2 - lat1
-        return R * math.sqrt(x**2 + y**2) * math.pi / 180
-
     def validate(self, data):
-        # Get token from request data
-        token = data["token"]
-
-        # Get session id from token
-        payload = jwt.decode(token, options={"verify_signature": False})
-        session_id = payload.get("session_id", None)
-        teacher_id = payload.get("teacher_id", None)
-
-        # Early return if session id is not present
-        if not session_id or not teacher_id:
-            raise serializers.ValidationError("Invalid token.")
-
-        # Get session secret from cache
-        session_data = cache.get(f"teacher:{teacher_id}:session:{session_id}")
-        if not session_data:
-            raise serializers.ValidationError("Token not active for this session.")
-
-        session_secret = session_data["secret"]
-        session_face_recognition_enabled = session_data["face_recognition_enabled"]
-        session_location_enabled = session_data["location_enabled"]
-        session_longitude = session_data["longitude"]
-        session_latitude = session_data["latitude"]
-
-        # Verify token
-        try:
-            payload = jwt.decode(token, session_secret, algorithms=["HS256"])
-        except jwt.exceptions.InvalidSignatureError:
-            raise serializers.ValidationError("Invalid signature.")
-        except jwt.exceptions.ExpiredSignatureError:
-            raise serializers.ValidationError("Token expired.")
-
-        # Check if location is enabled
-        if session_location_enabled:
-            longitude = data.get("longitude", None)
-            latitude = data.get("latitude", None)
-            if not longitude or not latitude:
-                raise serializers.ValidationError("Longitude and latitude are required.")
-
-            # Longtitude and latitude are not within the range
-            if self.approx_distance(latitude, longitude, session_latitude, session_longitude) > 100:
-                raise serializers.ValidationError("Location not within range.")
-
-        data["session_id"] = session_id
-        data["face_recognition_enabled"] = session_face_recognition_enabled
-        return data
-
-    def get_presigned_put_object_url(self):
-        if "storages" not in settings.INSTALLED_APPS:
-            return None
-
-        if self.context["request"].user.init_image:
-            path = get_face_image_path(self.instance, self.instance.id)
-        else:
-            path = get_face_image_path(self.instance, f"{self.instance.id}_init")
-
-        return s3_client.generate_presigned_url(
-            ClientMethod="put_object",
-            Params={
-                "Bucket": settings.MEDIA_BUCKET_NAME,
-                "Key": path,
-                "ContentType": "image/jpeg",
-            },
-            ExpiresIn=300,
+        data.update(
+            validate_check_in(
+                data["token"],
+                data.get("longitude", None),
+                data.get("latitude", None),
+                student_id=self.context["request"].user.id,
+            )
         )
+        return data
 
     def create(self, validated_data):
-        default_is_present = False if validated_data["face_recognition_enabled"] else True
-        default_face_recognition_status = (
-            Attendance.FaceRecognitionStatus.PENDING
-            if validated_data["face_recognition_enabled"]
-            else Attendance.FaceRecognitionStatus.NOT_REQUIRED
+        return record_check_in(
+            validated_data["session_id"],
+            self.context["request"].user,
+            validated_data["face_recognition_enabled"],
+            validated_data["expires_at"],
+            validated_data.get("longitude", None),
+            validated_data.get("latitude", None),
         )
 
-        attendance_obj, is_created = Attendance.objects.get_or_create(
-            session_id_id=validated_data["session_id"],
-            student_id=self.context["request"].user,
-            defaults={
-                "is_present": default_is_present,
-                "face_recognition_status": default_face_recognition_status,
-            },
-        )
-        if attendance_obj.is_present and not is_created:
-            raise serializers.ValidationError("You have already checked in.")
-        return attendance_obj
-
     def to_representation(self, instance: Attendance) -> Any:
         serialized_data = AttendanceSerializer(instance).data
         if instance.face_recognition_status == Attendance.FaceRecognitionStatus.PENDING:
-            serialized_data["face_image_upload_url"] = self.get_presigned_put_object_url()
+            serialized_data["face_image_upload_url"] = face_image_upload_url(instance, self.context["request"].user)
         return serialized_data
 
 
@@ -246,10 +232,24 @@ class ImageProcessingCallbackSerializer(serializers.Serializer):
     face_image = serializers.CharField()
 
     def create(self, validated_data):
-        attendance = Attendance.objects.get(id=validated_data["id"])
+        attendance = (
+            Attendance.objects.select_for_update(of=("self",))
+            .select_related("session_id__course_id")
+            .get(id=validated_data["id"])
+        )
+        before = state_of(attendance.is_present, attendance.face_recognition_status)
         attendance.face_recognition_status = validated_data["face_recognition_status"]
         attendance.face_image = validated_data["face_image"]
+        attendance.is_present = attendance.face_recognition_status == Attendance.FaceRecognitionStatus.SUCCESS
         attendance.save()
+        after = state_of(attendance.is_present, attendance.face_recognition_status)
+        count_transition(attendance.session_id_id, before, after)
+
+        # Let check-in retries be rejected from the cache, once the request's transaction commits
+        if after == PRESENT:
+            teacher_id = attendance.session_id.course_id.teacher_id_id
+            check_in = (teacher_id, attendance.session_id_id, attendance.student_id_id)
+            transaction.on_commit(lambda: mark_checked_in_many([check_in]))
 
         # Update init_image status
         if "init" in validated_data["face_image"]:
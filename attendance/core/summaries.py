@@ -0,0 +1,79 @@
+"""
+Attendance summaries for the session and course lists.
+
+Dashboards used to download every attendance row to count them. With
+``summary=true`` the session list has each session's counts and the course
+list each course's attendance rate per session, both computed by one grouped
+query over the listed objects.
+"""
+
+from django.db.models import Count, Q
+
+from . import counters
+from .models import Attendance, Session
+
+STATUSES = Attendance.FaceRecognitionStatus.values
+
+# The present state of attendance.core.counters: is_present, or accepted by face recognition
+PRESENT = counters.STATE_FILTERS[counters.PRESENT]
+# The same from the session's side of the join
+SESSION_PRESENT = Q(attendance__is_present=True) | Q(
+    attendance__face_recognition_status=Attendance.FaceRecognitionStatus.SUCCESS
+)
+
+
+def session_summaries(session_ids) -> dict[int, dict]:
+    """
+    Every session's check-ins, how many of them are present, and the raw counts
+    of the is_present and face_recognition_status fields they are derived from.
+    """
+    rows = (
+        Attendance.objects.filter(session_id__in=session_ids)
+        .order_by()
+        .values("session_id")
+        .annotate(
+            total=Count("id"),
+            present=Count("id", filter=PRESENT),
+            marked_present=Count("id", filter=Q(is_present=True)),
+            **{status: Count("id", filter=Q(face_recognition_status=status)) for status in STATUSES},
+        )
+    )
+    empty = {"total": 0, "present": 0, "marked_present": 0, **dict.fromkeys(STATUSES, 0)}
+    summaries = {session_id: summary(empty) for session_id in session_ids}
+    for row in rows:
+        summaries[row["session_id"]] = summary(row)
+    return summaries
+
+
+def summary(row: dict) -> dict:
+    return {
+        "total": row["total"],
+        "present": row["present"],
+        "is_present": {"true": row["marked_present"], "false": row["total"] - row["marked_present"]},
+        "face_recognition_status": {status: row[status] for status in STATUSES},
+    }
+
+
+def course_summaries(course_ids) -> dict[int, list[dict]]:
+    """
+    Every course's sessions, oldest first, with their check-ins, how many of
+    them are present and the rate, None for a session nobody checked in to.
+    """
+    rows = (
+        Session.objects.filter(course_id__in=course_ids)
+        .order_by("start_time", "id")
+        .values("id", "course_id", "start_time")
+        .annotate(total=Count("attendance"), present=Count("attendance", filter=SESSION_PRESENT))
+    )
+    summaries: dict[int, list[dict]] = {course_id: [] for course_id in course_ids}
+    for row in rows:
+        summaries[row["course_id"]].append(
+            {
+                "session_id": row["id"],
+                "start_time": row["start_time"],
+                "total": row["total"],
+                "present": row["present"],
+                "rate": row["present"] / row["total"] if row["total"] else None,
+            }
+        )
+    return summaries
@@ -0,0 +1,47 @@
+import uuid
+
+from factory import LazyFunction, Sequence, SubFactory
+from factory.django import DjangoModelFactory
+
+from attendance.core.models import Attendance, Course, Session
+from attendance.users.models import User
+from attendance.users.tests.factories import UserFactory
+
+
+class TeacherFactory(UserFactory):
+    role = User.UserRoleChoices.TEACHER
+
+
+class StudentFactory(UserFactory):
+    role = User.UserRoleChoices.STUDENT
+
+
+class CourseFactory(DjangoModelFactory):
+    name = Sequence(lambda n: f"COP{3000 + n}")
+    teacher_id = SubFactory(TeacherFactory)
+
+    class Meta:
+        model = Course
+
+
+class SessionFactory(DjangoModelFactory):
+    course_id = SubFactory(CourseFactory)
+    salt = LazyFunction(lambda: uuid.uuid4().hex)
+
+    class Meta:
+        model = Session
+
+
+class AttendanceFactory(DjangoModelFactory):
+    session_id = SubFactory(SessionFactory)
+    student_id = SubFactory(StudentFactory)
+
+    class Meta:
+        model = Attendance
+
+
+# Waiting for face recognition, the student's init image already handled
+class PendingAttendanceFactory(AttendanceFactory):
+    student_id = SubFactory(StudentFactory, init_image=True)
+    face_recognition_status = Attendance.FaceRecognitionStatus.PENDING
+    is_present = False
@@ -0,0 +1,285 @@
+"""
+In-memory stand-ins for the AWS clients used by process_sqs_msg
+and the face comparison backends.
+
+FakeSQS keeps the parts of SQS semantics the processor relies on: received
+messages are invisible until they are deleted or their visibility timeout runs
+out, and every receive hands out a new receipt handle. Batch calls can be made
+to fail per entry by putting an error code in ``failures``, receives by
+putting one in ``receive_failures``.
+"""
+
+import collections
+import hashlib
+import io
+import itertools
+import json
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Callable
+
+from botocore.exceptions import ClientError
+
+
+def s3_event(*keys: str, bucket: str = "media", etag: bool = True, event_time: datetime | None = None) -> str:
+    """An S3 event notification, every object's ETag is made up from its key."""
+    objects = [{"key": key, "eTag": hashlib.md5(key.encode()).hexdigest()} if etag else {"key": key} for key in keys]
+    timestamp = (event_time or datetime.now(timezone.utc)).isoformat(timespec="milliseconds").replace("+00:00", "Z")
+    records = [
+        {"eventTime": timestamp, "s3": {"bucket": {"name": bucket}, "object": s3_object}} for s3_object in objects
+    ]
+    return json.dumps({"Records": records})
+
+
+class FakeSQS:
+    def __init__(self, bodies=(), visibility_timeout: int = 30):
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+        self.visibility_timeout = visibility_timeout
+        self.messages: dict[str, dict[str, Any]] = {}
+        self.receipts: dict[str, str] = {}
+        self.deleted: list[str] = []
+        self.released: list[str] = []
+        self.calls: collections.Counter[str] = collections.Counter()
+        # Error codes the next batch entries fail with, in order; a code ending in "!" is a sender fault
+        self.failures: list[str] = []
+        # Error codes the next receives fail with, in order
+        self.receive_failures: list[str] = []
+        self.on_drained: Callable[[], Any] | None = None
+        for body in bodies:
+            self.send_message(body)
+
+    def send_message(self, body: str) -> str:
+        with self.lock:
+            message_id = str(next(self.ids))
+            self.messages[message_id] = {"Body": body, "visible_at": 0.0, "receives": 0}
+        return message_id
+
+    def receive_message(self, QueueUrl, MaxNumberOfMessages=1, WaitTimeSeconds=0, VisibilityTimeout=None, **kwargs):
+        visibility_timeout = self.visibility_timeout if VisibilityTimeout is None else VisibilityTimeout
+        with self.lock:
+            self.calls["receive_message"] += 1
+            if self.receive_failures:
+                code = self.receive_failures.pop(0)
+                raise ClientError({"Error": {"Code": code, "Message": code}}, "ReceiveMessage")
+            now = time.monotonic()
+            received: list[dict[str, Any]] = []
+            for message_id, message in self.messages.items():
+                if len(received) == MaxNumberOfMessages:
+                    break
+                if message["visible_at"] > now:
+                    continue
+                message["visible_at"] = now + visibility_timeout
+                message["receives"] += 1
+                receipt_handle = f"{message_id}-{message['receives']}"
+                self.receipts[receipt_handle] = message_id
+                received.append({"MessageId": message_id, "ReceiptHandle": receipt_handle, "Body": message["Body"]})
+                if "ApproximateReceiveCount" in kwargs.get("MessageSystemAttributeNames", ()):
+                    received[-1]["Attributes"] = {"ApproximateReceiveCount": str(message["receives"])}
+            drained = not self.messages
+
+        if drained and self.on_drained:
+            self.on_drained()
+        if not received:
+            # A short stand-in for the long poll
+            time.sleep(min(WaitTimeSeconds, 0.01))
+            return {}
+        return {"Messages": received}
+
+    def _delete(self, receipt_handle):
+        message_id = self.receipts.pop(receipt_handle)
+        self.messages.pop(message_id, None)
+        self.deleted.append(message_id)
+
+    def _change_visibility(self, receipt_handle, visibility_timeout):
+        message_id = self.receipts[receipt_handle]
+        self.messages[message_id]["visible_at"] = time.monotonic() + visibility_timeout
+        if visibility_timeout == 0:
+            self.released.append(message_id)
+
+    def _batch(self, entries, apply):
+        successful, failed = [], []
+        for entry in entries:
+            code = self.failures.pop(0) if self.failures else None
+            if code is None and self.receipts.get(entry["ReceiptHandle"]) not in self.messages:
+                code = "ReceiptHandleIsInvalid!"
+            if code is None:
+                apply(entry)
+                successful.append({"Id": entry["Id"]})
+            else:
+                failed.append({"Id": entry["Id"], "SenderFault": code.endswith("!"), "Code": code.rstrip("!")})
+        return {"Successful": successful, "Failed": failed}
+
+    def get_queue_attributes(self, QueueUrl, AttributeNames):
+        with self.lock:
+            self.calls["get_queue_attributes"] += 1
+            now = time.monotonic()
+            visible = sum(message["visible_at"] <= now for message in self.messages.values())
+        return {"Attributes": {"ApproximateNumberOfMessages": str(visible)}}
+
+    def delete_message(self, QueueUrl, ReceiptHandle):
+        with self.lock:
+            self.calls["delete_message"] += 1
+            self._delete(ReceiptHandle)
+        return {}
+
+    def delete_message_batch(self, QueueUrl, Entries):
+        assert len(Entries) <= 10
+        with self.lock:
+            self.calls["delete_message_batch"] += 1
+            return self._batch(Entries, lambda entry: self._delete(entry["ReceiptHandle"]))
+
+    def change_message_visibility(self, QueueUrl, ReceiptHandle, VisibilityTimeout):
+        with self.lock:
+            self.calls["change_message_visibility"] += 1
+            self._change_visibility(ReceiptHandle, VisibilityTimeout)
+        return {}
+
+    def change_message_visibility_batch(self, QueueUrl, Entries):
+        assert len(Entries) <= 10
+        with self.lock:
+            self.calls["change_message_visibility_batch"] += 1
+            return self._batch(
+                Entries, lambda entry: self._change_visibility(entry["ReceiptHandle"], entry["VisibilityTimeout"])
+            )
+
+
+class FakeS3:
+    class exceptions:
+        class NoSuchKey(Exception):
+            pass
+
+    def __init__(self, objects: dict[str, bytes] | None = None):
+        # "bucket/key" -> body
+        self.objects = dict(objects or {})
+        self.metadata: dict[str, dict[str, str]] = {}
+        self.copies: list[tuple[str, str]] = []
+        self.puts: list[str] = []
+
+    def copy_object(self, Bucket, CopySource, Key, **kwargs):
+        self.copies.append((CopySource, f"{Bucket}/{Key}"))
+        if CopySource in self.objects:
+            self.objects[f"{Bucket}/{Key}"] = self.objects[CopySource]
+            self.metadata[f"{Bucket}/{Key}"] = self.metadata.get(CopySource, {})
+        return {}
+
+    def get_object(self, Bucket, Key, **kwargs):
+        key = f"{Bucket}/{Key}"
+        if key not in self.objects:
+            raise self.exceptions.NoSuchKey(Key)
+        return {"Body": io.BytesIO(self.objects[key]), "Metadata": self.metadata.get(key, {})}
+
+    def put_object(self, Bucket, Key, Body, Metadata=None, **kwargs):
+        self.puts.append(f"{Bucket}/{Key}")
+        self.objects[f"{Bucket}/{Key}"] = Body
+        self.metadata[f"{Bucket}/{Key}"] = Metadata or {}
+        return {"ETag": f'"{hashlib.md5(Body).hexdigest()}"'}
+
+
+class FakeRekognition:
+    """
+    CompareFaces and a face collection. Every image Rekognition would analyse takes
+    ``delay`` seconds, so compare_faces costs two and a collection search one.
+    Collection faces match attendance images under the student's key prefix.
+    """
+
+    class exceptions:
+        class InvalidParameterException(Exception):
+            pass
+
+        class ResourceNotFoundException(Exception):
+            pass
+
+        class ResourceAlreadyExistsException(Exception):
+            pass
+
+    def __init__(self, match: bool = True, delay: float = 0):
+        self.match = match
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.calls: collections.Counter[str] = collections.Counter()
+        self.images = 0
+        self.targets: list[str] = []
+        # CollectionId -> {FaceId: ExternalImageId}
+        self.collections: dict[str, dict[str, str]] = {}
+
+    def analyse(self, api: str, images: int) -> None:
+        with self.lock:
+            self.calls[api] += 1
+            self.images += images
+        time.sleep(self.delay * images)
+
+    def collection(self, collection_id: str) -> dict:
+        if collection_id not in self.collections:
+            raise self.exceptions.ResourceNotFoundException(collection_id)
+        return self.collections[collection_id]
+
+    def compare_faces(self, SourceImage, TargetImage, **kwargs):
+        self.targets.append(TargetImage["S3Object"]["Name"])
+        self.analyse("compare_faces", 2)
+        return {"FaceMatches": [{"Similarity": 99.0}] if self.match else []}
+
+    def create_collection(self, CollectionId):
+        with self.lock:
+            self.calls["create_collection"] += 1
+            if CollectionId in self.collections:
+                raise self.exceptions.ResourceAlreadyExistsException(CollectionId)
+            self.collections[CollectionId] = {}
+        return {"StatusCode": 200}
+
+    def index_faces(self, CollectionId, Image, ExternalImageId, **kwargs):
+        faces = self.collection(CollectionId)
+        self.analyse("index_faces", 1)
+        face_id = str(uuid.uuid4())
+        faces[face_id] = ExternalImageId
+        return {"FaceRecords": [{"Face": {"FaceId": face_id, "ExternalImageId": ExternalImageId}}]}
+
+    def search_faces_by_image(self, CollectionId, Image, MaxFaces=4096, **kwargs):
+        faces = self.collection(CollectionId)
+        self.analyse("search_faces_by_image", 1)
+        student_id = Image["S3Object"]["Name"].split("/")[0]
+        matches = [
+            {"Similarity": 99.0, "Face": {"FaceId": face_id, "ExternalImageId": external_id}}
+            for face_id, external_id in list(faces.items())
+            if self.match and external_id == student_id
+        ]
+        return {"FaceMatches": matches[:MaxFaces]}
+
+    def delete_faces(self, CollectionId, FaceIds):
+        faces = self.collection(CollectionId)
+        with self.lock:
+            self.calls["delete_faces"] += 1
+            deleted = [face_id for face_id in FaceIds if faces.pop(face_id, None) is not None]
+        return {"DeletedFaces": deleted}
+
+
+class FakeCloudWatch:
+    def __init__(self):
+        self.metric_data = []
+
+    def put_metric_data(self, Namespace, MetricData):
+        self.metric_data += [(Namespace, datum) for datum in MetricData]
+
+
+class FakeSession:
+    """Stands in for boto3.session.Session, every session hands out the same fake clients."""
+
+    def __init__(self, sqs: FakeSQS, s3: FakeS3 | None = None, rekognition: FakeRekognition | None = None):
+        self.clients = {
+            "sqs": sqs,
+            "s3": s3 or FakeS3(),
+            "rekognition": rekognition or FakeRekognition(),
+            "cloudwatch": FakeCloudWatch(),
+        }
+        self.configs: dict[str, Any] = {}
+        self.created: list[str] = []
+
+    def __call__(self):
+        self.created.append(threading.current_thread().name)
+        return self
+
+    def client(self, service_name: str, config=None):
+        self.configs[service_name] = config
+        return self.clients[service_name]
@@ -0,0 +1,157 @@
+import importlib
+
+import pytest
+from django.db import IntegrityError
+from django.test import override_settings
+from django.urls import clear_url_caches, resolve, reverse
+from rest_framework_simplejwt.tokens import AccessToken
+
+from attendance.core import async_views
+from attendance.core.checkin import mint_token
+from attendance.core.models import Attendance
+from attendance.core.tests.factories import AttendanceFactory, StudentFactory
+
+# The check-in view opts out of ATOMIC_REQUESTS, so it has to run outside the test transaction
+pytestmark = pytest.mark.django_db(transaction=True)
+
+
+def reload_urls():
+    import config.api_router
+    import config.urls
+
+    importlib.reload(config.api_router)
+    importlib.reload(config.urls)
+    clear_url_caches()
+
+
+@pytest.fixture(autouse=True)
+def async_views_enabled():
+    with override_settings(ATTENDANCE_ASYNC_VIEWS=True, ATTENDANCE_CHECKIN_FAST_PATH=True):
+        reload_urls()
+        yield
+    reload_urls()
+
+
+def authenticate(api_client, user):
+    api_client.credentials(HTTP_AUTHORIZATION=f"Bearer {AccessToken.for_user(user)}")
+    return api_client
+
+
+def test_async_views_are_routed():
+    assert resolve(reverse("api:attendance-list-create")).func is async_views.attendance_list_create
+    assert resolve(reverse("api:session-get-secret", args=[1])).func is async_views.session_get_secret
+
+
+def test_async_check_in(api_client, student, session):
+    url = reverse("api:attendance-list-create")
+    token = mint_token(session)
+    authenticate(api_client, student)
+
+    response = api_client.post(url, {"token": token}, format="json")
+    assert response.status_code == 201
+    attendance = Attendance.objects.get(session_id=session, student_id=student)
+    assert response.json() == {
+        "id": attendance.id,
+        "session_id": session.id,
+        "student_id": student.id,
+        "created_at": attendance.created_at.isoformat().replace("+00:00", "Z"),
+        "face_recognition_status": Attendance.FaceRecognitionStatus.NOT_REQUIRED,
+        "is_present": True,
+    }
+
+    response = api_client.post(url, {"token": token}, format="json")
+    assert response.status_code == 400
+    assert response.json() == {"errors": ["You have already checked in."]}
+
+
+def test_async_check_in_errors(api_client, session):
+    url = reverse("api:attendance-list-create")
+
+    response = api_client.post(url, {"token": mint_token(session)}, format="json")
+    assert response.status_code == 401
+    assert response.json() == {"detail": "Authentication credentials were not provided."}
+
+    authenticate(api_client, session.course_id.teacher_id)
+    response = api_client.post(url, {"token": mint_token(session)}, format="json")
+    assert response.status_code == 403
+
+    authenticate(api_client, StudentFactory())
+    response = api_client.post(url, {}, format="json")
+    assert response.json() == {"token": ["This field is required."]}
+
+
+def test_async_views_check_the_method_before_authenticating(api_client, session):
+    response = api_client.get(reverse("api:session-get-secret", args=[session.id]))
+
+    assert response.status_code == 405
+
+
+def test_async_views_use_the_configured_exception_handler(monkeypatch, api_client, student, session):
+    def fail(*args):
+        raise IntegrityError('new row violates check constraint "email_whitelisted_domain"')
+
+    authenticate(api_client, student)
+    url = reverse("api:attendance-list-create")
+    monkeypatch.setattr(async_views, "acheck_in", fail)
+
+    response = api_client.post(url, {"token": mint_token(session)}, format="json")
+    assert response.status_code == 400
+    assert response.json() == {"errors": ["Email domain is not whitelisted."]}
+
+    monkeypatch.setattr(async_views, "acheck_in", lambda *args: 1 / 0)
+    response = api_client.post(url, {"token": mint_token(session)}, format="json")
+    assert response.status_code == 500
+    assert response.json() == {"detail": "A server error occurred."}
+
+
+def test_async_list_falls_back_to_drf(api_client, student, session):
+    AttendanceFactory(session_id=session, student_id=student)
+    authenticate(api_client, student)
+
+    response = api_client.get(reverse("api:attendance-list-create"))
+
+    assert response.status_code == 200
+    assert response.json()[0]["session_id"]["id"] == session.id
+
+
+def test_async_get_secret(api_client, session):
+    url = reverse("api:session-get-secret", args=[session.id])
+    authenticate(api_client, session.course_id.teacher_id)
+
+    secret = api_client.post(url).json()["secret"]
+
+    assert secret == session.generate_secret()
+    assert api_client.post(url).json() == {"secret": secret}
+
+    authenticate(api_client, StudentFactory())
+    assert api_client.post(url).status_code == 403
+
+
+def test_async_get_secret_of_another_teacher(api_client, session, user):
+    user.role = user.UserRoleChoices.TEACHER
+    user.save()
+    authenticate(api_client, user)
+
+    response = api_client.post(reverse("api:session-get-secret", args=[session.id]))
+
+    assert response.status_code == 404
+
+
+def test_async_face_status(api_client, student, session):
+    attendance = AttendanceFactory(
+        session_id=session,
+        student_id=student,
+        face_recognition_status=Attendance.FaceRecognitionStatus.PENDING,
+        is_present=False,
+    )
+    url = reverse("api:attendance-face-status", args=[attendance.id])
+
+    response = authenticate(api_client, student).get(url)
+    assert response.json() == {
+        "id": attendance.id,
+        "face_recognition_status": Attendance.FaceRecognitionStatus.PENDING,
+        "is_present": False,
+    }
+
+    assert authenticate(api_client, session.course_id.teacher_id).get(url).status_code == 200
+    assert authenticate(api_client, StudentFactory()).get(url).status_code == 404
@@ -0,0 +1,180 @@
+import fakeredis
+import pytest
+from django.urls import reverse
+
+from attendance.core import buffer
+from attendance.core.buffer import DEAD_LETTER_KEY, STREAM_KEY, CheckInFlusher, flush_stats
+from attendance.core.checkin import mint_token
+from attendance.core.counters import get_counts
+from attendance.core.models import Attendance
+from attendance.core.tests.factories import AttendanceFactory, SessionFactory, StudentFactory
+
+# The check-in view opts out of ATOMIC_REQUESTS, so it has to run outside the test transaction
+pytestmark = pytest.mark.django_db(transaction=True)
+
+URL = reverse("api:attendance-list-create")
+
+
+@pytest.fixture(autouse=True)
+def write_behind(settings, monkeypatch):
+    settings.ATTENDANCE_CHECKIN_FAST_PATH = True
+    settings.ATTENDANCE_CHECKIN_WRITE_BEHIND = True
+    redis = fakeredis.FakeRedis()
+    monkeypatch.setattr(buffer, "get_redis_connection", lambda alias: redis)
+    return redis
+
+
+def test_buffered_check_in_is_visible_before_flush(student_client, student, session):
+    response = student_client.post(URL, {"token": mint_token(session)}, format="json")
+
+    assert response.status_code == 201
+    assert response.json()["id"] is None
+    assert not Attendance.objects.exists()
+
+    response = student_client.get(URL)
+    assert [row["session_id"]["id"] for row in response.json()] == [session.id]
+    assert response.json()[0]["student_id"]["id"] == student.id
+    response = student_client.get(URL, {"flat": "true"})
+    assert [row["session_id"] for row in response.json()["results"]] == [session.id]
+    assert [row["id"] for row in response.json()["sessions"]] == [session.id]
+
+
+def test_buffered_check_ins_keep_to_the_list_order_and_pages(student_client, student, session):
+    flushed = [
+        AttendanceFactory(session_id=SessionFactory(course_id=session.course_id), student_id=student) for _ in range(2)
+    ]
+    student_client.post(URL, {"token": mint_token(session)}, format="json")
+
+    # The newest check-in, first or last in the whole list
+    assert [row["id"] for row in student_client.get(URL).json()] == [None] + [a.id for a in flushed[::-1]]
+    response = student_client.get(URL, {"ordering": "created_at"})
+    assert [row["id"] for row in response.json()] == [a.id for a in flushed] + [None]
+
+    # A page keeps its size, the first one has them apart
+    response = student_client.get(URL, {"page_size": 1}).json()
+    assert [row["id"] for row in response["results"]] == [flushed[-1].id]
+    assert [row["session_id"]["id"] for row in response["pending"]] == [session.id]
+    response = student_client.get(response["next"]).json()
+    assert [row["id"] for row in response["results"]] == [flushed[0].id]
+    assert response["pending"] == []
+    response = student_client.get(URL, {"page_size": 1, "flat": "true"}).json()
+    assert [row["session_id"] for row in response["pending"]] == [session.id]
+    assert session.id in [row["id"] for row in response["sessions"]]
+
+
+def test_buffered_check_in_rejects_duplicates(student_client, session):
+    token = mint_token(session)
+    student_client.post(URL, {"token": token}, format="json")
+
+    response = student_client.post(URL, {"token": token}, format="json")
+
+    assert response.json() == {"errors": ["You have already checked in."]}
+
+
+def test_flusher_writes_buffered_check_ins(student_client, student, session):
+    student_client.post(URL, {"token": mint_token(session)}, format="json")
+    flusher = CheckInFlusher("test", batch_size=10)
+
+    assert flusher.flush(flusher.read_batch(">")) == 1
+
+    attendance = Attendance.objects.get(session_id=session, student_id=student)
+    assert attendance.is_present
+    assert attendance.face_recognition_status == Attendance.FaceRecognitionStatus.NOT_REQUIRED
+    assert [row["id"] for row in student_client.get(URL).json()] == [attendance.id]
+    assert flush_stats() | {"last_lag_ms": 0} == {
+        "last_batch_size": 1,
+        "last_lag_ms": 0,
+        "flushed_total": 1,
+        "backlog": 0,
+    }
+
+
+def test_face_recognition_check_ins_are_not_buffered(student_client, session):
+    session.face_recognition_enabled = True
+    session.save()
+
+    response = student_client.post(URL, {"token": mint_token(session)}, format="json")
+
+    assert response.json()["id"] == Attendance.objects.get().id
+
+
+def test_flusher_counts_only_the_check_ins_it_inserts(api_client, session):
+    students = StudentFactory.create_batch(3)
+    # Checked in before the buffer was turned on
+    AttendanceFactory(session_id=session, student_id=students[0], is_present=True)
+    assert get_counts(session.id)["present"] == 1
+    for student in students:
+        api_client.force_authenticate(student)
+        api_client.post(URL, {"token": mint_token(session)}, format="json")
+    # Not counted until they are flushed
+    assert get_counts(session.id)["present"] == 1
+
+    flusher = CheckInFlusher("test", batch_size=10)
+    flusher.flush(flusher.read_batch(">"))
+
+    assert Attendance.objects.filter(session_id=session).count() == 3
+    assert get_counts(session.id) == {"present": 3, "pending": 0, "failed": 0, "total": 3}
+
+
+def test_flusher_keeps_the_buffered_created_at(student_client, student, session):
+    response = student_client.post(URL, {"token": mint_token(session)}, format="json")
+    flusher = CheckInFlusher("test", batch_size=10)
+
+    flusher.flush(flusher.read_batch(">"))
+
+    attendance = Attendance.objects.get(session_id=session, student_id=student)
+    assert attendance.created_at.isoformat().replace("+00:00", "Z") == response.json()["created_at"]
+
+
+def test_flusher_drops_check_ins_of_deleted_students(api_client, session):
+    students = StudentFactory.create_batch(2)
+    for student in students:
+        api_client.force_authenticate(student)
+        api_client.post(URL, {"token": mint_token(session)}, format="json")
+    students[0].delete()
+    flusher = CheckInFlusher("test", batch_size=10)
+
+    assert flusher.flush(flusher.read_batch(">")) == 2
+
+    assert list(Attendance.objects.values_list("student_id", flat=True)) == [students[1].id]
+    assert flush_stats()["backlog"] == 0
+
+
+def test_flusher_dead_letters_rows_it_cannot_insert(write_behind, student_client, student, session):
+    student_client.post(URL, {"token": mint_token(session)}, format="json")
+    write_behind.xadd(STREAM_KEY, {"session_id": session.id, "student_id": student.id, "created_at": "garbage"})
+    flusher = CheckInFlusher("test", batch_size=10)
+
+    assert flusher.flush(flusher.read_batch(">")) == 1
+
+    assert Attendance.objects.get().student_id == student
+    assert write_behind.xlen(STREAM_KEY) == 0
+    [(_, fields)] = write_behind.xrange(DEAD_LETTER_KEY)
+    assert fields[b"created_at"] == b"garbage"
+    assert flush_stats()["dead_lettered_total"] == 1
+
+
+def test_flusher_dead_letters_entries_that_keep_failing(write_behind, student_client, session):
+    student_client.post(URL, {"token": mint_token(session)}, format="json")
+    flusher = CheckInFlusher("test", batch_size=10, max_deliveries=2)
+    flusher.read_batch(">")
+
+    # Each read of the pending entries after a failed flush is another delivery
+    assert flusher.drop_exhausted(flusher.read_batch("0"))
+    assert not flusher.drop_exhausted(flusher.read_batch("0"))
+
+    assert write_behind.xlen(DEAD_LETTER_KEY) == 1
+    assert flusher.read_batch("0") == []
+    assert student_client.get(URL).json() == []
+
+
+def test_flusher_claims_check_ins_another_flusher_never_acknowledged(student_client, student, session):
+    student_client.post(URL, {"token": mint_token(session)}, format="json")
+    CheckInFlusher("replaced", batch_size=10).read_batch(">")
+    flusher = CheckInFlusher("test", batch_size=10, claim_idle_ms=0)
+
+    assert flusher.read_batch(">") == []
+    assert flusher.claim_idle() == 1
+    assert flusher.flush(flusher.read_batch("0")) == 1
+
+    assert Attendance.objects.get().student_id == student
@@ -0,0 +1,274 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import jwt
+import pytest
+from django.core.cache import cache
+from django.db import connection
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from attendance.core import checkin, metrics
+from attendance.core.checkin import mint_token
+from attendance.core.management.commands.process_sqs_msg import FaceRecognitionProcessor
+from attendance.core.metrics import get_counters
+from attendance.core.models import SESSION_CACHE_KEY, Attendance
+from attendance.core.tests.factories import AttendanceFactory, StudentFactory
+
+# The check-in view opts out of ATOMIC_REQUESTS, so it has to run outside the test transaction
+pytestmark = pytest.mark.django_db(transaction=True)
+
+URL = reverse("api:attendance-list-create")
+
+
+@pytest.fixture(autouse=True)
+def fast_path(settings):
+    settings.ATTENDANCE_CHECKIN_FAST_PATH = True
+
+
+def test_check_in_returns_flat_response(student_client, student, session):
+    response = student_client.post(URL, {"token": mint_token(session)}, format="json")
+
+    assert response.status_code == 201
+    attendance = Attendance.objects.get(session_id=session, student_id=student)
+    assert response.json() == {
+        "id": attendance.id,
+        "session_id": session.id,
+        "student_id": student.id,
+        "created_at": attendance.created_at.isoformat().replace("+00:00", "Z"),
+        "face_recognition_status": Attendance.FaceRecognitionStatus.NOT_REQUIRED,
+        "is_present": True,
+    }
+
+
+def test_check_in_with_face_recognition_is_pending(student_client, session):
+    session.face_recognition_enabled = True
+    session.save()
+
+    response = student_client.post(URL, {"token": mint_token(session)}, format="json")
+
+    assert response.status_code == 201
+    assert response.json()["face_recognition_status"] == Attendance.FaceRecognitionStatus.PENDING
+    assert response.json()["is_present"] is False
+    assert "face_image_upload_url" in response.json()
+
+
+def test_check_in_twice_is_rejected(student_client, session):
+    token = mint_token(session)
+    student_client.post(URL, {"token": token}, format="json")
+
+    response = student_client.post(URL, {"token": token}, format="json")
+
+    assert response.status_code == 400
+    assert response.json() == {"errors": ["You have already checked in."]}
+
+
+def test_duplicate_check_in_is_rejected_from_cache(student_client, session, django_assert_num_queries):
+    token = mint_token(session)
+    student_client.post(URL, {"token": token}, format="json")
+
+    with django_assert_num_queries(0):
+        response = student_client.post(URL, {"token": token}, format="json")
+
+    assert response.json() == {"errors": ["You have already checked in."]}
+    assert get_counters()[metrics.CHECK_IN_DUPLICATES_REJECTED] == 1
+
+
+def test_pending_face_recognition_check_in_can_be_retried(student_client, session):
+    session.face_recognition_enabled = True
+    session.save()
+    token = mint_token(session)
+
+    first = student_client.post(URL, {"token": token}, format="json")
+    second = student_client.post(URL, {"token": token}, format="json")
+
+    assert second.status_code == 201
+    assert second.json()["id"] == first.json()["id"]
+
+
+@pytest.fixture
+def pending_check_in(student_client, session) -> int:
+    session.face_recognition_enabled = True
+    session.save()
+    return student_client.post(URL, {"token": mint_token(session)}, format="json").json()["id"]
+
+
+def test_face_recognition_marks_the_check_in_until_the_session_expires(
+    monkeypatch, student_client, student, session, pending_check_in
+):
+    marked = []
+    monkeypatch.setattr(checkin, "mark_checked_in", lambda *args: marked.append(args))
+    processor = FaceRecognitionProcessor.__new__(FaceRecognitionProcessor)
+
+    processor.update_attendance_record(pending_check_in, Attendance.FaceRecognitionStatus.SUCCESS, "key")
+
+    key = SESSION_CACHE_KEY.format(teacher_id=session.course_id.teacher_id.id, session_id=session.id)
+    assert marked == [(session.id, student.id, cache.get(key)["expires_at"])]
+
+
+def test_image_processing_callback_marks_the_check_in(
+    api_client, student_client, session, pending_check_in, django_assert_num_queries
+):
+    api_client.post(
+        reverse("api:image-processing-callback"),
+        {
+            "id": pending_check_in,
+            "face_recognition_status": Attendance.FaceRecognitionStatus.SUCCESS,
+            "face_image": "key",
+        },
+        format="json",
+        HTTP_X_INTERNAL_SERVICE="Lambda",
+    )
+
+    with django_assert_num_queries(0):
+        response = student_client.post(URL, {"token": mint_token(session)}, format="json")
+
+    assert response.json() == {"errors": ["You have already checked in."]}
+
+
+def test_image_processing_callback_sets_is_present(api_client, pending_check_in):
+    for status, is_present in [
+        (Attendance.FaceRecognitionStatus.FAILED, False),
+        (Attendance.FaceRecognitionStatus.SUCCESS, True),
+    ]:
+        api_client.post(
+            reverse("api:image-processing-callback"),
+            {"id": pending_check_in, "face_recognition_status": status, "face_image": "key"},
+            format="json",
+            HTTP_X_INTERNAL_SERVICE="Lambda",
+        )
+
+        assert Attendance.objects.get(id=pending_check_in).is_present is is_present
+
+
+def test_override_marks_the_check_in(student_client, session, pending_check_in, django_assert_num_queries):
+    teacher_client = APIClient()
+    teacher_client.force_authenticate(session.course_id.teacher_id)
+    teacher_client.post(reverse("api:attendance-override", args=[pending_check_in]))
+
+    assert Attendance.objects.get(id=pending_check_in).is_present
+    with django_assert_num_queries(0):
+        response = student_client.post(URL, {"token": mint_token(session)}, format="json")
+    assert response.json() == {"errors": ["You have already checked in."]}
+
+
+@pytest.mark.parametrize(
+    ("token", "error"),
+    [
+        ("not-a-jwt", "Invalid token."),
+        (jwt.encode({"session_id": 1}, "secret", algorithm="HS256"), "Invalid token."),
+        (
+            jwt.encode({"session_id": 1, "teacher_id": 1}, "secret", algorithm="HS256"),
+            "Token not active for this session.",
+        ),
+    ],
+)
+def test_check_in_rejects_malformed_tokens(student_client, token, error):
+    response = student_client.post(URL, {"token": token}, format="json")
+
+    assert response.status_code == 400
+    assert response.json() == {"errors": [error]}
+
+
+def test_check_in_rejects_bad_signature(student_client, session):
+    session.generate_secret()
+    token = jwt.encode(
+        {"session_id": session.id, "teacher_id": session.course_id.teacher_id.id}, "wrong", algorithm="HS256"
+    )
+
+    response = student_client.post(URL, {"token": token}, format="json")
+
+    assert response.json() == {"errors": ["Invalid signature."]}
+
+
+def test_check_in_rejects_expired_token(student_client, session):
+    response = student_client.post(URL, {"token": mint_token(session, expires_in=-1)}, format="json")
+
+    assert response.json() == {"errors": ["Token expired."]}
+
+
+def test_check_in_rejects_token_not_yet_valid(student_client, session):
+    payload = {"session_id": session.id, "teacher_id": session.course_id.teacher_id.id, "nbf": time.time() + 60}
+    token = jwt.encode(payload, session.generate_secret(), algorithm="HS256")
+
+    response = student_client.post(URL, {"token": token}, format="json")
+
+    assert response.json() == {"errors": ["Invalid token."]}
+
+
+def test_check_in_checks_location(student_client, session):
+    session.location_enabled = True
+    session.latitude, session.longitude = 28.6024, -81.2001
+    session.save()
+    token = mint_token(session)
+
+    response = student_client.post(URL, {"token": token}, format="json")
+    assert response.json() == {"errors": ["Longitude and latitude are required."]}
+
+    response = student_client.post(URL, {"token": token, "latitude": 28.6124, "longitude": -81.2001}, format="json")
+    assert response.json() == {"errors": ["Location not within range."]}
+
+    response = student_client.post(URL, {"token": token, "latitude": 28.6025, "longitude": -81.2001}, format="json")
+    assert response.status_code == 201
+
+
+def test_check_in_requires_token(student_client):
+    response = student_client.post(URL, {}, format="json")
+
+    assert response.status_code == 400
+    assert response.json() == {"token": ["This field is required."]}
+
+
+def test_face_status(student_client, student, session):
+    attendance = AttendanceFactory(session_id=session, student_id=student)
+
+    response = student_client.get(reverse("api:attendance-face-status", args=[attendance.id]))
+
+    assert response.json() == {
+        "id": attendance.id,
+        "face_recognition_status": attendance.face_recognition_status,
+        "is_present": attendance.is_present,
+    }
+
+
+def test_legacy_check_in_returns_nested_response(settings, student_client, session):
+    settings.ATTENDANCE_CHECKIN_FAST_PATH = False
+
+    response = student_client.post(URL, {"token": mint_token(session)}, format="json")
+
+    assert response.status_code == 201
+    assert response.json()["session_id"]["course_id"]["id"] == session.course_id.id
+
+
+@pytest.mark.parametrize("face_recognition_enabled", [False, True])
+def test_concurrent_check_ins_write_one_row_per_student(session, face_recognition_enabled):
+    session.face_recognition_enabled = face_recognition_enabled
+    session.save()
+    students = StudentFactory.create_batch(50)
+    token = mint_token(session, expires_in=60)
+
+    def post(student):
+        client = APIClient()
+        client.force_authenticate(student)
+        try:
+            response = client.post(URL, {"token": token}, format="json")
+            return student.id, response.status_code, response.json()
+        finally:
+            connection.close()
+
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        results = list(executor.map(post, students * 4))
+
+    assert Attendance.objects.filter(session_id=session).count() == len(students)
+    assert all(status_code in (201, 400) for _, status_code, _ in results)
+    for student in students:
+        responses = [(status_code, body) for student_id, status_code, body in results if student_id == student.id]
+        created = [body for status_code, body in responses if status_code == 201]
+        if face_recognition_enabled:
+            assert len(created) == 4
+            assert len({body["id"] for body in created}) == 1
+        else:
+            assert len(created) == 1
+            assert [body for status_code, body in responses if status_code == 400] == [
+                {"errors": ["You have already checked in."]}
+            ] * 3
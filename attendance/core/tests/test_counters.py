@@ -0,0 +1,104 @@
+import pytest
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from attendance.core.checkin import mint_token
+from attendance.core.counters import count_keys, get_counts
+from attendance.core.management.commands.process_sqs_msg import FaceRecognitionProcessor
+from attendance.core.models import Attendance
+from attendance.core.tests.factories import AttendanceFactory, StudentFactory
+
+# Check-in opts out of ATOMIC_REQUESTS, so it has to run outside the test transaction
+pytestmark = pytest.mark.django_db(transaction=True)
+
+EMPTY = {"present": 0, "pending": 0, "failed": 0, "total": 0}
+
+
+def check_in(api_client, session, student):
+    api_client.force_authenticate(student)
+    return api_client.post(reverse("api:attendance-list-create"), {"token": mint_token(session)}, format="json")
+
+
+def summary(api_client, session):
+    api_client.force_authenticate(session.course_id.teacher_id)
+    return api_client.get(reverse("api:session-summary", args=[session.id])).json()
+
+
+def test_counts_follow_check_in_and_face_recognition(api_client, session):
+    session.face_recognition_enabled = True
+    session.save()
+    students = StudentFactory.create_batch(3)
+    ids = [check_in(api_client, session, student).json()["id"] for student in students]
+    # A retry while face recognition is pending is not a new check-in
+    check_in(api_client, session, students[0])
+    assert summary(api_client, session) == {**EMPTY, "pending": 3, "total": 3}
+
+    processor = FaceRecognitionProcessor.__new__(FaceRecognitionProcessor)
+    processor.update_attendance_record(ids[0], Attendance.FaceRecognitionStatus.SUCCESS, "key")
+    processor.update_attendance_record(ids[1], Attendance.FaceRecognitionStatus.FAILED, "key")
+    # SQS delivers at least once
+    processor.update_attendance_record(ids[1], Attendance.FaceRecognitionStatus.FAILED, "key")
+    assert summary(api_client, session) == {"present": 1, "pending": 1, "failed": 1, "total": 3}
+
+    api_client.force_authenticate(session.course_id.teacher_id)
+    api_client.post(reverse("api:attendance-override", args=[ids[1]]))
+    response = api_client.post(
+        reverse("api:image-processing-callback"),
+        {"id": ids[2], "face_recognition_status": Attendance.FaceRecognitionStatus.FAILED, "face_image": "key"},
+        format="json",
+        HTTP_X_INTERNAL_SERVICE="Lambda",
+    )
+    assert response.status_code == 201
+    assert summary(api_client, session) == {"present": 2, "pending": 0, "failed": 1, "total": 3}
+
+
+def test_counts_without_face_recognition(api_client, session):
+    for student in StudentFactory.create_batch(2):
+        check_in(api_client, session, student)
+
+    assert summary(api_client, session) == {**EMPTY, "present": 2, "total": 2}
+
+
+def test_summary_skips_the_database_while_the_session_is_cached(api_client, session):
+    session.generate_secret()
+    api_client.force_authenticate(session.course_id.teacher_id)
+    get_counts(session.id)
+
+    with CaptureQueriesContext(connection) as queries:
+        response = api_client.get(reverse("api:session-summary", args=[session.id]))
+
+    assert response.json() == EMPTY
+    # Only ATOMIC_REQUESTS' own transaction
+    assert [query["sql"] for query in queries] == ["BEGIN", "COMMIT"]
+
+
+def test_summary_of_another_teachers_session(api_client, session, user):
+    user.role = user.UserRoleChoices.TEACHER
+    user.save()
+    api_client.force_authenticate(user)
+
+    response = api_client.get(reverse("api:session-summary", args=[session.id]))
+
+    assert response.status_code == 404
+
+
+def test_counts_are_rebuilt_from_sql(session):
+    AttendanceFactory(session_id=session, is_present=True)
+    AttendanceFactory(session_id=session, face_recognition_status=Attendance.FaceRecognitionStatus.PENDING)
+    AttendanceFactory(session_id=session, face_recognition_status=Attendance.FaceRecognitionStatus.FAILED)
+    AttendanceFactory(session_id=session, face_recognition_status=Attendance.FaceRecognitionStatus.SUCCESS)
+
+    assert get_counts(session.id) == {"present": 2, "pending": 1, "failed": 1, "total": 4}
+
+
+def test_reconcile_session_counts(session, capsys):
+    AttendanceFactory(session_id=session, is_present=True)
+    cache.set_many({key: 7 for key in count_keys(session.id).values()})
+
+    call_command("reconcile_session_counts", session=[session.id])
+
+    assert get_counts(session.id) == {**EMPTY, "present": 1, "total": 1}
+    assert "1 had drifted" in capsys.readouterr().out
@@ -0,0 +1,117 @@
+import numpy as np
+import pytest
+from django.core.management import call_command
+
+from attendance.core import embeddings
+from attendance.core.embeddings import EmbeddingStore
+
+
+def vector(*values) -> np.ndarray:
+    return np.array(values, dtype=np.float32)
+
+
+def stored(store: EmbeddingStore, student_id: int, face_id: str) -> np.ndarray:
+    embedding = store.get(student_id, face_id)
+    assert embedding is not None
+    return embedding
+
+
+def test_lookups_are_views_into_the_store(tmp_path):
+    store = EmbeddingStore(tmp_path)
+    store.put(1, "a", vector(3, 4))
+
+    embedding = stored(store, 1, "a")
+
+    assert np.allclose(embedding, [0.6, 0.8])
+    assert np.shares_memory(embedding, store.matrix)
+    assert not embedding.flags.writeable
+    assert store.get(1, "b") is None
+    assert store.get(2, "a") is None
+
+
+def test_reenrollment_replaces_the_embedding(tmp_path):
+    store = EmbeddingStore(tmp_path)
+    store.put(1, "a", vector(1, 0))
+    store.put(2, "b", vector(0, 1))
+
+    store.put(1, "c", vector(1, 1))
+
+    assert store.get(1, "a") is None
+    assert np.allclose(stored(store, 1, "c"), [2**-0.5, 2**-0.5])
+    assert (store.size, store.replaced) == (3, 1)
+
+
+def test_workers_share_the_store(tmp_path):
+    store, other = EmbeddingStore(tmp_path), EmbeddingStore(tmp_path)
+    store.put(1, "a", vector(1, 0))
+    # Appended in place: the other worker maps the same rows
+    assert np.allclose(stored(other, 1, "a"), [1, 0])
+
+    other.put(1, "b", vector(0, 1))
+    assert store.get(1, "a") is None
+    assert store.compact(force=True) == 1
+    # A new generation was written, the other worker switches to it on its next miss
+    other.put(2, "c", vector(1, 1))
+    assert np.allclose(stored(store, 1, "b"), [0, 1])
+    assert store.get(2, "c") is not None
+    assert (store.size, store.replaced) == (2, 0)
+
+
+def test_store_grows(tmp_path, monkeypatch):
+    monkeypatch.setattr(embeddings, "MIN_CAPACITY", 4)
+    store = EmbeddingStore(tmp_path)
+
+    for student_id in range(1, 11):
+        store.put(student_id, f"face {student_id}", vector(student_id, 1))
+
+    assert len(store.index) >= 10
+    assert all(store.get(student_id, f"face {student_id}") is not None for student_id in range(1, 11))
+    # Old generations are cleaned up
+    assert len(list(tmp_path.glob("generation-*"))) == 1
+
+
+def test_similarities_against_a_sessions_students(tmp_path):
+    store = EmbeddingStore(tmp_path)
+    for student_id, embedding in {1: vector(1, 0), 2: vector(0, 1), 3: vector(-1, 0)}.items():
+        store.put(student_id, str(student_id), embedding)
+
+    scores = store.similarities(np.array([[1, 0], [1, 1]]), [3, 1, 4])
+
+    assert np.allclose(scores[:, :2], [[-1.0, 1.0], [-(0.5**0.5), 0.5**0.5]])
+    assert np.isnan(scores[:, 2]).all()
+    assert np.allclose(store.pair_similarities([1, 2], np.array([[1, 0], [1, 0]])), [1, 0])
+
+
+def test_removed_faces_are_compacted(tmp_path):
+    store = EmbeddingStore(tmp_path)
+    for student_id in range(1, 4):
+        store.put(student_id, str(student_id), vector(student_id, 1))
+
+    store.remove(["1"])
+    # One replaced row against two live ones isn't worth a rewrite yet
+    assert store.compact() == 0
+    store.remove(["2"])
+    assert store.compact() == 2
+
+    assert store.get(1, "1") is None
+    assert store.get(3, "3") is not None
+    assert store.size == 1
+
+
+def test_compact_face_embeddings(tmp_path, settings, capsys):
+    settings.FACE_EMBEDDING_STORE = str(tmp_path)
+    store = EmbeddingStore(tmp_path)
+    store.put(1, "a", vector(1, 0))
+    store.put(1, "b", vector(0, 1))
+
+    call_command("compact_face_embeddings")
+
+    assert "Dropped 1 replaced embeddings, 1 rows left" in capsys.readouterr().out
+
+
+def test_dimensions_have_to_match(tmp_path):
+    store = EmbeddingStore(tmp_path)
+    store.put(1, "a", vector(1, 0))
+
+    with pytest.raises(ValueError):
+        store.put(2, "b", vector(1, 0, 0))
@@ -0,0 +1,136 @@
+import functools
+
+import pytest
+from django.core.management import call_command
+
+from attendance.core.embeddings import EmbeddingStore
+from attendance.core.faces import COLLECTION, LocalFaceComparator, RekognitionFaceComparator, fake_embedder
+from attendance.core.models import Attendance
+from attendance.core.tests.factories import AttendanceFactory, PendingAttendanceFactory, SessionFactory, StudentFactory
+from attendance.core.tests.fake_aws import FakeRekognition, FakeS3, FakeSession, FakeSQS, s3_event
+from attendance.users.models import User
+
+# Workers use their own database connections, so the rows have to be committed
+pytestmark = pytest.mark.django_db(transaction=True)
+
+
+def test_compare_batch(tmp_path):
+    s3 = FakeS3({f"media/{i}/init.jpeg": f"person {i}".encode() for i in range(1, 4)})
+    s3.objects |= {"media/4/init.jpeg": b"no face", "media/1/1.jpeg": b"person 1#1", "media/2/1.jpeg": b"person 3#1"}
+    s3.objects |= {"media/3/1.jpeg": b"no face", "media/4/1.jpeg": b"person 4#1", "media/5/1.jpeg": b"person 5#1"}
+    rekognition = FakeRekognition()
+    client = FakeSession(FakeSQS(), s3=s3, rekognition=rekognition)().client
+    fallback = RekognitionFaceComparator(client, mode=COLLECTION)
+    comparator = LocalFaceComparator(
+        client, embedder=fake_embedder, threshold=0.8, store=EmbeddingStore(tmp_path / "a"), fallback=fallback
+    )
+    face_ids = [comparator.enroll("media", f"{student_id}/init.jpeg", student_id) for student_id in range(1, 5)]
+    comparisons = [(student_id, face_id, f"{student_id}/1.jpeg") for student_id, face_id in zip(range(1, 6), face_ids)]
+    comparisons.append((5, "", "5/1.jpeg"))
+    # Enrolled in the Rekognition collection before the switch
+    comparisons.append((6, fallback.enroll("media", "6/init.jpeg", 6), "6/1.jpeg"))
+
+    results = comparator.compare_batch("media", comparisons)
+
+    # Only the first is the same person, student 3's image has no face. Student 4's init image has no face
+    # and 5 never enrolled, they are compared pairwise by Rekognition, 6 is searched in its collection
+    assert face_ids[3] == ""
+    assert results == [True, False, False, True, True, True]
+    assert rekognition.targets == ["4/1.jpeg", "5/1.jpeg"]
+    assert rekognition.calls["search_faces_by_image"] == 1
+    # A host that didn't enroll them loads the embeddings from S3
+    elsewhere = LocalFaceComparator(
+        client, embedder=fake_embedder, threshold=0.8, store=EmbeddingStore(tmp_path / "b"), fallback=fallback
+    )
+    assert elsewhere.compare_batch("media", comparisons) == results
+    assert elsewhere.store.size == 3
+
+
+def test_students_without_an_embedding_only_use_rekognition_if_enabled(settings, tmp_path):
+    s3 = FakeS3({"media/1/init.jpeg": b"person 1", "media/1/1.jpeg": b"person 1#1"})
+    rekognition = FakeRekognition()
+    client = FakeSession(FakeSQS(), s3=s3, rekognition=rekognition)().client
+    comparisons = [(1, "", "1/1.jpeg")]
+
+    comparator = LocalFaceComparator(client, embedder=fake_embedder, store=EmbeddingStore(tmp_path))
+    assert comparator.compare_batch("media", comparisons) == [False]
+    assert rekognition.targets == []
+
+    settings.FACE_LOCAL_FALLBACK = True
+    comparator = LocalFaceComparator(client, embedder=fake_embedder, store=EmbeddingStore(tmp_path))
+    assert comparator.compare_batch("media", comparisons) == [True]
+    assert rekognition.targets == ["1/1.jpeg"]
+
+
+def test_benchmark_face_comparison(capsys):
+    call_command("benchmark_face_comparison", students=20, batch_size=4)
+
+    assert "20 of 20 correct" in capsys.readouterr().out
+
+
+def test_processor_with_the_local_backend(session, tmp_path, processor_for):
+    students = StudentFactory.create_batch(2)
+    enrollments = [AttendanceFactory(session_id=session, student_id=student) for student in students]
+    next_session = SessionFactory(course_id=session.course_id)
+    attendances = [PendingAttendanceFactory(session_id=next_session, student_id=student) for student in students]
+    s3 = FakeS3()
+    for student, enrollment, attendance in zip(students, enrollments, attendances):
+        s3.objects[f"media/{student.id}/{enrollment.id}_init.jpeg"] = f"person {student.id}".encode()
+    # The first student checks in as themselves, the second as someone else
+    s3.objects[f"media/{students[0].id}/{attendances[0].id}.jpeg"] = f"person {students[0].id}#1".encode()
+    s3.objects[f"media/{students[1].id}/{attendances[1].id}.jpeg"] = b"person 0#1"
+    sqs = FakeSQS(
+        [s3_event(*(f"{s.id}/{e.id}_init.jpeg" for s, e in zip(students, enrollments)))]
+        + [s3_event(f"{a.student_id.id}/{a.id}.jpeg") for a in attendances]
+    )
+    processor, _ = processor_for(
+        sqs,
+        concurrency=1,
+        comparator_class=functools.partial(
+            LocalFaceComparator, embedder=fake_embedder, threshold=0.8, store=EmbeddingStore(tmp_path)
+        ),
+        s3=s3,
+    )
+    sqs.on_drained = processor.stop
+
+    processor.run()
+
+    assert processor.processed == 3
+    assert [
+        Attendance.objects.get(id=attendance.id).face_recognition_status for attendance in attendances
+    ] == [Attendance.FaceRecognitionStatus.SUCCESS, Attendance.FaceRecognitionStatus.FAILED]
+    face_id = User.objects.get(id=students[0].id).face_id
+    assert f"media/{students[0].id}/{face_id}.npy" in s3.objects
+
+
+def test_processor_compares_a_receive_batch_at_once(monkeypatch, session, tmp_path, processor_for):
+    attendances = PendingAttendanceFactory.create_batch(4, session_id=session)
+    s3 = FakeS3()
+    comparator_class = functools.partial(
+        LocalFaceComparator, embedder=fake_embedder, threshold=0.8, store=EmbeddingStore(tmp_path)
+    )
+    enroller = comparator_class(FakeSession(FakeSQS(), s3=s3)().client)
+    for attendance in attendances:
+        student = attendance.student_id
+        s3.objects[f"media/{student.id}/init.jpeg"] = f"person {student.id}".encode()
+        s3.objects[f"media/{student.id}/{attendance.id}.jpeg"] = f"person {student.id}#1".encode()
+        student.face_id = enroller.enroll("media", f"{student.id}/init.jpeg", student.id)
+        student.save()
+    batches = []
+    compare_batch = LocalFaceComparator.compare_batch
+
+    def counted(self, bucket_name, comparisons):
+        batches.append(len(comparisons))
+        return compare_batch(self, bucket_name, comparisons)
+
+    monkeypatch.setattr(LocalFaceComparator, "compare_batch", counted)
+    sqs = FakeSQS(s3_event(f"{a.student_id.id}/{a.id}.jpeg") for a in attendances)
+    processor, _ = processor_for(sqs, concurrency=4, comparator_class=comparator_class, s3=s3)
+    sqs.on_drained = processor.stop
+
+    processor.run()
+
+    assert batches == [4]
+    assert set(
+        Attendance.objects.filter(session_id=session).values_list("face_recognition_status", flat=True)
+    ) == {Attendance.FaceRecognitionStatus.SUCCESS}
@@ -0,0 +1,42 @@
+import pytest
+from django.urls import reverse
+
+URL = reverse("api:attendance-list-create")
+REPORT_URL = reverse("api:attendance-report-list")
+
+
+def nest(data: dict) -> list[dict]:
+    sessions = {session["id"]: session for session in data["sessions"]}
+    return [{**row, "session_id": sessions[row["session_id"]]} for row in data["results"]]
+
+
+@pytest.mark.parametrize("url", [URL, REPORT_URL])
+def test_flat_list_has_the_nested_rows(teacher_client, attendances, url):
+    nested = teacher_client.get(url).json()
+
+    flat = teacher_client.get(url, {"flat": "true"}).json()
+
+    assert nest(flat) == nested
+    assert len(flat["sessions"]) == len({row["session_id"]["id"] for row in nested})
+
+
+def test_flat_list_is_filtered_for_students(api_client, attendances):
+    student = attendances[0].student_id
+    api_client.force_authenticate(student)
+
+    flat = api_client.get(URL, {"flat": "1"}).json()
+
+    assert nest(flat) == api_client.get(URL).json()
+    assert [row["student_id"]["id"] for row in flat["results"]] == [student.id]
+
+
+def test_flat_pages(teacher_client, attendances):
+    expected = teacher_client.get(URL).json()
+
+    rows, url = [], f"{URL}?flat=true&page_size=3"
+    while url:
+        page = teacher_client.get(url).json()
+        rows.extend(nest(page))
+        url = page["next"]
+
+    assert rows == expected
@@ -0,0 +1,96 @@
+import pytest
+from django.urls import reverse
+
+from attendance.core.checkin import mint_token
+from attendance.core.geofence import build_geometry, contains, validate_geojson
+from attendance.core.tests.factories import AttendanceFactory, StudentFactory
+
+# Two lecture halls, the first with a courtyard cut out of the middle
+HALL = [[-81.2010, 28.6010], [-81.1990, 28.6010], [-81.1990, 28.6030], [-81.2010, 28.6030], [-81.2010, 28.6010]]
+COURTYARD = [[-81.2003, 28.6017], [-81.1997, 28.6017], [-81.1997, 28.6023], [-81.2003, 28.6023]]
+ANNEX = [[-81.1950, 28.6010], [-81.1940, 28.6010], [-81.1940, 28.6020]]
+GEOFENCE = {"type": "MultiPolygon", "coordinates": [[HALL, COURTYARD], [ANNEX]]}
+
+
+def test_polygon_geofence_contains():
+    geometry = build_geometry(None, None, None, GEOFENCE)
+    assert geometry is not None
+
+    inside = contains(
+        geometry,
+        [28.6012, 28.6020, 28.6040, 28.6012, 28.6019],
+        [-81.2008, -81.2000, -81.2000, -81.1945, -81.1948],
+    )
+
+    # Hall, courtyard, north of the hall, annex, outside the annex triangle
+    assert inside.tolist() == [True, False, False, True, False]
+
+
+def test_circle_geofence_contains():
+    geometry = build_geometry(28.6024, -81.2001, 50, None)
+    assert geometry is not None
+
+    # About 33 m and 67 m north of the center
+    assert contains(geometry, [28.6027, 28.6030], [-81.2001, -81.2001]).tolist() == [True, False]
+
+
+def test_build_geometry_without_location():
+    assert build_geometry(None, None, 100, None) is None
+
+
+@pytest.mark.parametrize(
+    "geofence",
+    [
+        {"type": "Point", "coordinates": [-81.2, 28.6]},
+        {"type": "Polygon", "coordinates": [[[-81.2, 28.6], [-81.1, 28.6]]]},
+        {"type": "Polygon", "coordinates": [[[28.6, -181.2], [28.6, -81.1], [28.7, -81.1]]]},
+    ],
+)
+def test_validate_geojson_rejects(geofence):
+    with pytest.raises(ValueError):
+        validate_geojson(geofence)
+
+
+@pytest.mark.django_db(transaction=True)
+def test_check_in_inside_polygon(api_client, student, session):
+    session.location_enabled = True
+    session.geofence = GEOFENCE
+    session.save()
+    token = mint_token(session)
+    api_client.force_authenticate(student)
+
+    url = reverse("api:attendance-list-create")
+    response = api_client.post(url, {"token": token, "latitude": 28.6020, "longitude": -81.2000}, format="json")
+    assert response.json() == {"errors": ["Location not within range."]}
+
+    response = api_client.post(url, {"token": token, "latitude": 28.6012, "longitude": -81.2008}, format="json")
+    assert response.status_code == 201
+    assert response.json()["id"]
+
+
+@pytest.mark.django_db
+def test_session_rejects_invalid_geofence(api_client, session):
+    api_client.force_authenticate(session.course_id.teacher_id)
+
+    response = api_client.patch(
+        reverse("api:session-detail", args=[session.id]),
+        {"geofence": {"type": "Polygon", "coordinates": [[[-81.2, 28.6]]]}},
+        format="json",
+    )
+
+    assert response.status_code == 400
+    assert response.json() == {"geofence": ["Each polygon ring needs at least 3 points."]}
+
+
+@pytest.mark.django_db
+def test_geofence_check(api_client, session):
+    session.geofence = GEOFENCE
+    session.save()
+    inside = AttendanceFactory(session_id=session, student_id=StudentFactory(), latitude=28.6012, longitude=-81.2008)
+    outside = AttendanceFactory(session_id=session, student_id=StudentFactory(), latitude=28.6020, longitude=-81.2000)
+    unknown = AttendanceFactory(session_id=session, student_id=StudentFactory())
+    api_client.force_authenticate(session.course_id.teacher_id)
+
+    response = api_client.get(reverse("api:session-geofence-check", args=[session.id]))
+
+    assert response.json() == {"inside": [inside.id], "outside": [outside.id], "unknown": [unknown.id]}
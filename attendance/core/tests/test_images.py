@@ -0,0 +1,41 @@
+import io
+
+from PIL import Image
+
+from attendance.core.images import normalize_jpeg
+
+ORIENTATION = 0x0112
+
+
+def jpeg(size: tuple[int, int], mode: str = "RGB", orientation: int = 1, image_format: str = "JPEG") -> bytes:
+    exif = Image.Exif()
+    exif[ORIENTATION] = orientation
+    exif[0x010F] = "Phone"
+    output = io.BytesIO()
+    Image.new(mode, size, "red").save(output, image_format, exif=exif)
+    return output.getvalue()
+
+
+def test_large_images_are_downscaled_and_oriented():
+    original = jpeg((4000, 3000), orientation=6)
+
+    normalized = normalize_jpeg(original, max_size=1280)
+
+    with Image.open(io.BytesIO(normalized)) as image:
+        # Rotated to portrait, then fit in the bounds
+        assert image.size == (960, 1280)
+        assert image.format == "JPEG"
+        assert not image.getexif()
+        assert "icc_profile" not in image.info
+    assert len(normalized) < len(original)
+
+
+def test_small_images_keep_their_size():
+    with Image.open(io.BytesIO(normalize_jpeg(jpeg((640, 480)), max_size=1280))) as image:
+        assert image.size == (640, 480)
+        assert not image.getexif()
+
+
+def test_other_formats_are_reencoded_as_jpeg():
+    with Image.open(io.BytesIO(normalize_jpeg(jpeg((2000, 1000), "RGBA", image_format="PNG"), 500))) as image:
+        assert (image.format, image.mode, image.size) == ("JPEG", "RGB", (500, 250))
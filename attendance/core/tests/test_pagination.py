@@ -0,0 +1,92 @@
+import datetime
+
+import pytest
+from django.urls import reverse
+from django.utils import timezone
+
+from attendance.core.models import Attendance, Session
+from attendance.core.tests.factories import AttendanceFactory, CourseFactory, SessionFactory
+
+URL = reverse("api:attendance-list-create")
+
+
+def walk(client, url: str, key: str = "next") -> list[list[int]]:
+    pages = []
+    while url:
+        response = client.get(url)
+        assert response.status_code == 200
+        pages.append([row["id"] for row in response.data["results"]])
+        url = response.data[key]
+    return pages
+
+
+@pytest.fixture
+def attendances(session) -> list:
+    sessions = [session, SessionFactory(course_id=session.course_id)]
+    attendances = [AttendanceFactory(session_id=sessions[i % 2]) for i in range(7)]
+    # Ties on created_at are broken by id
+    now = timezone.now()
+    for i, attendance in enumerate(attendances):
+        attendance.created_at = now - datetime.timedelta(minutes=i // 3)
+    Attendance.objects.bulk_update(attendances, ["created_at"])
+    return attendances
+
+
+def test_lists_are_not_paginated_without_opting_in(teacher_client, attendances):
+    response = teacher_client.get(URL)
+
+    assert [row["id"] for row in response.data] == [a.id for a in sorted(attendances, key=newest_first)]
+
+
+def newest_first(attendance: Attendance):
+    return (-attendance.created_at.timestamp(), -attendance.id)
+
+
+def test_pages_walk_forward_and_back(teacher_client, attendances):
+    expected = [a.id for a in sorted(attendances, key=newest_first)]
+
+    pages = walk(teacher_client, f"{URL}?page_size=3")
+
+    assert pages == [expected[:3], expected[3:6], expected[6:]]
+    last = teacher_client.get(f"{URL}?page_size=3").data["next"]
+    last = teacher_client.get(last).data["next"]
+    assert walk(teacher_client, last, key="previous") == [expected[6:], expected[3:6], expected[:3]]
+
+
+def test_pages_are_stable_across_inserts(teacher_client, session, attendances):
+    expected = [a.id for a in sorted(attendances, key=newest_first)]
+    first = teacher_client.get(f"{URL}?page_size=3").data
+
+    AttendanceFactory(session_id=session)
+
+    # A new check-in lands before the first page instead of pushing rows onto the next one
+    assert walk(teacher_client, first["next"]) == [expected[3:6], expected[6:]]
+
+
+def test_ordering_and_filters_apply_to_pages(teacher_client, session, attendances):
+    expected = [a.id for a in sorted(attendances, key=newest_first) if a.session_id == session][::-1]
+
+    pages = walk(teacher_client, f"{URL}?page_size=2&ordering=created_at&session_id={session.id}")
+
+    assert sum(pages, []) == expected
+    assert [len(page) for page in pages] == [2, 2]
+
+
+def test_sessions_are_paginated_on_start_time(teacher_client, session):
+    course = session.course_id
+    sessions = [session, *(SessionFactory(course_id=course) for _ in range(4))]
+    Session.objects.filter(id__in=[s.id for s in sessions[:2]]).update(start_time=timezone.now())
+    SessionFactory(course_id=CourseFactory())
+    expected = list(
+        Session.objects.filter(course_id=course).order_by("-start_time", "-id").values_list("id", flat=True)
+    )
+
+    pages = walk(teacher_client, f"{reverse('api:session-list')}?page_size=2")
+
+    assert pages == [expected[:2], expected[2:4], expected[4:]]
+
+
+def test_invalid_cursor(teacher_client):
+    response = teacher_client.get(f"{URL}?cursor=garbage")
+
+    assert response.status_code == 404
@@ -0,0 +1,427 @@
+import datetime
+import hashlib
+import json
+import threading
+import urllib.request
+
+import pytest
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from attendance.core import metrics
+from attendance.core.faces import COLLECTION, COMPARE
+from attendance.core.management.commands import process_sqs_msg
+from attendance.core.management.commands.process_sqs_msg import (
+    FaceRecognitionProcessor,
+    FaceRecognitionResults,
+    ReceiveBatch,
+    event_key,
+)
+from attendance.core.models import Attendance
+from attendance.core.tests.factories import PendingAttendanceFactory, StudentFactory
+from attendance.core.tests.fake_aws import FakeRekognition, FakeS3, FakeSQS, s3_event
+from attendance.core.tests.test_images import jpeg
+from attendance.users.models import User
+
+# Workers use their own database connections, so the rows have to be committed
+pytestmark = pytest.mark.django_db(transaction=True)
+
+
+def received(sqs: FakeSQS, processor: FaceRecognitionProcessor, count: int) -> list[dict]:
+    messages = sqs.receive_message(QueueUrl=None, MaxNumberOfMessages=count)["Messages"]
+    processor.in_flight.track(messages)
+    return messages
+
+
+def test_messages_are_processed_concurrently(session, processor_for):
+    attendances = PendingAttendanceFactory.create_batch(20, session_id=session)
+    sqs = FakeSQS(s3_event(f"{a.student_id.id}/{a.id}.jpeg") for a in attendances)
+    processor, session_factory = processor_for(sqs, concurrency=4, rekognition=FakeRekognition(delay=0.01))
+    sqs.on_drained = processor.stop
+
+    processor.run()
+
+    assert len(sqs.deleted) == 20
+    assert processor.processed == 20
+    assert set(
+        Attendance.objects.filter(session_id=session).values_list("face_recognition_status", flat=True)
+    ) == {Attendance.FaceRecognitionStatus.SUCCESS}
+    # The receiving thread and every worker that picked up a message built their own session
+    assert len(session_factory.created) == len(set(session_factory.created))
+    assert len(session_factory.created) > 2
+
+
+def test_failed_messages_stay_on_the_queue(session, processor_for):
+    sqs = FakeSQS([s3_event("1/999999.jpeg"), "not json"])
+    processor, _ = processor_for(sqs, concurrency=2)
+    done = threading.Timer(0.5, processor.stop)
+    done.start()
+
+    processor.run()
+
+    assert sqs.deleted == ["1"]
+    assert processor.failed >= 1
+    assert len(sqs.messages) == 1
+
+
+def test_stop_releases_messages_that_were_not_started(session, processor_for):
+    attendances = PendingAttendanceFactory.create_batch(5, session_id=session)
+    sqs = FakeSQS(s3_event(f"{a.student_id.id}/{a.id}.jpeg") for a in attendances)
+    rekognition = FakeRekognition(delay=0.1)
+    processor, _ = processor_for(sqs, concurrency=1, rekognition=rekognition)
+    threading.Timer(0.1, processor.stop).start()
+
+    processor.run()
+
+    # The message in flight when the task was stopped finished, nothing else was started
+    assert rekognition.calls["compare_faces"] == 1
+    assert len(sqs.deleted) == 1
+    assert len(sqs.messages) == 4
+
+
+def test_acknowledgements_are_batched(session, processor_for):
+    sqs = FakeSQS(s3_event("1/1.jpeg") for _ in range(12))
+    processor, _ = processor_for(sqs, concurrency=1)
+    messages = received(sqs, processor, 10) + received(sqs, processor, 2)
+
+    for message in messages:
+        processor.in_flight.ack(message)
+
+    # The tenth acknowledgement sent a full batch, the rest waits for the next flush
+    assert sqs.calls["delete_message_batch"] == 1
+    assert len(sqs.deleted) == 10
+    processor.in_flight.flush()
+    assert sqs.calls["delete_message_batch"] == 2
+    assert not sqs.messages
+    assert sqs.calls["delete_message"] == 0
+
+
+def test_failed_acknowledgements(session, processor_for):
+    sqs = FakeSQS(s3_event("1/1.jpeg") for _ in range(3))
+    processor, _ = processor_for(sqs, concurrency=1)
+    messages = received(sqs, processor, 3)
+    sqs.failures = ["InternalError", "ReceiptHandleIsInvalid!"]
+
+    for message in messages:
+        processor.in_flight.ack(message)
+    processor.in_flight.flush()
+
+    # The first entry failed on SQS' side and is retried, the second can never succeed and is dropped
+    assert sqs.deleted == ["3"]
+    assert processor.in_flight.acks == [(messages[0]["ReceiptHandle"], 2)]
+    processor.in_flight.flush()
+    assert sqs.deleted == ["3", "1"]
+    assert set(sqs.messages) == {"2"}
+    assert not processor.in_flight.acks
+
+
+def test_visibility_is_extended_while_processing(session, processor_for):
+    attendances = PendingAttendanceFactory.create_batch(2, session_id=session)
+    sqs = FakeSQS(s3_event(f"{a.student_id.id}/{a.id}.jpeg") for a in attendances)
+    # Comparing a face takes longer than the visibility timeout
+    rekognition = FakeRekognition(delay=0.75)
+    processor, _ = processor_for(sqs, concurrency=2, visibility_timeout=1, rekognition=rekognition)
+    sqs.on_drained = processor.stop
+
+    processor.run()
+
+    assert sqs.calls["change_message_visibility_batch"] >= 1
+    # Neither message became visible again, so no other worker compared it a second time
+    assert rekognition.calls["compare_faces"] == 2
+    assert sorted(sqs.deleted) == ["1", "2"]
+    assert not processor.in_flight.visible_until
+
+
+def test_results_are_written_with_one_update_per_table(session, processor_for):
+    attendances = PendingAttendanceFactory.create_batch(4, session_id=session)
+    students = StudentFactory.create_batch(2)
+    processor, _ = processor_for(FakeSQS(), concurrency=1)
+    results = FaceRecognitionResults()
+    results.init_images = {student.id: "" for student in students}
+    statuses = [Attendance.FaceRecognitionStatus.SUCCESS, Attendance.FaceRecognitionStatus.FAILED] * 2
+    for attendance, status in zip(attendances, statuses):
+        results.attendances[attendance.id] = (status, f"{attendance.student_id.id}/{attendance.id}.jpeg")
+
+    with CaptureQueriesContext(connection) as queries:
+        processor.write_results(results)
+
+    assert len([query for query in queries if query["sql"].startswith("UPDATE")]) == 2
+    assert [
+        (a.face_recognition_status, a.is_present, a.face_image) for a in Attendance.objects.order_by("id")
+    ] == [
+        (status, status == Attendance.FaceRecognitionStatus.SUCCESS, f"{a.student_id.id}/{a.id}.jpeg")
+        for a, status in zip(attendances, statuses)
+    ]
+    assert User.objects.filter(init_image=True).count() == 6
+
+
+def test_messages_are_not_acknowledged_when_the_write_fails(session, monkeypatch, processor_for):
+    attendances = PendingAttendanceFactory.create_batch(2, session_id=session)
+    student = StudentFactory()
+    sqs = FakeSQS(
+        [s3_event(f"{a.student_id.id}/{a.id}.jpeg") for a in attendances]
+        + [s3_event(f"{student.id}/{attendances[0].id}_init.jpeg")]
+    )
+    processor, _ = processor_for(sqs, concurrency=3)
+
+    def fail(*args, **kwargs):
+        raise RuntimeError("connection lost")
+
+    monkeypatch.setattr(Attendance.objects, "bulk_update", fail)
+    threading.Timer(0.5, processor.stop).start()
+
+    processor.run()
+
+    assert not sqs.deleted
+    assert processor.processed == 0
+    assert processor.failed == 3
+    # The users update ran in the same transaction and was rolled back with it
+    assert not User.objects.get(id=student.id).init_image
+    # The events weren't handled, their redeliveries are processed again
+    records = [record for message in sqs.messages.values() for record in json.loads(message["Body"])["Records"]]
+    assert not cache.get_many([event_key("media", record["s3"]["object"]) for record in records])
+    assert set(Attendance.objects.values_list("face_recognition_status", flat=True)) == {
+        Attendance.FaceRecognitionStatus.PENDING
+    }
+
+
+def test_collection_mode(session, processor_for):
+    student, enrolled_before = StudentFactory(), StudentFactory(init_image=True)
+    enrollment, attendance, reenrollment, other = PendingAttendanceFactory.create_batch(4, session_id=session)
+    sqs = FakeSQS(
+        [
+            s3_event(f"{student.id}/{enrollment.id}_init.jpeg"),
+            s3_event(f"{student.id}/{attendance.id}.jpeg"),
+            s3_event(f"{student.id}/{reenrollment.id}_init.jpeg"),
+            s3_event(f"{enrolled_before.id}/{other.id}.jpeg"),
+        ]
+    )
+    rekognition = FakeRekognition()
+    # One message at a time, so each enrollment is committed before the next image
+    processor, _ = processor_for(sqs, concurrency=1, mode=COLLECTION, rekognition=rekognition)
+    sqs.on_drained = processor.stop
+
+    processor.run()
+
+    student.refresh_from_db()
+    assert student.init_image
+    # Re-enrolling replaced the first face in the collection
+    assert list(rekognition.collections[processor.comparator.collection_id]) == [student.face_id]
+    assert rekognition.calls == {
+        "create_collection": 1,
+        "index_faces": 2,
+        "search_faces_by_image": 1,
+        "delete_faces": 1,
+        # A student enrolled before the switch has no FaceId and is compared pairwise
+        "compare_faces": 1,
+    }
+    assert set(Attendance.objects.values_list("face_recognition_status", flat=True)) == {
+        Attendance.FaceRecognitionStatus.SUCCESS
+    }
+
+
+@pytest.mark.parametrize("mode,images", [(COMPARE, 2), (COLLECTION, 1)])
+def test_images_analysed_per_attendance(session, mode, images, processor_for):
+    attendances = PendingAttendanceFactory.create_batch(5, session_id=session)
+    for attendance in attendances:
+        User.objects.filter(id=attendance.student_id.id).update(face_id=f"face-{attendance.student_id.id}")
+    rekognition = FakeRekognition()
+    sqs = FakeSQS(s3_event(f"{a.student_id.id}/{a.id}.jpeg") for a in attendances)
+    processor, _ = processor_for(sqs, concurrency=2, mode=mode, rekognition=rekognition)
+    rekognition.collections[processor.comparator.collection_id] = {
+        f"face-{attendance.student_id.id}": str(attendance.student_id.id) for attendance in attendances
+    }
+    sqs.on_drained = processor.stop
+
+    processor.run()
+
+    assert processor.processed == 5
+    assert rekognition.images == 5 * images
+
+
+def test_duplicate_events_are_skipped(session, processor_for):
+    attendance, other = PendingAttendanceFactory.create_batch(2, session_id=session)
+    event = s3_event(f"{attendance.student_id.id}/{attendance.id}.jpeg")
+    # Redelivered, and an event without a version or ETag that can't be told apart from a new upload
+    unversioned = s3_event(f"{other.student_id.id}/{other.id}.jpeg", etag=False)
+    sqs = FakeSQS([event, unversioned, event, unversioned])
+    rekognition = FakeRekognition()
+    # One message at a time, so each is committed before its duplicate arrives
+    processor, _ = processor_for(sqs, concurrency=1, rekognition=rekognition)
+    sqs.on_drained = processor.stop
+
+    processor.run()
+
+    assert rekognition.calls["compare_faces"] == 3
+    assert len(sqs.deleted) == 4
+    assert metrics.get_counters([metrics.S3_EVENTS_DUPLICATE_SKIPPED, metrics.FACE_COMPARISONS_SKIPPED]) == {
+        metrics.S3_EVENTS_DUPLICATE_SKIPPED: 1,
+        metrics.FACE_COMPARISONS_SKIPPED: 1,
+    }
+
+
+def test_images_are_normalized_next_to_the_originals(session, settings, processor_for):
+    settings.FACE_IMAGE_NORMALIZE = True
+    (attendance,) = PendingAttendanceFactory.create_batch(1, session_id=session)
+    key = f"{attendance.student_id.id}/{attendance.id}.jpeg"
+    original = jpeg((4000, 3000))
+    s3, rekognition = FakeS3({f"media/{key}": original}), FakeRekognition()
+    sqs = FakeSQS([s3_event(key)])
+    processor, _ = processor_for(sqs, concurrency=1, s3=s3, rekognition=rekognition)
+    sqs.on_drained = processor.stop
+
+    processor.run()
+
+    normalized = f"normalized/{attendance.student_id.id}/{attendance.id}.jpg"
+    assert s3.objects[f"media/{key}"] == original
+    assert len(s3.objects[f"media/{normalized}"]) < len(original)
+    assert rekognition.targets == [normalized]
+    # The record still points at the upload
+    assert Attendance.objects.get(id=attendance.id).face_image.name == key
+
+
+def test_normalized_images_replace_the_originals(session, settings, processor_for):
+    settings.FACE_IMAGE_NORMALIZE = True
+    settings.FACE_IMAGE_ORIGINALS = "replace"
+    (attendance,) = PendingAttendanceFactory.create_batch(1, session_id=session)
+    key = f"{attendance.student_id.id}/{attendance.id}.jpeg"
+    original = jpeg((4000, 3000))
+    s3, rekognition = FakeS3({f"media/{key}": original}), FakeRekognition()
+    sqs = FakeSQS([s3_event(key)])
+    processor, _ = processor_for(sqs, concurrency=1, s3=s3, rekognition=rekognition)
+
+    def drained():
+        if len(sqs.deleted) == 2:
+            return processor.stop()
+        if len(sqs.deleted) == 1:
+            # S3 notifies about the replacement too
+            etag = hashlib.md5(s3.objects[f"media/{key}"]).hexdigest()
+            record = {"s3": {"bucket": {"name": "media"}, "object": {"key": key, "eTag": etag}}}
+            sqs.send_message(json.dumps({"Records": [record]}))
+
+    sqs.on_drained = drained
+
+    processor.run()
+
+    assert s3.puts == [f"media/{key}"]
+    assert len(s3.objects[f"media/{key}"]) < len(original)
+    assert rekognition.targets == [key]
+    assert metrics.get_counters([metrics.S3_EVENTS_DUPLICATE_SKIPPED]) == {metrics.S3_EVENTS_DUPLICATE_SKIPPED: 1}
+
+
+def test_stage_timings_and_latency(session, processor_for):
+    attendances = PendingAttendanceFactory.create_batch(3, session_id=session)
+    uploaded = timezone.now() - datetime.timedelta(seconds=90)
+    sqs = FakeSQS(
+        [s3_event(f"{a.student_id.id}/{a.id}.jpeg", event_time=uploaded) for a in attendances]
+        + [s3_event("not/a/face.png")]
+        # Written by the processor itself
+        + [s3_event("normalized/1/2.jpg", "1/face.npy")]
+    )
+    processor, _ = processor_for(sqs, concurrency=2, rekognition=FakeRekognition())
+    sqs.on_drained = processor.stop
+    server = processor.serve_metrics(0)
+
+    try:
+        processor.run()
+        with urllib.request.urlopen(f"http://127.0.0.1:{server.server_address[1]}/metrics") as response:
+            exposition = response.read().decode()
+    finally:
+        server.shutdown()
+
+    assert processor.messages_received.get() == 5
+    assert processor.invalid_keys.get() == 1
+    assert processor.messages_failed.get() == 0
+    for stage, count in {"parse": 5, "dedup": 5, "compare": 3}.items():
+        assert processor.stage_seconds.count(stage) == count
+    # However the messages were split into receive batches and acknowledgement batches
+    assert processor.stage_seconds.count("db_update") >= 1
+    assert processor.stage_seconds.count("ack") >= 1
+    assert processor.event_latency.count() == 3
+    assert 'face_recognition_stage_seconds_count{stage="compare"} 3' in exposition
+    assert 'face_recognition_event_latency_seconds_bucket{le="60"} 0' in exposition
+    assert 'face_recognition_event_latency_seconds_bucket{le="120"} 3' in exposition
+    assert "face_recognition_invalid_keys_total 1" in exposition
+
+
+def test_receives_back_off(session, monkeypatch, processor_for):
+    (attendance,) = PendingAttendanceFactory.create_batch(1, session_id=session)
+    sqs = FakeSQS([s3_event(f"{attendance.student_id.id}/{attendance.id}.jpeg")])
+    sqs.receive_failures = ["ServiceUnavailable"] * 3
+    processor, _ = processor_for(sqs, concurrency=1)
+    # The longest delay the jitter allows
+    monkeypatch.setattr("random.uniform", lambda low, high: high)
+    pauses: list[float] = []
+    monkeypatch.setattr(processor, "pause", pauses.append)
+
+    def drained():
+        if sqs.calls["receive_message"] >= 8:
+            processor.stop()
+
+    sqs.on_drained = drained
+
+    processor.run(backlog_interval=0)
+
+    assert processor.processed == 1
+    # Doubling after errors, then once messages came through, doubling again while the queue is empty
+    assert pauses[:6] == [1, 2, 4, 0.1, 0.2, 0.4]
+
+
+def test_backlog_is_published(session, processor_for):
+    attendances = PendingAttendanceFactory.create_batch(3, session_id=session)
+    sqs = FakeSQS([s3_event(f"{a.student_id.id}/{a.id}.jpeg") for a in attendances])
+    processor, session_factory = processor_for(sqs, concurrency=2)
+    sqs.on_drained = processor.stop
+
+    processor.run()
+
+    assert processor.processed == 3
+    assert processor.queue_backlog.value == 3
+    metric_data = session_factory.clients["cloudwatch"].metric_data
+    assert [(datum["MetricName"], datum["Value"]) for _, datum in metric_data] == [("QueueBacklog", 3), ("Workers", 2)]
+    assert session_factory.configs["rekognition"].retries["mode"] == "adaptive"
+
+
+@pytest.mark.parametrize("concurrency,one_message", [(1, False), (2, False), (1, True)])
+def test_attendance_images_wait_for_the_init_image(session, monkeypatch, concurrency, one_message, processor_for):
+    monkeypatch.setattr(process_sqs_msg, "INIT_IMAGE_RETRY_DELAY", 1)
+    student = StudentFactory()
+    enrollment, attendance = PendingAttendanceFactory.create_batch(2, session_id=session)
+    # Delivered out of order
+    keys = [f"{student.id}/{attendance.id}.jpeg", f"{student.id}/{enrollment.id}_init.jpeg"]
+    sqs = FakeSQS([s3_event(*keys)] if one_message else [s3_event(key) for key in keys])
+    rekognition = FakeRekognition()
+    processor, _ = processor_for(sqs, concurrency=concurrency, mode=COLLECTION, rekognition=rekognition)
+    sqs.on_drained = processor.stop
+
+    processor.run()
+
+    assert processor.failed == 0
+    # Put back until the init image was committed, unless it came in the same message or receive batch
+    assert processor.messages_deferred.get() == (0 if one_message or concurrency > 1 else 1)
+    assert rekognition.calls["search_faces_by_image"] == 1
+    assert rekognition.calls["compare_faces"] == 0
+    assert Attendance.objects.get(id=attendance.id).face_recognition_status == Attendance.FaceRecognitionStatus.SUCCESS
+
+
+def test_receive_batch_shares_its_init_images():
+    messages = [
+        {"MessageId": "1", "Body": s3_event("7/1_init.jpeg", "8/2.jpeg")},
+        {"MessageId": "2", "Body": s3_event("9/3_init.jpeg")},
+        {"MessageId": "3", "Body": json.dumps({"Event": "s3:TestEvent"})},
+    ]
+    batch = ReceiveBatch(messages)
+    assert [batch.carries_init_images(message) for message in messages] == [True, True, False]
+
+    results = FaceRecognitionResults()
+    results.init_images[7] = "face-7"
+    batch.done(messages[0], results)
+    # The second message failed, its student's init image stays unknown
+    batch.done(messages[1], None)
+
+    assert batch.init_image(7, timeout=0) == "face-7"
+    assert batch.init_image(9, timeout=0) is None
+    # Not in the batch, nothing to wait for
+    assert batch.init_image(8, timeout=60) is None
@@ -0,0 +1,129 @@
+import json
+import uuid
+
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from attendance.core.models import Attendance, Course, Session
+from attendance.users.models import User
+
+COURSES = 100
+SESSIONS_PER_COURSE = 50
+STUDENTS = 2000
+# Each session gets about 1 in ATTENDANCE_RATIO students, ~100k rows
+ATTENDANCE_RATIO = 100
+TABLES = {Attendance._meta.db_table, Session._meta.db_table}
+
+
+@pytest.fixture
+def dataset(db, settings) -> tuple[User, User, Session]:
+    """Enough rows that a sequential scan of the big tables costs more than an index would."""
+    domain = settings.WHITELISTED_EMAIL_DOMAINS[0]
+    teachers = User.objects.bulk_create(
+        User(email=f"teacher-{i}@{domain}", password="!", role=User.UserRoleChoices.TEACHER) for i in range(COURSES)
+    )
+    User.objects.bulk_create(
+        User(email=f"student-{i}@{domain}", password="!", role=User.UserRoleChoices.STUDENT) for i in range(STUDENTS)
+    )
+    courses = Course.objects.bulk_create(Course(name=f"COP{3000 + i}", teacher_id=t) for i, t in enumerate(teachers))
+    Session.objects.bulk_create(
+        Session(course_id=course, salt=uuid.uuid4().hex) for course in courses for _ in range(SESSIONS_PER_COURSE)
+    )
+
+    fields = {field.name: field.column for field in Attendance._meta.fields}
+    with connection.cursor() as cursor:
+        # Sessions a day apart, their check-ins a second apart and a few percent failing face recognition
+        cursor.execute(
+            f"""
+            UPDATE {Session._meta.db_table} SET start_time = now() - (id * interval '1 day')
+            """
+        )
+        cursor.execute(
+            f"""
+            INSERT INTO {Attendance._meta.db_table}
+                ({fields["session_id"]}, {fields["student_id"]}, {fields["created_at"]},
+                 {fields["is_present"]}, {fields["face_recognition_status"]})
+            SELECT s.id, u.id, s.start_time + (u.id * interval '1 second'), true,
+                   CASE WHEN (s.id * u.id) %% 37 = 0 THEN %s ELSE %s END
+            FROM {Session._meta.db_table} s JOIN {User._meta.db_table} u ON u.id %% %s = s.id %% %s
+            WHERE u.role = %s
+            """,
+            [
+                Attendance.FaceRecognitionStatus.FAILED,
+                Attendance.FaceRecognitionStatus.SUCCESS,
+                ATTENDANCE_RATIO,
+                ATTENDANCE_RATIO,
+                User.UserRoleChoices.STUDENT,
+            ],
+        )
+        for model in (User, Course, Session, Attendance):
+            cursor.execute(f"ANALYZE {model._meta.db_table}")
+
+    session = Session.objects.filter(course_id=courses[0].id).order_by("start_time").last()
+    assert session is not None
+    attendance = Attendance.objects.filter(session_id=session.id).first()
+    assert attendance is not None
+    return teachers[0], attendance.student_id, session
+
+
+def seq_scans(plan: dict) -> list[str]:
+    scans = []
+    if plan["Node Type"] == "Seq Scan" and plan["Relation Name"] in TABLES:
+        scans.append(plan["Relation Name"])
+    for child in plan.get("Plans", ()):
+        scans.extend(seq_scans(child))
+    return scans
+
+
+def explain(sql: str, params) -> dict:
+    with connection.cursor() as cursor:
+        cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+        plan = cursor.fetchone()[0]
+    return (json.loads(plan) if isinstance(plan, str) else plan)[0]["Plan"]
+
+
+def assert_no_seq_scans(api_client, user: User, url: str, params: dict):
+    api_client.force_authenticate(user)
+    with CaptureQueriesContext(connection) as context:
+        response = api_client.get(url, params)
+    assert response.status_code == 200
+
+    # The captured SQL has its parameters interpolated, re-run it through the cursor to EXPLAIN it
+    selects = [
+        query["sql"]
+        for query in context.captured_queries
+        if query["sql"].startswith("SELECT") and any(f'"{table}"' in query["sql"] for table in TABLES)
+    ]
+    assert selects
+    for sql in selects:
+        plan = explain(sql, None)
+        assert not seq_scans(plan), f"Sequential scan in the plan of {sql}:\n{json.dumps(plan, indent=2)}"
+
+
+@pytest.mark.parametrize(
+    "role,url,params",
+    [
+        ("teacher", "api:attendance-list-create", {}),
+        ("teacher", "api:attendance-list-create", {"session_id": None}),
+        ("teacher", "api:attendance-list-create", {"page_size": 100}),
+        ("teacher", "api:attendance-report-list", {}),
+        ("teacher", "api:attendance-report-list", {"page_size": 100}),
+        ("teacher", "api:session-list", {}),
+        ("teacher", "api:session-list", {"course_id": None}),
+        ("teacher", "api:session-list", {"page_size": 10}),
+        ("teacher", "api:session-list", {"page_size": 10, "summary": "true"}),
+        ("teacher", "api:course-list", {"summary": "true"}),
+        ("student", "api:attendance-list-create", {}),
+        ("student", "api:attendance-list-create", {"session_id": None}),
+        ("student", "api:attendance-list-create", {"page_size": 10}),
+    ],
+)
+def test_lists_use_indexes(api_client, dataset, role, url, params):
+    teacher, student, session = dataset
+    # Filter on the dataset's ids
+    values = {"session_id": session.id, "course_id": session.course_id.id}
+    params = {key: values.get(key) if value is None else value for key, value in params.items()}
+
+    assert_no_seq_scans(api_client, teacher if role == "teacher" else student, reverse(url), params)
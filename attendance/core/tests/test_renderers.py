@@ -0,0 +1,181 @@
+import datetime
+import io
+import uuid
+from decimal import Decimal
+from zoneinfo import ZoneInfo
+
+import pytest
+from django.urls import reverse
+from django.utils.translation import gettext_lazy
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.serializer_helpers import ReturnDict, ReturnList
+
+from attendance.core import serializers
+from attendance.core.checkin import mint_token
+from attendance.core.models import Attendance
+from attendance.core.parsers import ORJSONParser
+from attendance.core.renderers import ORJSONRenderer
+
+NOW = datetime.datetime(2024, 9, 3, 14, 5, 7, 123456, tzinfo=datetime.UTC)
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        None,
+        {"id": 1, "name": "COP3502", "ok": True, "missing": None, "ids": [1, 2, 3], "pair": (1, 2)},
+        ReturnDict(
+            {"results": ReturnList([{"id": 1}], serializer=serializers.AttendanceSerializer())},
+            serializer=serializers.AttendanceSerializer(),
+        ),
+        NOW,
+        NOW.replace(microsecond=0),
+        NOW.astimezone(ZoneInfo("America/New_York")),
+        NOW.replace(tzinfo=None),
+        NOW.date(),
+        NOW.time(),
+        datetime.timedelta(minutes=5),
+        {"radius": Decimal("1.5"), "tiny": Decimal("0.00001"), "huge": Decimal("1E+20"), "zero": Decimal("0")},
+        gettext_lazy("Course does not belong to you."),
+        {"errors": [gettext_lazy("You have already checked in.")]},
+        [-81.2003, 28.6024, 0.1, 1 / 3, 1e-05, 1.5e16, 1e22, 5e-324, 2.0**53, -0.0, 100.0],
+        [sign * digits * 10.0**power for sign in (1, -1) for digits in (1, 1.5, 123.456) for power in range(-30, 30)],
+        [0, -1, 2**63 - 1, -(2**63), 2**64, 10**30],
+        "".join(chr(i) for i in range(0x80)) + "é漢字😀  ",
+        {1: "one"},
+        {None: "none"},
+        {True: "true"},
+        {"email": "ab123456@ucf.edu", "etag": "5e3b6c1e2d", "id": "12345678-1234-5678-1234-5678e1234567"},
+        {"tiny": [1e-05, 0.0001, 9.99e-05], "huge": [1e16, 9.999999999999998e15], "precise": [0.1 + 0.2]},
+        {"queryset": Attendance.objects.none()},
+        uuid.UUID("12345678-1234-5678-1234-567812345678"),
+        b"bytes",
+        {"nested": [{"deeper": [{"deepest": NOW}]}]},
+    ],
+)
+def test_renderer_matches_json_renderer(data):
+    assert ORJSONRenderer().render(data) == JSONRenderer().render(data)
+
+
+@pytest.mark.parametrize("accepted_media_type", ["application/json; indent=2", "application/json; indent=4"])
+def test_renderer_indents_like_json_renderer(accepted_media_type):
+    data = {"id": 1, "sessions": [{"start_time": NOW}]}
+
+    assert ORJSONRenderer().render(data, accepted_media_type) == JSONRenderer().render(data, accepted_media_type)
+
+
+@pytest.mark.parametrize(
+    "data,error",
+    [
+        ({"object": object()}, TypeError),
+        ({"nan": float("nan")}, ValueError),
+        ([1.0, [float("inf")]], ValueError),
+        (-float("inf"), ValueError),
+    ],
+)
+def test_renderer_raises_like_json_renderer(data, error):
+    with pytest.raises(error):
+        JSONRenderer().render(data)
+    with pytest.raises(error):
+        ORJSONRenderer().render(data)
+
+
+def test_renderer_uses_orjson_unless_a_float_differs(monkeypatch):
+    data = {"email": "ab123456@ucf.edu", "etag": "d41d8cd98f00b204e9800998ecf8427e", "longitude": -81.2003}
+    monkeypatch.setattr(JSONRenderer, "render", lambda *args: pytest.fail("Rendered by JSONRenderer"))
+    ORJSONRenderer().render(data)
+
+    for value in (1e-05, 1e16, Decimal("0.00001")):
+        with pytest.raises(pytest.fail.Exception):
+            ORJSONRenderer().render({**data, "value": value})
+
+
+@pytest.mark.parametrize(
+    "body",
+    [
+        b'{"token": "abc", "longitude": -81.2003, "latitude": 28.6024}',
+        b'[1, 2.5, -0, 1e-05, 1E400, true, false, null, "\\u00e9\\ud83d\\ude00"]',
+        b'{"big": 123456789012345678901234567890, "small": -9223372036854775808}',
+        b'"\\ud800"',
+        '{"name": "é漢字"}'.encode(),
+        b'{"a": 1, "a": 2}',
+    ],
+)
+def test_parser_matches_json_parser(body):
+    assert ORJSONParser().parse(io.BytesIO(body)) == JSONParser().parse(io.BytesIO(body))
+
+
+@pytest.mark.parametrize("body", [b"", b"{", b'{"a": NaN}', b"[Infinity]", b"\xef\xbb\xbf{}", b'{"a": "\xff"}'])
+def test_parser_rejects_like_json_parser(body):
+    with pytest.raises(ParseError):
+        JSONParser().parse(io.BytesIO(body))
+    with pytest.raises(ParseError):
+        ORJSONParser().parse(io.BytesIO(body))
+
+
+@pytest.fixture
+def course(session):
+    course = session.course_id
+    course.name = "Análisis I"
+    course.save()
+    return course
+
+
+def teacher_requests(course, session, attendance):
+    return [
+        ("get", reverse("api:course-list"), None),
+        ("get", reverse("api:course-detail", args=[course.id]), None),
+        ("post", reverse("api:course-list"), {"name": "COT3100"}),
+        ("get", reverse("api:session-list"), None),
+        ("get", reverse("api:session-list"), {"page_size": 1}),
+        ("get", reverse("api:session-detail", args=[session.id]), None),
+        ("post", reverse("api:session-list"), {"course_id": course.id, "location_enabled": True}),
+        ("post", reverse("api:session-list"), {"course_id": course.id}),
+        ("get", reverse("api:attendance-list-create"), None),
+        ("get", reverse("api:attendance-list-create"), {"session_id": session.id, "page_size": 2}),
+        ("get", reverse("api:attendance-list-create"), {"flat": "true"}),
+        ("get", reverse("api:attendance-report-list"), None),
+        ("get", reverse("api:attendance-report-list"), {"cursor": "garbage"}),
+        ("get", reverse("api:attendance-report-detail", args=[attendance.id]), None),
+        ("get", reverse("api:attendance-face-status", args=[attendance.id]), None),
+        ("post", reverse("api:attendance-override", args=[attendance.id]), None),
+        ("get", reverse("user_detail"), None),
+    ]
+
+
+def student_requests(course, session, attendance):
+    return [
+        ("get", reverse("api:attendance-list-create"), None),
+        ("get", reverse("api:attendance-list-create"), {"flat": "1", "page_size": 1}),
+        ("post", reverse("api:attendance-list-create"), {"token": mint_token(session)}),
+        ("post", reverse("api:attendance-list-create"), {"token": mint_token(session)}),
+        ("post", reverse("api:attendance-list-create"), {"token": "garbage"}),
+        ("get", reverse("api:attendance-face-status", args=[attendance.id]), None),
+        ("get", reverse("api:attendance-face-status", args=[0]), None),
+        ("get", reverse("api:course-list"), None),
+        ("get", reverse("user_detail"), None),
+    ]
+
+
+# Check-in opts out of ATOMIC_REQUESTS, so a rejected duplicate would break the test transaction
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.parametrize("role", ["teacher", "student"])
+def test_endpoints_render_like_json_renderer(api_client, monkeypatch, course, session, attendances, role):
+    monkeypatch.setattr(serializers, "generate_presigned_url", lambda method, key, expires: f"https://s3/{key}?X=1")
+    attendance = attendances[0]
+    if role == "teacher":
+        api_client.force_authenticate(course.teacher_id)
+        requests = teacher_requests(course, session, attendance)
+    else:
+        api_client.force_authenticate(attendance.student_id)
+        requests = student_requests(course, session, attendance)
+
+    for method, url, data in requests:
+        if method == "get":
+            response = api_client.get(url, data)
+        else:
+            response = api_client.post(url, data, format="json")
+
+        assert response.content == JSONRenderer().render(response.data), (method, url, data)
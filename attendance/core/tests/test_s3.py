@@ -0,0 +1,78 @@
+import itertools
+
+import pytest
+
+from attendance.core import metrics, s3
+from attendance.core.metrics import get_counters
+
+
+class StubS3Client:
+    def __init__(self):
+        self.signed = itertools.count(1)
+        self.calls = []
+
+    def generate_presigned_url(self, ClientMethod, Params, ExpiresIn):
+        self.calls.append((ClientMethod, Params, ExpiresIn))
+        return f"https://{Params['Bucket']}.s3.amazonaws.com/{Params['Key']}?signature={next(self.signed)}"
+
+
+@pytest.fixture
+def s3_client(monkeypatch, settings):
+    settings.MEDIA_BUCKET_NAME = "media"
+    client = StubS3Client()
+    monkeypatch.setattr(s3, "s3_client", client, raising=False)
+    s3.presigned_urls.clear()
+    yield client
+    s3.presigned_urls.clear()
+
+
+def test_presigned_url_is_reused(s3_client):
+    first = s3.generate_presigned_url("get_object", "1/init.jpeg", 900)
+
+    assert s3.generate_presigned_url("get_object", "1/init.jpeg", 900) == first
+    assert len(s3_client.calls) == 1
+    assert s3.presigned_urls.stats() == {"hits": 1, "misses": 1, "size": 1}
+
+
+def test_presigned_url_cache_key(s3_client):
+    s3.generate_presigned_url("get_object", "1/2.jpeg", 900)
+    s3.generate_presigned_url("get_object", "1/3.jpeg", 900)
+    s3.generate_presigned_url("put_object", "1/2.jpeg", 300, ContentType="image/jpeg")
+    s3.generate_presigned_url("put_object", "1/2.jpeg", 300, ContentType="image/png")
+
+    assert len(s3_client.calls) == 4
+
+
+def test_presigned_url_is_resigned_after_half_its_lifetime(s3_client, monkeypatch):
+    now = 1_000_000.0
+    monkeypatch.setattr(s3.time, "time", lambda: now)
+    first = s3.generate_presigned_url("put_object", "1/2_init.jpeg", 300)
+
+    now += 149
+    assert s3.generate_presigned_url("put_object", "1/2_init.jpeg", 300) == first
+
+    now += 1
+    assert s3.generate_presigned_url("put_object", "1/2_init.jpeg", 300) != first
+
+
+def test_presigned_url_shared_cache(s3_client, settings):
+    settings.PRESIGNED_URL_CACHE_SHARED = True
+    first = s3.generate_presigned_url("get_object", "1/init.jpeg", 900)
+
+    # Another worker has nothing in its own process cache
+    s3.presigned_urls.clear()
+
+    assert s3.generate_presigned_url("get_object", "1/init.jpeg", 900) == first
+    assert len(s3_client.calls) == 1
+
+
+def test_presigned_url_counters_are_published_in_batches(s3_client, monkeypatch):
+    monkeypatch.setattr(s3, "COUNTER_FLUSH_EVERY", 10)
+
+    for _ in range(9):
+        s3.generate_presigned_url("get_object", "1/init.jpeg", 900)
+    assert get_counters()[metrics.PRESIGNED_URL_CACHE_HITS] == 0
+
+    s3.generate_presigned_url("get_object", "1/init.jpeg", 900)
+    assert get_counters()[metrics.PRESIGNED_URL_CACHE_HITS] == 9
+    assert get_counters()[metrics.PRESIGNED_URL_CACHE_MISSES] == 1
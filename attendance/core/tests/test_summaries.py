@@ -0,0 +1,124 @@
+import datetime
+
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from attendance.core.models import Attendance, Session
+from attendance.core.tests.factories import AttendanceFactory, CourseFactory, SessionFactory
+
+NOT_REQUIRED, PENDING, SUCCESS, FAILED = Attendance.FaceRecognitionStatus.values
+
+
+@pytest.fixture
+def sessions(session) -> list[Session]:
+    """Three sessions of the course a day apart, oldest first, the last without check-ins."""
+    sessions = [session, SessionFactory(course_id=session.course_id), SessionFactory(course_id=session.course_id)]
+    now = timezone.now()
+    for days, s in zip((2, 1, 0), sessions):
+        Session.objects.filter(id=s.id).update(start_time=now - datetime.timedelta(days=days))
+
+    for is_present, status in [(True, NOT_REQUIRED), (True, NOT_REQUIRED), (False, PENDING), (False, FAILED)]:
+        AttendanceFactory(session_id=sessions[0], is_present=is_present, face_recognition_status=status)
+    for is_present, status in [(False, SUCCESS), (False, FAILED)]:
+        AttendanceFactory(session_id=sessions[1], is_present=is_present, face_recognition_status=status)
+    # Another teacher's
+    AttendanceFactory(session_id=SessionFactory(course_id=CourseFactory()))
+    return sessions
+
+
+def summaries(rows: list[dict]) -> dict[int, dict]:
+    return {row["id"]: row["summary"] for row in rows}
+
+
+def test_lists_have_no_summaries_unless_requested(teacher_client, sessions):
+    assert all("summary" not in row for row in teacher_client.get(reverse("api:session-list")).json())
+    assert all("summary" not in row for row in teacher_client.get(reverse("api:course-list")).json())
+
+
+def test_session_summaries(teacher_client, sessions):
+    response = teacher_client.get(reverse("api:session-list"), {"summary": "true"})
+
+    assert summaries(response.json()) == {
+        sessions[0].id: {
+            "total": 4,
+            "present": 2,
+            "is_present": {"true": 2, "false": 2},
+            "face_recognition_status": {NOT_REQUIRED: 2, PENDING: 1, SUCCESS: 0, FAILED: 1},
+        },
+        sessions[1].id: {
+            "total": 2,
+            # Accepted by face recognition counts as present, like the course summaries and counters
+            "present": 1,
+            "is_present": {"true": 0, "false": 2},
+            "face_recognition_status": {NOT_REQUIRED: 0, PENDING: 0, SUCCESS: 1, FAILED: 1},
+        },
+        sessions[2].id: {
+            "total": 0,
+            "present": 0,
+            "is_present": {"true": 0, "false": 0},
+            "face_recognition_status": {NOT_REQUIRED: 0, PENDING: 0, SUCCESS: 0, FAILED: 0},
+        },
+    }
+
+
+def test_session_summaries_of_a_page(teacher_client, sessions):
+    response = teacher_client.get(reverse("api:session-list"), {"summary": "1", "page_size": 2})
+
+    # Newest first
+    assert [row["summary"]["total"] for row in response.json()["results"]] == [0, 2]
+
+
+def test_summaries_take_one_query(teacher_client, sessions):
+    for _ in range(3):
+        SessionFactory(course_id=sessions[0].course_id)
+    CourseFactory(teacher_id=sessions[0].course_id.teacher_id)
+
+    for url in (reverse("api:session-list"), reverse("api:course-list")):
+        with CaptureQueriesContext(connection) as plain:
+            teacher_client.get(url)
+        with CaptureQueriesContext(connection) as summarized:
+            teacher_client.get(url, {"summary": "true"})
+
+        assert len(summarized) == len(plain) + 1
+
+
+def test_course_summaries(teacher_client, sessions):
+    other_course = CourseFactory(teacher_id=sessions[0].course_id.teacher_id)
+
+    response = teacher_client.get(reverse("api:course-list"), {"summary": "true"})
+
+    assert summaries(response.json()) == {
+        sessions[0].course_id.id: [
+            {
+                "session_id": sessions[0].id,
+                "start_time": start_time(sessions[0]),
+                "total": 4,
+                "present": 2,
+                "rate": 0.5,
+            },
+            # Accepted by face recognition counts as present
+            {
+                "session_id": sessions[1].id,
+                "start_time": start_time(sessions[1]),
+                "total": 2,
+                "present": 1,
+                "rate": 0.5,
+            },
+            {
+                "session_id": sessions[2].id,
+                "start_time": start_time(sessions[2]),
+                "total": 0,
+                "present": 0,
+                "rate": None,
+            },
+        ],
+        other_course.id: [],
+    }
+
+
+def start_time(session: Session) -> str:
+    session.refresh_from_db()
+    return session.start_time.isoformat().replace("+00:00", "Z")
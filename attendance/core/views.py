@@ -1,5 +1,8 @@
+from django.conf import settings
 from django.core.cache import cache
+from django.db import transaction
 from django.utils import timezone
+from django.utils.decorators import method_decorator
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import exceptions, generics, permissions, viewsets, views
 from rest_framework.decorators import action
@@ -9,16 +12,32 @@ from rest_framework.response import Response
 
 from attendance.users.permissions import IsStudent, IsTeacher
 
-from .models import Attendance, Course, Session
+from .buffer import pending_check_ins
+from .checkin import check_in, mark_checked_in_many
+from .counters import FAILED, PENDING, PRESENT, count_keys, count_transition, get_counts, set_counts, state_of
+from .geofence import contains
+from .models import SESSION_CACHE_KEY, Attendance, Course, Session
+from .pagination import KeysetPagination
 from .serializers import (
     AttendanceCreateSerializer,
     AttendanceImageSerializer,
     AttendanceSerializer,
     CourseSerializer,
+    FlatAttendanceSerializer,
     ImageProcessingCallbackSerializer,
     SessionReadSerializer,
     SessionWriteSerializer,
 )
+from .summaries import course_summaries, session_summaries
+
+
+def query_flag(request: Request, name: str) -> bool:
+    return request.query_params.get(name, "").lower() in ("1", "true")
+
+
+def list_rows(data) -> list:
+    """The rows of a list response's data, paginated or not."""
+    return data["results"] if isinstance(data, dict) else data
 
 
 class CourseModelViewSet(viewsets.ModelViewSet):
@@ -30,6 +49,16 @@ class CourseModelViewSet(viewsets.ModelViewSet):
     def get_queryset(self):
         return Course.objects.filter(teacher_id=self.request.user)
 
+    def list(self, request: Request, *args, **kwargs):
+        response = super().list(request, *args, **kwargs)
+        if query_flag(request, "summary"):
+            # Attendance rates per session, oldest first, for the course dashboards
+            rows = list_rows(response.data)
+            summaries = course_summaries([row["id"] for row in rows])
+            for row in rows:
+                row["summary"] = summaries[row["id"]]
+        return response
+
     def create(self, request: Request, *args, **kwargs):
         request.data["teacher_id"] = request.user.id
         return super().create(request, *args, **kwargs)
@@ -45,7 +74,8 @@ class SessionModelViewSet(viewsets.ModelViewSet):
     filter_backends = (DjangoFilterBackend, OrderingFilter)
     filterset_fields = ("course_id",)
     ordering_fields = ("start_time",)
-    ordering = ("-start_time",)
+    ordering = ("-start_time", "-id")
+    pagination_class = KeysetPagination
 
     def get_queryset(self):
         return Session.objects.filter(course_id__teacher_id=self.request.user)
@@ -55,6 +85,25 @@ class SessionModelViewSet(viewsets.ModelViewSet):
             return SessionReadSerializer
         return SessionWriteSerializer
 
+    def list(self, request: Request, *args, **kwargs):
+        response = super().list(request, *args, **kwargs)
+        if query_flag(request, "summary"):
+            rows = list_rows(response.data)
+            summaries = session_summaries([row["id"] for row in rows])
+            for row in rows:
+                row["summary"] = summaries[row["id"]]
+        return response
+
+    def perform_create(self, serializer):
+        session = serializer.save()
+        transaction.on_commit(lambda: set_counts(session.id, {PRESENT: 0, PENDING: 0, FAILED: 0}))
+
+    def perform_update(self, serializer):
+        session = serializer.save()
+        # The secret doesn't depend on the location, so a running session keeps its tokens
+        if cache.get(SESSION_CACHE_KEY.format(teacher_id=self.request.user.id, session_id=session.id)):
+            session.generate_secret()
+
     @action(detail=True, methods=["post"])
     def end(self, request: Request, pk=None):
         session = self.get_object()
@@ -71,14 +120,74 @@ class SessionModelViewSet(viewsets.ModelViewSet):
         session: Session = self.get_object()
         return Response({"secret": session.generate_secret()})
 
+    @action(detail=True, methods=["get"])
+    def summary(self, request: Request, pk=None):
+        """Present, pending, failed and total check-ins, for the teacher's live session page."""
+        session_key = SESSION_CACHE_KEY.format(teacher_id=request.user.id, session_id=pk)
+        keys = list(count_keys(pk).values())
+        cached = cache.get_many([session_key, *keys])
+        # The secret is cached under the teacher's id, so it proves the session is theirs
+        session_id = int(pk) if session_key in cached else self.get_object().id
+        return Response(get_counts(session_id, cached))
+
+    @action(detail=True, methods=["get"])
+    def geofence_check(self, request: Request, pk=None):
+        """Re-check every located check-in of the session against its current geofence."""
+        session: Session = self.get_object()
+        if session.geometry is None:
+            raise exceptions.ValidationError({"errors": ["Session has no location."]})
+
+        rows = Attendance.objects.filter(session_id=session.id).order_by("id").values_list("id", "latitude", "longitude")
+        located = [row for row in rows if row[1] is not None and row[2] is not None]
+        ids, latitudes, longitudes = zip(*located) if located else ((), (), ())
+        inside = contains(session.geometry, latitudes, longitudes)
+        return Response(
+            {
+                "inside": [id for id, is_inside in zip(ids, inside) if is_inside],
+                "outside": [id for id, is_inside in zip(ids, inside) if not is_inside],
+                "unknown": [row[0] for row in rows if row[1] is None or row[2] is None],
+            }
+        )
+
+
+class FlatAttendanceListMixin(generics.ListAPIView):
+    """
+    Lists attendance with FlatAttendanceSerializer when the request passes
+    ``flat=true``. Each row's session_id is then the session's id, and the
+    sessions of the listed rows are serialized once under "sessions".
+    """
+
+    flat_query_param = "flat"
+
+    def is_flat(self) -> bool:
+        return query_flag(self.request, self.flat_query_param)
+
+    def list(self, request: Request, *args, **kwargs):
+        if not self.is_flat():
+            return super().list(request, *args, **kwargs)
 
-class AttendanceListCreateAPIView(generics.ListCreateAPIView):
+        serializer = FlatAttendanceSerializer()
+        queryset = serializer.values(self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(queryset)
+        rows = serializer.to_representation(queryset if page is None else page)
+        sessions = serializer.sessions([row["session_id"] for row in rows])
+        if page is None:
+            return Response({"sessions": sessions, "results": rows})
+        response = self.get_paginated_response(rows)
+        response.data["sessions"] = sessions
+        return response
+
+
+# Check-in writes a single row, so it does not need the ATOMIC_REQUESTS transaction
+@method_decorator(transaction.non_atomic_requests, name="dispatch")
+class AttendanceListCreateAPIView(FlatAttendanceListMixin, generics.ListCreateAPIView):
     queryset = Attendance.objects.all()
     filter_backends = (DjangoFilterBackend, OrderingFilter)
     permission_classes = (IsTeacher | IsStudent,)
     filterset_fields = ("session_id",)
     ordering_fields = ("created_at",)
-    ordering = ("-created_at",)
+    ordering = ("-created_at", "-id")
+    pagination_class = KeysetPagination
 
     def check_permissions(self, request: Request):
         if request.method == "POST":
@@ -91,9 +200,49 @@ class AttendanceListCreateAPIView(generics.ListCreateAPIView):
         return AttendanceSerializer
 
     def create(self, request: Request, *args, **kwargs):
+        if settings.ATTENDANCE_CHECKIN_FAST_PATH:
+            return Response(check_in(request.user, request.data), status=201)
+
         request.data["student_id"] = request.user.id
         return super().create(request, *args, **kwargs)
 
+    def list(self, request: Request, *args, **kwargs):
+        response = super().list(request, *args, **kwargs)
+        if settings.ATTENDANCE_CHECKIN_WRITE_BEHIND and IsStudent().has_permission(request, self):
+            self.add_pending_check_ins(request, response)
+        return response
+
+    def add_pending_check_ins(self, request: Request, response: Response) -> None:
+        """
+        Show the student their own check-ins that are still waiting to be flushed.
+        They would break a page's size and cursors, so a paginated list has them
+        under "pending" on its first page. The whole list takes them in its order,
+        as they are the newest check-ins.
+        """
+        paginator = KeysetPagination()
+        paginated = paginator.is_paginated(request)
+        pending = []
+        if not (paginated and paginator.cursor_query_param in request.query_params):
+            pending = pending_check_ins(request.user, request.query_params.get("session_id", None))
+        rows = AttendanceSerializer(pending, many=True).data
+        if self.is_flat():
+            listed = {session["id"] for session in response.data["sessions"]}
+            for row in rows:
+                session, row["session_id"] = row["session_id"], row["session_id"]["id"]
+                if session["id"] not in listed:
+                    listed.add(session["id"])
+                    response.data["sessions"].append(session)
+
+        if paginated:
+            response.data["pending"] = rows
+            return
+        _, descending = paginator.get_ordering(request, self.get_queryset(), self)
+        results = list_rows(response.data)
+        if descending:
+            results[:0] = rows
+        else:
+            results.extend(reversed(rows))
+
     def get_queryset(self):
         if IsStudent().has_permission(self.request, self):
             return Attendance.objects.select_related(
@@ -126,14 +275,15 @@ class ImageProcessingCallbackAPIView(generics.CreateAPIView):
         return super().create(request, *args, **kwargs)
 
 
-class AttendanceReportListAPIView(generics.ListAPIView):
+class AttendanceReportListAPIView(FlatAttendanceListMixin, generics.ListAPIView):
     queryset = Attendance.objects.all()
     permission_classes = (IsTeacher,)
     serializer_class = AttendanceSerializer
     filter_backends = (DjangoFilterBackend, OrderingFilter)
     filterset_fields = ("session_id",)
     ordering_fields = ("created_at",)
-    ordering = ("-created_at",)
+    ordering = ("-created_at", "-id")
+    pagination_class = KeysetPagination
 
     def get_queryset(self):
         return Attendance.objects.select_related(
@@ -161,12 +311,35 @@ class AttendanceReportDetailAPIView(generics.RetrieveAPIView):
         )
 
 
+def face_status_queryset(user):
+    attendance = Attendance.objects.values("id", "face_recognition_status", "is_present")
+    if user.role == user.UserRoleChoices.STUDENT:
+        return attendance.filter(student_id=user)
+    return attendance.filter(session_id__course_id__teacher_id=user)
+
+
+class AttendanceFaceStatusAPIView(views.APIView):
+    permission_classes = (IsTeacher | IsStudent,)
+
+    def get(self, request: Request, pk=None):
+        return Response(generics.get_object_or_404(face_status_queryset(request.user), pk=pk))
+
+
 class AttendanceOverrideAPIView(views.APIView):
     def post(self, request: Request, pk=None):
         if not IsTeacher().has_permission(request, Attendance):
             raise exceptions.PermissionDenied()
 
-        attendance = Attendance.objects.get(pk=pk)
+        attendance = (
+            Attendance.objects.select_for_update(of=("self",)).select_related("session_id__course_id").get(pk=pk)
+        )
+        before = state_of(attendance.is_present, attendance.face_recognition_status)
         attendance.face_recognition_status = Attendance.FaceRecognitionStatus.SUCCESS
+        attendance.is_present = True
         attendance.save()
+        count_transition(attendance.session_id_id, before, PRESENT)
+
+        # Reject the student's check-in retries from the cache, as face recognition does
+        check_in = (attendance.session_id.course_id.teacher_id_id, attendance.session_id_id, attendance.student_id_id)
+        transaction.on_commit(lambda: mark_checked_in_many([check_in]))
         return Response(AttendanceSerializer(attendance).data)
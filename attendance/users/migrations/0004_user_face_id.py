@@ -0,0 +1,17 @@
+# Generated by Django 5.0.11 on 2026-10-18 19:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("users", "0003_user_email_whitelisted_domain"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="user",
+            name="face_id",
+            field=models.CharField(blank=True, default="", max_length=36),
+        ),
+    ]
@@ -25,6 +25,8 @@ class User(AbstractUser):
     REQUIRED_FIELDS = []
 
     init_image = models.BooleanField(default=False)
+    # Rekognition FaceId of the init image, when it is indexed into the face collection
+    face_id = models.CharField(max_length=36, blank=True, default="")
 
     objects = UserManager()
 
@@ -1,17 +1,18 @@
-from collections.abc import Sequence
+from collections import abc
 from typing import Any
 
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from factory import Faker, post_generation
+from factory import Faker, Sequence, post_generation
 from factory.django import DjangoModelFactory
 
 
 class UserFactory(DjangoModelFactory):
-    email = Faker("email")
+    email = Sequence(lambda n: f"user{n}@{settings.WHITELISTED_EMAIL_DOMAINS[0]}")
     name = Faker("name")
 
     @post_generation
-    def password(self, create: bool, extracted: Sequence[Any], **kwargs):
+    def password(self, create: bool, extracted: abc.Sequence[Any], **kwargs):
         password = (
             extracted
             if extracted
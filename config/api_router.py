@@ -2,6 +2,7 @@ from django.conf import settings
 from django.urls import path
 from rest_framework.routers import DefaultRouter, SimpleRouter
 from attendance.core.views import (
+    AttendanceFaceStatusAPIView,
     AttendanceListCreateAPIView,
     AttendanceOverrideAPIView,
     AttendanceReportDetailAPIView,
@@ -27,5 +28,18 @@ urlpatterns += [
     path("attendance/report/", AttendanceReportListAPIView.as_view(), name="attendance-report-list"),
     path("attendance/<int:pk>/report/", AttendanceReportDetailAPIView.as_view(), name="attendance-report-detail"),
     path("attendance/<int:pk>/override/", AttendanceOverrideAPIView.as_view(), name="attendance-override"),
+    path("attendance/<int:pk>/face_status/", AttendanceFaceStatusAPIView.as_view(), name="attendance-face-status"),
     path("image-processing-callback/", ImageProcessingCallbackAPIView.as_view(), name="image-processing-callback"),
 ]
+
+if settings.ATTENDANCE_ASYNC_VIEWS:
+    from attendance.core import async_views
+
+    # Served from config.asgi, so the hot endpoints don't hold a worker while they wait on Redis and Postgres
+    urlpatterns = [
+        path("attendance/", async_views.attendance_list_create, name="attendance-list-create"),
+        path("session/<int:pk>/get_secret/", async_views.session_get_secret, name="session-get-secret"),
+        path(
+            "attendance/<int:pk>/face_status/", async_views.attendance_face_status, name="attendance-face-status"
+        ),
+    ] + urlpatterns
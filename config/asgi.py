@@ -0,0 +1,26 @@
+"""
+ASGI config for Attendance Tracking System project.
+
+This module contains the ASGI application used by uvicorn workers, e.g.
+``gunicorn config.asgi -k uvicorn_worker.UvicornWorker``. It should expose a
+module-level variable named ``application``.
+
+Pair it with ``ATTENDANCE_ASYNC_VIEWS=True`` so the hot endpoints run as async
+views, everything else is still served by the sync DRF views in a thread.
+
+"""
+import os
+import sys
+from pathlib import Path
+
+from django.core.asgi import get_asgi_application
+
+# This allows easy placement of apps within the interior
+# attendance directory.
+BASE_DIR = Path(__file__).resolve(strict=True).parent.parent
+sys.path.append(str(BASE_DIR / "attendance"))
+# We defer to a DJANGO_SETTINGS_MODULE already in the environment.
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings.production")
+
+# This application object is used by any ASGI server configured to use this file.
+application = get_asgi_application()
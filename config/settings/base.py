@@ -283,7 +283,12 @@ ACCOUNT_FORMS = {"signup": "attendance.users.forms.UserSignupForm"}
 # django-rest-framework - https://www.django-rest-framework.org/api-guide/settings/
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": ("dj_rest_auth.jwt_auth.JWTCookieAuthentication",),
-    "DEFAULT_RENDERER_CLASSES": ("rest_framework.renderers.JSONRenderer",),
+    "DEFAULT_RENDERER_CLASSES": ("attendance.core.renderers.ORJSONRenderer",),
+    "DEFAULT_PARSER_CLASSES": (
+        "attendance.core.parsers.ORJSONParser",
+        "rest_framework.parsers.FormParser",
+        "rest_framework.parsers.MultiPartParser",
+    ),
     "DEFAULT_PERMISSION_CLASSES": ("rest_framework.permissions.IsAuthenticated",),
     "DEFAULT_SCHEMA_CLASS": "drf_spectacular.openapi.AutoSchema",
     "EXCEPTION_HANDLER": "attendance.core.exception_handler.core_exception_handler",
@@ -317,4 +322,58 @@ REST_AUTH = {
 
 WHITELISTED_EMAIL_DOMAINS = env.list("WHITELISTED_EMAIL_DOMAINS", default=["ucf.edu"])
 
-AWS_REGION = env("AWS_REGION", default="us-east-1")
\ No newline at end of file
+AWS_REGION = env("AWS_REGION", default="us-east-1")
+
+# Attendance check-in
+# ------------------------------------------------------------------------------
+# Serve POST /api/v1/attendance/ through attendance.core.checkin, which returns a flat
+# response instead of AttendanceCreateSerializer's nested one. Only enable it once the
+# clients read the flat shape.
+ATTENDANCE_CHECKIN_FAST_PATH = env.bool("ATTENDANCE_CHECKIN_FAST_PATH", default=False)
+# Queue check-ins that don't need face recognition in a Redis stream and insert them
+# in batches with `manage.py flush_checkins`. Only applies to the fast path. Requires the django-redis cache backend.
+ATTENDANCE_CHECKIN_WRITE_BEHIND = env.bool("ATTENDANCE_CHECKIN_WRITE_BEHIND", default=False)
+# Route check-in, get_secret and face_status to the async views in attendance.core.async_views.
+# Only useful when serving config.asgi, see "Running under ASGI" in the README.
+ATTENDANCE_ASYNC_VIEWS = env.bool("ATTENDANCE_ASYNC_VIEWS", default=False)
+# Share reused presigned S3 URLs between workers through the default cache, on top of
+# the per-process cache in attendance.core.s3.
+PRESIGNED_URL_CACHE_SHARED = env.bool("PRESIGNED_URL_CACHE_SHARED", default=False)
+
+# Face recognition
+# ------------------------------------------------------------------------------
+# How the Rekognition backend matches attendance images with the student's init image:
+# "compare" runs CompareFaces on both images, "collection" indexes the init image into the
+# Rekognition collection REKOGNITION_COLLECTION_ID at enrollment and searches the collection
+# with every attendance image. Students enrolled before switching are compared pairwise.
+FACE_RECOGNITION_MODE = env("FACE_RECOGNITION_MODE", default="compare")
+REKOGNITION_COLLECTION_ID = env("REKOGNITION_COLLECTION_ID", default="attendance-faces")
+# Backend process_sqs_msg compares faces with, see attendance.core.faces.
+# LocalFaceComparator scores face embeddings in-process and needs FACE_EMBEDDER, the import
+# path of a callable that turns image bytes into an embedding vector (None if there is no face),
+# and a cosine similarity threshold that suits its model. No face model ships with the project,
+# one has to be provided; attendance.core.faces.fake_embedder only runs the pipeline offline.
+# Students without an embedding, enrolled before switching, don't match unless
+# FACE_LOCAL_FALLBACK compares them with Rekognition, see "Face recognition backends" in the README.
+FACE_COMPARATOR = env("FACE_COMPARATOR", default="attendance.core.faces.RekognitionFaceComparator")
+FACE_EMBEDDER = env("FACE_EMBEDDER", default="")
+FACE_SIMILARITY_THRESHOLD = env.float("FACE_SIMILARITY_THRESHOLD", default=0.5)
+FACE_LOCAL_FALLBACK = env.bool("FACE_LOCAL_FALLBACK", default=False)
+# Directory of LocalFaceComparator's memory-mapped embedding store, shared by every processor
+# worker on the host. It is a cache of the embeddings saved to S3 and can be deleted at any time.
+FACE_EMBEDDING_STORE = env("FACE_EMBEDDING_STORE", default="/tmp/face-embeddings")
+# Seconds process_sqs_msg remembers an S3 event (bucket, key and version or ETag) it has
+# handled, so a redelivered or duplicate event is skipped instead of compared again.
+S3_EVENT_DEDUP_TTL = env.int("S3_EVENT_DEDUP_TTL", default=24 * 60 * 60)
+# Downscale, orient and strip face images before process_sqs_msg compares them, see
+# attendance.core.images. FACE_IMAGE_ORIGINALS "keep" leaves the upload alone and writes the
+# normalized image under normalized/, "replace" overwrites the upload with it.
+FACE_IMAGE_NORMALIZE = env.bool("FACE_IMAGE_NORMALIZE", default=False)
+FACE_IMAGE_MAX_SIZE = env.int("FACE_IMAGE_MAX_SIZE", default=1280)
+FACE_IMAGE_ORIGINALS = env("FACE_IMAGE_ORIGINALS", default="keep")
+
+# SQS processor
+# ------------------------------------------------------------------------------
+# CloudWatch namespace process_sqs_msg publishes the queue backlog to for autoscaling, as
+# QueueBacklog and Workers metrics per QueueName. Leave empty to not publish them.
+SQS_PROCESSOR_METRICS_NAMESPACE = env("SQS_PROCESSOR_METRICS_NAMESPACE", default="AttendanceBackend")
@@ -30,6 +30,9 @@ data "aws_db_instance" "attendance_db" {
   db_instance_identifier = data.terraform_remote_state.core-infra.outputs.rds-indentifier
 }
 
+# Its event notification to the SQS queue, managed in core-infra, has to filter on the ".jpeg"
+# suffix: process_sqs_msg writes normalized copies (normalized/*.jpg) and face embeddings (*.npy)
+# to this bucket too, and without the filter they come back as invalid keys.
 data "aws_s3_bucket" "attendance_static_bucket" {
   bucket = replace(data.terraform_remote_state.core-infra.outputs.attendance-images-bucket, "arn:aws:s3:::", "")
 }
@@ -118,6 +118,7 @@ resource "aws_iam_policy" "backend_task_policy" {
           "sqs:SendMessage",
           "sqs:ReceiveMessage",
           "sqs:DeleteMessage",
+          "sqs:ChangeMessageVisibility",
           "sqs:GetQueueAttributes",
           "sqs:GetQueueUrl"
         ],
@@ -158,7 +159,18 @@ resource "aws_iam_policy" "backend_task_policy" {
       {
         "Effect" : "Allow"
         "Action" : [
-          "rekognition:CompareFaces"
+          "rekognition:CompareFaces",
+          "rekognition:CreateCollection",
+          "rekognition:IndexFaces",
+          "rekognition:SearchFacesByImage",
+          "rekognition:DeleteFaces"
+        ]
+        "Resource" : "*"
+      },
+      {
+        "Effect" : "Allow"
+        "Action" : [
+          "cloudwatch:PutMetricData"
         ]
         "Resource" : "*"
       }
@@ -20,6 +20,7 @@ locals {
     POSTGRES_DB                       = "${data.aws_db_instance.attendance_db.db_name}",
     POSTGRES_USER                     = "${data.aws_db_instance.attendance_db.master_username}",
     SQS_QUEUE_URL                     = "${data.aws_sqs_queue.attendance_queue.url}",
+    FACE_RECOGNITION_MODE             = var.face_recognition_mode,
   }
 }
 
@@ -65,8 +66,10 @@ resource "aws_ecs_task_definition" "attendance_backend" {
     {
       name      = "${local.app_prefix}-sqs-processor-container"
       image     = "${data.aws_ecr_repository.attendance_backend.repository_url}:${var.image_tag}"
-      command   = ["python", "/app/manage.py", "process_sqs_msg"]
+      command   = ["python", "/app/manage.py", "process_sqs_msg", "--concurrency", tostring(var.sqs_processor_concurrency)]
       essential = true
+      # SIGTERM stops receiving, this leaves time for the long poll and in-flight messages to finish
+      stopTimeout = 45
       restartPolicy = {
         enabled              = true
         restartAttemptPeriod = 120
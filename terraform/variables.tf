@@ -13,3 +13,15 @@ variable "frontend_base_url" {
   default     = "https://ucf.attendance.xhoantran.com"
   description = "The base URL of the frontend application"
 }
+
+variable "sqs_processor_concurrency" {
+  type        = number
+  default     = 8
+  description = "Messages the face recognition processor handles in parallel"
+}
+
+variable "face_recognition_mode" {
+  type        = string
+  default     = "compare"
+  description = "How the processor matches attendance images: pairwise \"compare\" or a Rekognition face \"collection\""
+}